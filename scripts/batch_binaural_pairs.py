@@ -0,0 +1,358 @@
+from dataclasses import dataclass, asdict
+from functools import cached_property
+from datetime import datetime, timezone
+from pathlib import Path
+import csv
+import hashlib
+import json
+import os
+import time
+
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_file, validate_param_file, \
+    check_programming_arguments
+from common import Role, DeviceSession, create_communication_interface, load_product, check_param_file_library, \
+    wait_for_device_address
+from configure_binaural_pair import add_binaural_arguments, program_binaural_half, delete_bond_table
+from metrics import collect_metrics_to
+from param_family import split_variant_path, get_variant_param_file
+from param_file import get_content_hash
+from tracing import trace_step, trace_to_file
+
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'off')
+
+# The steps for each pair, in the order they are run
+STEP_PROGRAM = 'program'
+STEP_DELETE_BONDS = 'delete_bonds'
+
+
+@dataclass(frozen=True)
+class PairJob:
+    pair_id: str
+    central_address: int
+    peripheral_address: int
+    param_file: Path
+    enable_asha: bool = False
+    enable_mfi: bool = False
+    delete_bonds: bool = False
+
+    def get_address(self, role):
+        return self.central_address if role == Role.CENTRAL else self.peripheral_address
+
+    def get_peer_address(self, role):
+        return self.peripheral_address if role == Role.CENTRAL else self.central_address
+
+    def get_steps(self):
+        return [STEP_PROGRAM, STEP_DELETE_BONDS] if self.delete_bonds else [STEP_PROGRAM]
+
+    @cached_property
+    def key(self):
+        """
+        Returns a digest of everything that is programmed for this pair, so a journal entry is
+        only reused if the manifest row (or the contents of its .param file) hasn't changed
+        """
+        row = asdict(self)
+        row['param_file'] = get_content_hash(self.param_file)
+        return hashlib.sha256(json.dumps(row, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def parse_mac_address(value):
+    """Parses a MAC address given as an int or as hex (e.g. '60c0bf123456', '0x60c0bf123456', '60:C0:BF:12:34:56')"""
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().replace(':', '').replace('-', '')
+    if text.lower().startswith('0x'):
+        text = text[2:]
+    return int(text, 16)
+
+
+def parse_flag(value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text == '':
+        return default
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"{value} is not a valid flag (use one of {TRUE_VALUES} or {FALSE_VALUES})")
+
+
+def read_manifest(manifest_file, default_param_file=None, enable_asha=False, enable_mfi=False, delete_bonds=False):
+    """
+    Reads a .csv or .json manifest of pairs to program. Each row has the columns 'pair_id',
+    'central_mac', 'peripheral_mac' and optionally 'param_file' (relative to the manifest, and
+    either a .param file or a FAMILY.pfam#VARIANT),
+    'asha', 'mfi' and 'delete_bonds' (the defaults for the optional columns are the arguments).
+    """
+    manifest_file = Path(manifest_file)
+    if manifest_file.suffix.lower() == '.json':
+        with manifest_file.open() as fp:
+            rows = json.load(fp)
+        if isinstance(rows, dict):
+            rows = rows['pairs']
+    else:
+        with manifest_file.open(newline='') as fp:
+            rows = list(csv.DictReader(fp))
+
+    jobs = []
+    for line, row in enumerate(rows, start=1):
+        row = {k.strip().lower(): v for k, v in row.items() if k is not None}
+        try:
+            param_file = row.get('param_file') or default_param_file
+            if not param_file:
+                raise ValueError("no 'param_file' (and no --param-file given)")
+            param_file, variant = split_variant_path(manifest_file.parent / param_file)
+            if not param_file.is_file():
+                raise ValueError(f"{param_file} is not a valid file path")
+            if variant is not None:
+                param_file = get_variant_param_file(param_file, variant)
+            jobs.append(PairJob(pair_id=str(row['pair_id']).strip(),
+                                central_address=parse_mac_address(row['central_mac']),
+                                peripheral_address=parse_mac_address(row['peripheral_mac']),
+                                param_file=param_file,
+                                enable_asha=parse_flag(row.get('asha'), enable_asha),
+                                enable_mfi=parse_flag(row.get('mfi'), enable_mfi),
+                                delete_bonds=parse_flag(row.get('delete_bonds'), delete_bonds)))
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"{manifest_file}, row {line}: {e}") from e
+
+    pair_ids = [job.pair_id for job in jobs]
+    duplicates = sorted({pair_id for pair_id in pair_ids if pair_ids.count(pair_id) > 1})
+    if duplicates:
+        raise ValueError(f"{manifest_file}: duplicate pair_id(s): {', '.join(duplicates)}")
+    return jobs
+
+
+class Journal:
+    """
+    An append-only log of the completed (and failed) steps of a batch. Every entry is flushed
+    to disk before the next step starts, so after a crash or power loss a rerun can skip all
+    of the steps that had already been completed. A read-only journal (e.g. for --dry-run) is
+    only read, and is not created if it doesn't exist.
+    """
+    def __init__(self, journal_file, read_only=False):
+        self.journal_file = Path(journal_file)
+        self.completed = set()
+        if self.journal_file.exists():
+            with self.journal_file.open('rb') as fp:
+                data = fp.read()
+            for line in data.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partially written entry (e.g. from a power loss) - that step wasn't completed
+                    continue
+                if entry.get('status') == 'done':
+                    self.completed.add((entry['pair_id'], entry['key'], entry['role'], entry['step']))
+            needs_newline = len(data) > 0 and not data.endswith(b'\n')
+        else:
+            needs_newline = False
+        self.fp = None
+        if read_only:
+            return
+        self.fp = self.journal_file.open('a')
+        if needs_newline:
+            self.fp.write('\n')
+
+    def is_done(self, job, role, step):
+        return (job.pair_id, job.key, role.name, step) in self.completed
+
+    def record(self, job, role, step, status, **details):
+        entry = dict(time=datetime.now(timezone.utc).isoformat(timespec='seconds'), pair_id=job.pair_id,
+                     key=job.key, role=role.name, step=step, status=status, **details)
+        self.fp.write(json.dumps(entry) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        if status == 'done':
+            self.completed.add((job.pair_id, entry['key'], role.name, step))
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+
+
+def connect_expected_device(session, expected_address, upgrade_firmware=False):
+    configured_device = session.connect(upgrade_firmware=upgrade_firmware)
+    address = session.mac_address
+    if address != expected_address:
+        session.release()
+        raise RuntimeError(f"Connected to {hex(address)} instead of the expected device ({hex(expected_address)})")
+    return configured_device
+
+
+def run_pair_half(journal, job, role, session, args):
+    """Runs the steps for one half of a pair that aren't already in the journal"""
+    steps = [step for step in job.get_steps() if not journal.is_done(job, role, step)]
+    if not steps:
+        return False
+
+    address = job.get_address(role)
+    if not args.no_prompt:
+        ear = 'LEFT' if role == Role.CENTRAL else 'RIGHT'
+        print(f"[{job.pair_id}] Connect the {ear} / {role.name} device ({hex(address)}) and press Enter when ready: ", end='')
+        input()
+    else:
+        # The previous device may still be attached until the fixture swaps it
+        with trace_step('wait_for_attach', role=role.name):
+            wait_for_device_address(session.interface, session.product, address, timeout=args.attach_timeout)
+
+    step = steps[0]
+    try:
+        configured_device = connect_expected_device(session, address, upgrade_firmware=args.upgrade_firmware)
+        if step == STEP_PROGRAM:
+            print(f"[{job.pair_id}] Programming the {role.name.lower()} ...")
+            with trace_step('program_binaural_half', role=role.name):
+                program_binaural_half(configured_device, job.param_file, job.get_peer_address(role), role,
+                                      enable_asha=job.enable_asha, enable_mfi=job.enable_mfi,
+                                      delta_burn=args.delta_burn, stream_voice_alerts=args.stream_voice_alerts,
+                                      verify_burn=args.verify_burn,
+                                      verify_retries=args.verify_retries, use_snapshot=args.use_snapshot)
+            journal.record(job, role, step, 'done', mac=hex(address))
+            if len(steps) == 1:
+                return True
+            # Still connected to the device after the reset, so continue with deleting the bond table
+            step = steps[1]
+            delete_bond_table(session, reboot_timeout=args.reboot_timeout)
+        else:
+            # Resuming after the device was programmed but before its bonds were deleted
+            with trace_step('clear_bond_table'):
+                configured_device.interface.ClearBondTableOnDevice()
+        print(f"[{job.pair_id}] Deleted the bond table on the {role.name.lower()}")
+        journal.record(job, role, step, 'done', mac=hex(address))
+    except Exception as e:
+        journal.record(job, role, step, 'failed', mac=hex(address), error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        # The next device will be attached in its place
+        session.release()
+    return True
+
+
+def plan_batch(args, jobs, journal):
+    """Returns the planner.Plan of the steps of a batch that aren't already in the journal"""
+    from planner import Plan, ParamFileSummary, add_setup_notes, add_startup_steps, add_connect_steps, \
+        add_program_steps, add_delete_bonds_steps
+
+    plan = Plan(f"program {len(jobs)} pair(s) from {args.manifest}")
+    add_setup_notes(plan, args, get_programmer(args.programmer))
+    plan.notes.append(f"Journal: {journal.journal_file} ({len(journal.completed)} completed step(s))")
+
+    # The halves with steps left to run, grouped by .param file
+    programs = {}
+    connects = deletes = 0
+    for job in jobs:
+        for role in (Role.CENTRAL, Role.PERIPHERAL):
+            steps = [step for step in job.get_steps() if not journal.is_done(job, role, step)]
+            if steps:
+                connects += 1
+            if STEP_PROGRAM in steps:
+                programs[job.param_file] = programs.get(job.param_file, 0) + 1
+            if STEP_DELETE_BONDS in steps:
+                deletes += 1
+
+    add_startup_steps(plan, args)
+    if connects:
+        add_connect_steps(plan, upgrade_firmware=args.upgrade_firmware, repeat=connects)
+    for param_file, count in sorted(programs.items()):
+        summary = ParamFileSummary.read(param_file)
+        plan.notes.append(f"Param file ({count} device(s)): {summary.describe()}")
+        add_program_steps(plan, summary, args, configure_device=False,
+                          overrides=f"{param_file.name}: role, ear, peer address, ASHA and MFi", repeat=count)
+    if deletes:
+        add_delete_bonds_steps(plan, repeat=deletes)
+    return plan
+
+
+def main(argv=None):
+    parser = add_binaural_arguments(get_command_line_parser())
+    parser.add_argument(
+        "manifest",
+        help="A .csv or .json manifest with the columns pair_id, central_mac, peripheral_mac "
+             "and optionally param_file, asha, mfi and delete_bonds",
+        type=validate_file,
+    )
+    parser.add_argument(
+        "--param-file",
+        action="store",
+        default=None,
+        help="Path to the .param file (or FAMILY.pfam#VARIANT) used for the pairs that don't specify one in the manifest",
+        type=validate_param_file,
+    )
+    parser.add_argument(
+        "--journal",
+        action="store",
+        default=None,
+        help="Path to the journal of completed steps (default is the manifest path with a .journal.jsonl suffix)",
+    )
+    parser.add_argument(
+        "--no-prompt",
+        action="store_true",
+        default=False, help="Don't wait for Enter before each device (e.g. when a fixture attaches the devices), "
+                            "wait until the device with the expected MAC address is attached instead"
+    )
+    parser.add_argument(
+        "--attach-timeout",
+        action="store",
+        default=60.0,
+        help="With --no-prompt, how many seconds to wait for each device to be attached before giving up (default 60)",
+        type=float,
+    )
+    args = parser.parse_args(argv)
+    check_programming_arguments(parser, args)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None and not args.dry_run:
+        collect_metrics_to(args.metrics)
+
+    # Use the absolute path for --param-file, as the manifest paths are relative to the manifest
+    jobs = read_manifest(args.manifest, default_param_file=args.param_file.resolve() if args.param_file else None,
+                         enable_asha=args.asha, enable_mfi=args.mfi, delete_bonds=args.delete_bonds)
+    journal_file = args.journal or args.manifest.with_suffix('.journal.jsonl')
+    if args.dry_run:
+        plan_batch(args, jobs, Journal(journal_file, read_only=True)).print()
+        return
+
+    # Fail fast on a mismatched .param file before touching any devices
+    product = load_product(args.product, args.library_file, args.product_index)
+    for param_file in sorted({job.param_file for job in jobs}):
+        check_param_file_library(param_file, product)
+
+    interface = create_communication_interface(get_programmer(args.programmer),
+                                               get_side(args.side),
+                                               interface_options=args.interface_options,
+                                               verify_nvm_writes=args.verify_nvm_writes,
+                                               product_name=args.product)
+    session = DeviceSession(interface, product, args.product)
+
+    journal = Journal(journal_file)
+    print(f"Programming {len(jobs)} pair(s) from {args.manifest} (journal: {journal.journal_file})")
+    start_time = time.perf_counter()
+    programmed = skipped = 0
+    try:
+        for job in jobs:
+            with trace_step('program_pair', pair_id=job.pair_id):
+                # Program the central first, just like configure_binaural_pair.py
+                ran = [run_pair_half(journal, job, role, session, args) for role in (Role.CENTRAL, Role.PERIPHERAL)]
+            if any(ran):
+                programmed += 1
+                print(f"[{job.pair_id}] Done (central: {hex(job.central_address)}, peripheral: {hex(job.peripheral_address)})")
+            else:
+                skipped += 1
+                print(f"[{job.pair_id}] Already done, skipping")
+    except Exception as e:
+        print(f"Stopped at a failed step: {type(e).__name__}: {e}")
+        print("Fix the problem and rerun the same command to resume the batch")
+        raise SystemExit(1)
+    finally:
+        journal.close()
+
+    print(f"\n{programmed} pair(s) programmed and {skipped} already done in {time.perf_counter() - start_time:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmarks parsing .param files: the full json.load() used before, the header-only reader,
+the compiler (from the loaded document and streamed from the file), the compiled param cache
+(cold and warm) and decoding the voice alerts (all at once and streamed). Reports the time and
+the peak memory of each. --synthetic-alerts adds a generated .param file with many large voice
+alerts, to show how each method scales with the size of the file.
+"""
+from pathlib import Path
+import argparse
+import base64
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from cmd_line_args import validate_file
+import param_file
+
+
+def measure(function, repeat):
+    # Time without tracemalloc (it slows allocation down) and measure the peak memory separately
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def full_json_load(path):
+    with path.open() as fp:
+        return json.load(fp)
+
+
+def decode_voice_alerts(path):
+    """Decodes all of the voice alerts at once, the way the SDK loads them from a .param file"""
+    voice_alerts = full_json_load(path).get('voicealerts') or []
+    return b''.join(base64.b64decode(a['encodeddata']) for a in voice_alerts)
+
+
+def stream_voice_alerts(path):
+    """Decodes the voice alerts in chunks into one buffer, the way common.write_voice_alerts() does"""
+    buffer = bytearray()
+    param_file.stream_voice_alerts(path, buffer.extend)
+    return buffer
+
+
+def write_synthetic_param_file(base_path, folder, alert_count, alert_size):
+    """Writes a copy of the given .param file with `alert_count` random voice alerts of `alert_size` bytes"""
+    param_json = full_json_load(base_path)
+    param_json['voicealerts'] = [
+        {'alertindex': i, 'hash': i, 'wavefilename': f"synthetic_{i}.wav",
+         'encodeddata': base64.b64encode(os.urandom(alert_size)).decode('ascii')}
+        for i in range(alert_count)
+    ]
+    path = Path(folder) / f"synthetic_{alert_count}x{alert_size}.param"
+    with path.open('w') as fp:
+        json.dump(param_json, fp, indent=2)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "param_files",
+        nargs="*",
+        default=sorted((Path(__file__).resolve().parent.parent / 'configs').glob('*.param')),
+        help="The .param files to benchmark (default is all of the files in configs/)",
+        type=validate_file,
+    )
+    parser.add_argument(
+        "--repeat",
+        action="store",
+        default=10,
+        help="Number of timed repetitions of each measurement",
+        type=int,
+    )
+    parser.add_argument(
+        "--synthetic-alerts",
+        action="store",
+        default=0,
+        help="Also benchmark a generated copy of the first .param file with this many voice alerts",
+        type=int,
+    )
+    parser.add_argument(
+        "--alert-size",
+        action="store",
+        default=256 * 1024,
+        help="The size in bytes of each generated voice alert",
+        type=int,
+    )
+    args = parser.parse_args(argv)
+
+    methods = [
+        ("json.load (full)", lambda path: full_json_load(path)),
+        ("read_param_header", lambda path: param_file.read_param_header(path)),
+        ("compile (json.load)", lambda path: param_file.compile_param_json(full_json_load(path))),
+        ("compile (streamed)", lambda path: param_file.compile_param_file(path)),
+        ("compile (cold)", lambda path: param_file.load_compiled_param_file(path, use_cache=False)),
+        ("compiled cache (warm)", lambda path: param_file.load_compiled_param_file(path)),
+        ("voice alerts (full)", decode_voice_alerts),
+        ("voice alerts (streamed)", stream_voice_alerts),
+    ]
+
+    with tempfile.TemporaryDirectory() as folder:
+        param_files = list(args.param_files)
+        if args.synthetic_alerts > 0 and param_files:
+            param_files.append(write_synthetic_param_file(param_files[0], folder, args.synthetic_alerts, args.alert_size))
+
+        print(f"{'File':<30} {'Method':<24} {'Time (ms)':>10} {'Peak (KiB)':>11}")
+        for path in param_files:
+            print(f"{path.name:<30} {'(file size)':<24} {'':>10} {path.stat().st_size / 1024:>11.1f}")
+            # Make sure the cache is populated for the warm measurement
+            param_file.load_compiled_param_file(path)
+            for name, method in methods:
+                elapsed, peak = measure(lambda: method(path), args.repeat)
+                print(f"{path.name:<30} {name:<24} {elapsed * 1000:>10.2f} {peak / 1024:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
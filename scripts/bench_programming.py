@@ -0,0 +1,222 @@
+"""
+Throughput benchmarks of the programming flows against the simulated SDK (sim_sdk.py), so the
+effect of changes to the tooling can be measured on any machine without hardware.
+"""
+from pathlib import Path
+import argparse
+import os
+import time
+
+from cmd_line_args import get_programmer, get_side, validate_file, simulate_sdk
+from common import Role, DeviceSession, create_communication_interface, connect_and_configure_device, load_product
+import sim_sdk
+
+PRODUCT = 'E7160SL'
+DEFAULT_PARAM_FILE = Path(__file__).resolve().parent.parent / 'configs' / 'left_only.param'
+
+
+def _interface(programmer='CAA', side='left'):
+    return create_communication_interface(get_programmer(programmer), get_side(side))
+
+
+def bench_configure(args, delta_burn=False, verify_nvm_writes=False, verify_burn=False, stream_voice_alerts=False):
+    from configure_device import configure_from_param_file
+
+    interface = _interface()
+    interface.VerifyNvmWrites = verify_nvm_writes
+    product = load_product(PRODUCT)
+    template = None
+    if delta_burn:
+        # Reprogramming units that already hold the same .param file
+        template = sim_sdk.attach_device(interface.programmer, interface.side)
+        configured_device = connect_and_configure_device(interface, product, PRODUCT)
+        configure_from_param_file(configured_device, args.param_file)
+        configured_device.product.CloseDevice()
+
+    start = time.perf_counter()
+    for _ in range(args.units):
+        sim_sdk.attach_device(interface.programmer, interface.side, template=template)
+        configured_device = connect_and_configure_device(interface, product, PRODUCT)
+        configure_from_param_file(configured_device, args.param_file, delta_burn=delta_burn, verify_burn=verify_burn,
+                                  stream_voice_alerts=stream_voice_alerts)
+        configured_device.product.CloseDevice()
+    return args.units, time.perf_counter() - start
+
+
+def bench_inspect(args, use_snapshot=False):
+    """Inspecting the same unit repeatedly (e.g. in a rework loop), so only the first inspection reads every memory"""
+    from test import inspect_device
+
+    interface = _interface()
+    product = load_product(PRODUCT)
+    sim_sdk.attach_device(interface.programmer, interface.side)
+    start = time.perf_counter()
+    for _ in range(args.units):
+        inspect_device(interface, product, PRODUCT, use_snapshot=use_snapshot)
+    return args.units, time.perf_counter() - start
+
+
+def bench_binaural_pair(args):
+    from configure_binaural_pair import configure_binaural_device
+
+    interface = _interface()
+    session = DeviceSession(interface, load_product(PRODUCT), PRODUCT)
+    start = time.perf_counter()
+    for _ in range(args.units):
+        central = sim_sdk.attach_device(interface.programmer, interface.side)
+        peripheral_address = central.mac + 1
+        configure_binaural_device(session, args.param_file, peripheral_address, Role.CENTRAL, delete_bonds=True)
+        sim_sdk.attach_device(interface.programmer, interface.side, mac=peripheral_address)
+        configure_binaural_device(session, args.param_file, central.mac, Role.PERIPHERAL, delete_bonds=True)
+    return args.units * 2, time.perf_counter() - start
+
+
+def _station_args(args):
+    return argparse.Namespace(verify_nvm_writes=False, product=PRODUCT, library_file=None, product_index=0,
+                              upgrade_firmware=False, param_file=args.param_file,
+                              overrides={}, delta_burn=False,
+                              stream_voice_alerts=False, verify_burn=False, verify_retries=0,
+                              use_snapshot=False, trace=None)
+
+
+def _station_slots(args):
+    from station import Slot
+    return [Slot('CAA' if i < 2 else 'DSP3', 'left' if i % 2 == 0 else 'right', None if i < 4 else f"unit={i}")
+            for i in range(args.slots)]
+
+
+def bench_station_sequential(args):
+    from configure_station import configure_slot
+
+    station_args = _station_args(args)
+    start = time.perf_counter()
+    for slot in _station_slots(args):
+        configure_slot(slot, station_args)
+    return args.slots, time.perf_counter() - start
+
+
+def bench_station_parallel(args):
+    from configure_station import configure_slot
+    from station import run_slots
+
+    results, elapsed = run_slots(configure_slot, _station_slots(args), _station_args(args),
+                                 simulate=args.scale)
+    assert all(r.success for r in results), [r.detail for r in results if not r.success]
+    return args.slots, elapsed
+
+
+OUTDATED_FIRMWARE = '1.14.1000'
+
+
+def _attach_outdated_devices(slots):
+    # Attach them here (inherited by forked workers) and through the environment (spawned workers)
+    os.environ['SD_SDK_SIM_DEVICE_FIRMWARE'] = OUTDATED_FIRMWARE
+    for slot in slots:
+        sim_sdk.detach_device(get_programmer(slot.programmer), get_side(slot.side))
+        sim_sdk.attach_device(get_programmer(slot.programmer), get_side(slot.side),
+                              firmware_version=OUTDATED_FIRMWARE, radio_application_version=OUTDATED_FIRMWARE)
+
+
+def _upgrade_args():
+    return argparse.Namespace(verify_nvm_writes=False, product=PRODUCT, library_file=None, product_index=0,
+                              reboot_timeout=60.0, trace=None)
+
+
+def bench_upgrade_sequential(args):
+    from upgrade_station import upgrade_slot
+
+    slots = _station_slots(args)
+    _attach_outdated_devices(slots)
+    del os.environ['SD_SDK_SIM_DEVICE_FIRMWARE']
+    start = time.perf_counter()
+    for slot in slots:
+        upgrade_slot(slot, _upgrade_args())
+    return args.slots, time.perf_counter() - start
+
+
+def bench_upgrade_parallel(args):
+    from station import run_slots
+    from upgrade_station import upgrade_slot
+
+    slots = _station_slots(args)
+    _attach_outdated_devices(slots)
+    try:
+        results, elapsed = run_slots(upgrade_slot, slots, _upgrade_args(), simulate=args.scale)
+    finally:
+        del os.environ['SD_SDK_SIM_DEVICE_FIRMWARE']
+    assert all(r.success for r in results), [r.detail for r in results if not r.success]
+    return args.slots, elapsed
+
+
+BENCHMARKS = {
+    'configure': lambda args: bench_configure(args),
+    'configure-delta': lambda args: bench_configure(args, delta_burn=True),
+    'configure-verify-nvm': lambda args: bench_configure(args, verify_nvm_writes=True),
+    'configure-verify-burn': lambda args: bench_configure(args, verify_burn=True),
+    'configure-stream-alerts': lambda args: bench_configure(args, stream_voice_alerts=True),
+    'inspect': lambda args: bench_inspect(args),
+    'inspect-snapshot': lambda args: bench_inspect(args, use_snapshot=True),
+    'binaural-pair': bench_binaural_pair,
+    'station-sequential': bench_station_sequential,
+    'station-parallel': bench_station_parallel,
+    'upgrade-sequential': bench_upgrade_sequential,
+    'upgrade-parallel': bench_upgrade_parallel,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        default=None,
+        help=f"Which benchmarks to run (default is all of {list(BENCHMARKS)})",
+    )
+    parser.add_argument(
+        "--scale",
+        action="store",
+        default=0.1,
+        help="Scale all of the simulated latencies by this factor",
+        type=float,
+    )
+    parser.add_argument(
+        "--units",
+        action="store",
+        default=3,
+        help="Number of units (or pairs) to program in the sequential benchmarks",
+        type=int,
+    )
+    parser.add_argument(
+        "--slots",
+        action="store",
+        default=4,
+        help="Number of programmer slots in the station benchmarks",
+        type=int,
+    )
+    parser.add_argument(
+        "--param-file",
+        action="store",
+        default=DEFAULT_PARAM_FILE,
+        help="The .param file to program",
+        type=validate_file,
+    )
+    args = parser.parse_args(argv)
+    for name in args.benchmarks or []:
+        if name not in BENCHMARKS:
+            parser.error(f"Unknown benchmark: {name} (choose from {list(BENCHMARKS)})")
+    simulate_sdk(args.scale)
+
+    # The flows print their progress as they go, so collect the results for one table at the end
+    rows = []
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"Running {name}...", flush=True)
+        rows.append((name,) + BENCHMARKS[name](args))
+
+    print(f"\nSimulated latency scale: {args.scale}")
+    print(f"{'Benchmark':<24} {'Units':>5} {'Time (s)':>9} {'s/unit':>7} {'Units/hour':>11}")
+    for name, units, elapsed in rows:
+        print(f"{name:<24} {units:>5} {elapsed:>9.2f} {elapsed / units:>7.2f} {units * 3600.0 / elapsed:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
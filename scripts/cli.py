@@ -0,0 +1,51 @@
+"""
+A single entry point for the scripts in this folder: `cli.py COMMAND [ARGS...]` runs the main()
+of the script for COMMAND with ARGS. Only that script is imported, and the SDK is only loaded
+once a device operation runs, so --help, argument errors and --dry-run return without paying
+for the SDK (or for the scripts of the other commands).
+"""
+from pathlib import Path
+import argparse
+import importlib
+import sys
+
+# The script (module) and a short description of each command
+COMMANDS = {
+    'confirm': ('confirm_sdk', "Confirm that the SDK can be found and loaded"),
+    'configure': ('configure_device', "Program a device from a .param file"),
+    'station': ('configure_station', "Program the devices on several programmer slots in parallel"),
+    'binaural': ('configure_binaural_pair', "Program a binaural pair"),
+    'batch': ('batch_binaural_pairs', "Program the binaural pairs in a manifest (resumable)"),
+    'test': ('test', "Connect to a device and read all of its parameters"),
+    'upgrade': ('upgrade_station', "Upgrade the firmware on several programmer slots in parallel"),
+    'tune': ('tune_interface', "Find the fastest reliable interface options for this station"),
+    'validate': ('validate_params', "Validate .param files against the product definition"),
+    'family': ('param_family', "Pack, unpack, list and diff .pfam families of .param files"),
+    'daemon': ('programming_daemon', "Run the programming daemon that keeps the SDK loaded"),
+    'metrics': ('metrics', "Report the step percentiles and throughput collected with --metrics"),
+}
+
+
+def get_cli_parser():
+    commands = '\n'.join(f"  {name:<12}{description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        description="Utility scripts using the Sound Designer SDK",
+        epilog=f"commands:\n{commands}\n\nRun '%(prog)s COMMAND --help' for the options of a command. "
+               f"'configure', 'station', 'binaural' and 'batch' accept --dry-run.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", metavar="COMMAND", choices=COMMANDS, help="The command to run (see below)")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="The arguments of the command")
+    return parser
+
+
+def main(argv=None):
+    args = get_cli_parser().parse_args(argv)
+    module_name, _ = COMMANDS[args.command]
+    # So the command's parser shows 'cli.py COMMAND' in its usage and errors
+    sys.argv[0] = f"{Path(sys.argv[0]).name} {args.command}"
+    importlib.import_module(module_name).main(args.args)
+
+
+if __name__ == '__main__':
+    main()
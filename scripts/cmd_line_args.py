@@ -19,6 +19,15 @@ def validate_file(value):
 
     return path_value
 
+def validate_param_file(value):
+    """Like validate_file(), but also accepts FAMILY.pfam#VARIANT (see param_family.py), which is rebuilt as a .param file"""
+    from param_family import split_variant_path, get_variant_param_file
+
+    family_file, variant = split_variant_path(value)
+    if variant is None:
+        return validate_file(value)
+    return get_variant_param_file(validate_file(family_file), variant)
+
 def get_side(value):
     side = value.upper()
     if side == 'LEFT':
@@ -40,6 +49,100 @@ def get_programmer(value):
     raise ValueError(f"Unknown programmer: {programmer}")
 
 
+def get_parameter_override(value):
+    """Parses '[MEMORY:]NAME=VALUE' where MEMORY is 'system' (the default) or a memory index"""
+    target, separator, parameter_value = value.partition('=')
+    if not separator or not target:
+        raise ValueError(f"{value} is not of the form [MEMORY:]NAME=VALUE")
+    memory, _, name = target.rpartition(':')
+    if memory == '' or memory.lower() == 'system':
+        memory = 'system'
+    else:
+        memory = int(memory)
+    return (memory, name.strip()), parameter_value.strip()
+
+
+def simulate_sdk(value):
+    import sim_sdk
+
+    scale = float(value)
+    sim_sdk.install(scale=scale)
+    return scale
+
+
+def add_library_arguments(parser, help="Path to the .library file to use (if different than the product default)"):
+    parser.add_argument(
+        "--library-file",
+        action="store",
+        default=None,
+        help=help,
+        type=validate_file,
+    )
+    parser.add_argument(
+        "--product-index",
+        action="store",
+        default=0,
+        help="Index of the product in the library file",
+        type=int,
+    )
+    return parser
+
+
+def check_programming_arguments(parser, args):
+    """Fails before any device is touched if the options added by add_programming_arguments() can't be used"""
+    # The daemon checks this itself, as it may be simulating the SDK
+    if args.stream_voice_alerts and args.simulate is None and getattr(args, 'daemon', None) is None:
+        parser.error("--stream-voice-alerts is only supported with --simulate (the voice alert memory it writes "
+                     "hasn't been checked on a real device)")
+
+
+def add_programming_arguments(parser):
+    """The options of the programming flow (common.program_from_param_file())"""
+    parser.add_argument(
+        "--delta-burn",
+        action="store_true",
+        default=False, help="Only burn the memories whose parameters differ from what is already on the device"
+    )
+    parser.add_argument(
+        "--use-snapshot",
+        action="store_true",
+        default=False, help="Sync the parameters from the device's cached snapshot when its system memory still "
+                            "matches, instead of reading every memory (and cache a snapshot of the device). "
+                            "Not used with --delta-burn, which always compares against every memory read from the device"
+    )
+    parser.add_argument(
+        "--stream-voice-alerts",
+        action="store_true",
+        default=False, help="Decode the voice alerts from the .param file in chunks and write them directly, instead "
+                            "of having the SDK load them (keeps the memory use low with large voice alerts). Only "
+                            "supported with --simulate until the voice alert memory it writes is checked on a real device"
+    )
+    parser.add_argument(
+        "--verify-burn",
+        action="store_true",
+        default=False, help="After burning, read all of the parameters back in one pass and compare them "
+                            "(a cheaper alternative to --verify-nvm-writes)"
+    )
+    parser.add_argument(
+        "--verify-retries",
+        action="store",
+        default=0,
+        help="With --verify-burn, how many times to rewrite the memories with parameters that differ",
+        type=int,
+    )
+    return parser
+
+
+def add_dry_run_argument(parser):
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False, help="Resolve the paths, read the .param files and print the planned steps with estimated "
+                            "costs, without loading the SDK or touching a device"
+    )
+    return parser
+
+
 def get_command_line_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -79,5 +182,41 @@ def get_command_line_parser():
     parser.add_argument(
         "--verify-nvm-writes", action="store_true", default=False, help="Verify all NVM writes"
     )
+    parser.add_argument(
+        "--daemon",
+        action="store",
+        nargs="?",
+        const="default",
+        default=None,
+        metavar="ADDRESS",
+        help="Submit the device operations to a running programming_daemon.py (optionally at the given address) "
+             "instead of loading the SDK in this process",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store",
+        default=None,
+        metavar="TRACE_FILE",
+        help="Time each step and write a Chrome trace / Perfetto compatible .json file (plus a summary table)",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store",
+        default=os.environ.get('SD_SDK_UTILS_METRICS'),
+        metavar="METRICS_FILE",
+        help="Add the duration and result of each step to a Prometheus textfile (.prom) or a SQLite database "
+             "(.db) for fleet monitoring (or set 'SD_SDK_UTILS_METRICS' in your environment, see metrics.py)",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store",
+        nargs="?",
+        const="1.0",
+        default=None,
+        metavar="LATENCY_SCALE",
+        help="Use the simulated SDK and devices in sim_sdk.py instead of real hardware "
+             "(optionally scaling all of the simulated latencies)",
+        type=simulate_sdk,
+    )
 
     return parser
\ No newline at end of file
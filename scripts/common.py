@@ -1,7 +1,13 @@
 from pathlib import Path
 import os
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
 from enum import IntEnum
 
+from tracing import trace_step, set_trace_metadata
+
 class Role(IntEnum):
     CENTRAL = 0
     PERIPHERAL = 1
@@ -12,53 +18,713 @@ class Ear(IntEnum):
 
 
 def connect_and_configure_device(communication_interface, product, product_name, upgrade_firmware=False):
-    from sd_sdk_python import sd
-    from sd_sdk_python.sd_sdk import Ezairo
+    return DeviceSession(communication_interface, product, product_name).connect(upgrade_firmware=upgrade_firmware)
 
-    device_info = communication_interface.DetectDevice()
-    assert device_info is not None and device_info.IsValid
 
-    compatibility = product.Definition.GetDeviceCompatibility(communication_interface)
+@dataclass
+class DeviceState:
+    """What a DeviceSession knows about a device it has connected to"""
+    device_info: object
+    compatibility: int
 
-    if upgrade_firmware:
-        if compatibility in (sd.kUnknownCompatibility, sd.kIncompatible):
-            raise RuntimeError("Don't know how to upgrade the firmware on this device!")
-        if compatibility == sd.kCompatibleUpToDate and device_info.FirmwareVersion == product.Definition.UpdateFirmwareVersion and \
-                                                       device_info.RadioApplicationVersion == product.Definition.UpdateRadioApplicationVersion:
-            print(f"Skipping firmware update as it is already up to date (FW: {device_info.FirmwareVersion}, Radio: {device_info.RadioApplicationVersion})")
-        else:
-            print(f"Upgrading firmware from {device_info.FirmwareVersion}/{device_info.RadioApplicationVersion} to {product.Definition.UpdateFirmwareVersion}/{product.Definition.UpdateRadioApplicationVersion}")
-            print("This will take a few minutes...")
-            update_log = product.Definition.UpdateDevice(communication_interface)
-            device_info_after = communication_interface.DetectDevice()
-            assert device_info_after is not None and device_info_after.IsValid
-            if device_info_after.FirmwareVersion != product.Definition.UpdateFirmwareVersion:
-                raise RuntimeError(f"Firmware update failed! Expected version {product.Definition.UpdateFirmwareVersion} but got {device_info_after.FirmwareVersion}!")
-            if device_info_after.RadioApplicationVersion != product.Definition.UpdateRadioApplicationVersion:
-                raise RuntimeError(f"Radio update failed! Expected version {product.Definition.UpdateRadioApplicationVersion} but got {device_info_after.RadioApplicationVersion}!")
-            print("Firmware update complete!")
-            device_info = device_info_after
-    else:
-        if compatibility != sd.kCompatibleUpToDate:
+
+class DeviceSession:
+    """
+    Connects to the device attached to a communication interface and keeps the connection open
+    between steps. The device info and firmware compatibility of every device it has connected
+    to are cached by MAC address, so connecting again (to a re-attached device, or after a
+    reset) skips the steps whose results cannot have changed.
+    """
+    def __init__(self, communication_interface, product, product_name):
+        self.interface = communication_interface
+        self.product = product
+        self.product_name = product_name
+        self.devices = {}
+        self.configured_device = None
+        # The SDK's DeviceInfo of the connected device, as detected (the Ezairo converts its
+        # device_info to the snake_case sd_sdk.DeviceInfo)
+        self.device_info = None
+
+    @property
+    def mac_address(self):
+        """The MAC address of the connected device (or None if not connected)"""
+        return None if self.configured_device is None else int(self.product.DeviceMACAddress, 16)
+
+    def connect(self, upgrade_firmware=False):
+        """
+        Returns an Ezairo for the attached device, reusing the open connection if there is one and
+        the same device still responds (e.g. a job may have left it open before the device was swapped)
+        """
+        if self.configured_device is not None:
+            if self._is_connected_device_attached():
+                return self.configured_device
+            self.release()
+        with trace_step('connect_device', upgrade_firmware=upgrade_firmware):
+            return self._connect(upgrade_firmware)
+
+    def _is_connected_device_attached(self):
+        with trace_step('detect_device'):
+            try:
+                device_info = self.interface.DetectDevice()
+            except Exception:
+                return False
+        known = self.device_info
+        return device_info is not None and device_info.IsValid and \
+            (device_info.SerialId, device_info.HybridSerial) == (known.SerialId, known.HybridSerial)
+
+    def _connect(self, upgrade_firmware):
+        from sd_sdk_python import sd
+        from sd_sdk_python.sd_sdk import Ezairo
+
+        with trace_step('detect_device'):
+            device_info = self.interface.DetectDevice()
+        assert device_info is not None and device_info.IsValid
+
+        compatibility = None
+        if upgrade_firmware:
+            # The upgrade has to happen before the device is initialized
+            compatibility = self._check_compatibility()
+            device_info, upgraded = update_device_firmware(self.interface, self.product, device_info, compatibility)
+            if upgraded:
+                compatibility = sd.kCompatibleUpToDate
+
+        assert device_info.FirmwareId == self.product_name
+
+        with trace_step('initialize_device'):
+            initialized = self.product.InitializeDevice(self.interface)
+        if not initialized:
+            print("Configuring device...")
+            invalidate_device_snapshot(self.product.DeviceMACAddress)
+            with trace_step('configure_device'):
+                self.product.ConfigureDevice()
+
+        assert device_info.LibraryId == self.product.Definition.LibraryId
+        assert device_info.ProductId == self.product.Definition.ProductId
+
+        mac_address = int(self.product.DeviceMACAddress, 16)
+        if compatibility is None:
+            # The compatibility only changes with the firmware on the device
+            known = self.devices.get(mac_address)
+            if known is not None and known.device_info.FirmwareVersion == device_info.FirmwareVersion and \
+                    known.device_info.RadioApplicationVersion == device_info.RadioApplicationVersion:
+                compatibility = known.compatibility
+            else:
+                compatibility = self._check_compatibility()
+        self.devices[mac_address] = DeviceState(device_info, compatibility)
+
+        set_trace_metadata(product=self.product_name,
+                           library_id=self.product.Definition.LibraryId,
+                           device_firmware_version=device_info.FirmwareVersion,
+                           device_radio_application_version=device_info.RadioApplicationVersion,
+                           library_firmware_version=self.product.Definition.UpdateFirmwareVersion,
+                           library_radio_application_version=self.product.Definition.UpdateRadioApplicationVersion)
+        if not upgrade_firmware and compatibility != sd.kCompatibleUpToDate:
             print(f"Warning: firmware on the device is not the same.")
             print(f"Device:  FW: {device_info.FirmwareVersion}, Radio: {device_info.RadioApplicationVersion}")
-            print(f"Library: FW: {product.Definition.UpdateFirmwareVersion}, Radio: {product.Definition.UpdateRadioApplicationVersion}")
+            print(f"Library: FW: {self.product.Definition.UpdateFirmwareVersion}, Radio: {self.product.Definition.UpdateRadioApplicationVersion}")
+
+        self.device_info = device_info
+        self.configured_device = Ezairo(sd, self.interface, device_info, self.product)
+        return self.configured_device
+
+    def reconnect_after_reset(self, timeout=30.0):
+        """
+        Waits for the connected device to come back after a reset and initializes it again
+        (it is the same device, so it isn't detected and checked from scratch). Returns the
+        number of seconds the reboot took.
+        """
+        assert self.configured_device is not None, "Not connected to a device"
+        with trace_step('wait_for_device'):
+            _, reboot_time = wait_for_device(self.interface, timeout=timeout)
+        with trace_step('initialize_device'):
+            assert self.product.InitializeDevice(self.interface)
+        return reboot_time
+
+    def release(self):
+        """Closes the connection (e.g. before another device is attached), but keeps what is known about the device"""
+        if self.configured_device is not None:
+            self.product.CloseDevice()
+            self.configured_device = None
+            self.device_info = None
+
+    def _check_compatibility(self):
+        with trace_step('firmware_compatibility_check'):
+            return self.product.Definition.GetDeviceCompatibility(self.interface)
+
+
+def is_firmware_up_to_date(device_info, compatibility, definition):
+    from sd_sdk_python import sd
+
+    return compatibility == sd.kCompatibleUpToDate and \
+           device_info.FirmwareVersion == definition.UpdateFirmwareVersion and \
+           device_info.RadioApplicationVersion == definition.UpdateRadioApplicationVersion
+
+
+def update_device_firmware(communication_interface, product, device_info, compatibility, reboot_timeout=60.0):
+    """
+    Upgrades the firmware and radio application of a detected device to the versions in the
+    product's library (unless they are already up to date) and verifies both versions after
+    the device reboots. Returns the (new) device info and whether the device was upgraded.
+    """
+    from sd_sdk_python import sd
+
+    if compatibility in (sd.kUnknownCompatibility, sd.kIncompatible):
+        raise RuntimeError("Don't know how to upgrade the firmware on this device!")
+    if is_firmware_up_to_date(device_info, compatibility, product.Definition):
+        print(f"Skipping firmware update as it is already up to date (FW: {device_info.FirmwareVersion}, Radio: {device_info.RadioApplicationVersion})")
+        return device_info, False
+
+    print(f"Upgrading firmware from {device_info.FirmwareVersion}/{device_info.RadioApplicationVersion} to {product.Definition.UpdateFirmwareVersion}/{product.Definition.UpdateRadioApplicationVersion}")
+    print("This will take a few minutes...")
+    with trace_step('update_device', from_version=device_info.FirmwareVersion,
+                    to_version=product.Definition.UpdateFirmwareVersion):
+        update_log = product.Definition.UpdateDevice(communication_interface)
+    with trace_step('wait_for_device'):
+        device_info_after, reboot_time = wait_for_device(communication_interface, timeout=reboot_timeout)
+    if device_info_after.FirmwareVersion != product.Definition.UpdateFirmwareVersion:
+        raise RuntimeError(f"Firmware update failed! Expected version {product.Definition.UpdateFirmwareVersion} but got {device_info_after.FirmwareVersion}!")
+    if device_info_after.RadioApplicationVersion != product.Definition.UpdateRadioApplicationVersion:
+        raise RuntimeError(f"Radio update failed! Expected version {product.Definition.UpdateRadioApplicationVersion} but got {device_info_after.RadioApplicationVersion}!")
+    print(f"Firmware update complete! (the device rebooted in {reboot_time:.1f}s)")
+    return device_info_after, True
+
+
+def wait_for_device(communication_interface, timeout=30.0, initial_delay=0.5, poll_interval=0.25,
+                    backoff=1.5, max_poll_interval=1.0):
+    """
+    Polls DetectDevice() (e.g. while a device reboots after a reset) until a valid device
+    responds, backing off between attempts. Returns the device info and the number of seconds
+    it took, or raises TimeoutError once `timeout` seconds have passed.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    time.sleep(initial_delay)
+    last_error = None
+    while True:
+        try:
+            device_info = communication_interface.DetectDevice()
+            if device_info is not None and device_info.IsValid:
+                return device_info, time.monotonic() - start
+        except Exception as e:
+            # Most programmers raise while the device is not responding yet
+            last_error = e
 
-    assert device_info.FirmwareId == product_name
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"No device detected after {timeout:.1f}s") from last_error
+        time.sleep(min(poll_interval, remaining))
+        poll_interval = min(poll_interval * backoff, max_poll_interval)
 
-    if not product.InitializeDevice(communication_interface):
-        print("Configuring device...")
-        product.ConfigureDevice()
 
-    assert device_info.LibraryId == product.Definition.LibraryId
-    assert device_info.ProductId == product.Definition.ProductId
-    return Ezairo(sd, communication_interface, device_info, product)
+def wait_for_device_address(communication_interface, product, mac_address, timeout=60.0, poll_interval=1.0):
+    """
+    Polls until the device with the given MAC address (an int) is attached to a communication
+    interface, e.g. while a fixture swaps the devices, by initializing whatever device responds
+    to read its MAC address. Returns the number of seconds it took, or raises TimeoutError once
+    `timeout` seconds have passed.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    while True:
+        found = None
+        try:
+            wait_for_device(communication_interface, timeout=max(deadline - time.monotonic(), 0), initial_delay=0)
+            product.InitializeDevice(communication_interface)
+            found = int(product.DeviceMACAddress, 16)
+        except Exception:
+            # No device yet (or it was detached again)
+            pass
+        if found == mac_address:
+            return time.monotonic() - start
 
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            attached = "no device is attached" if found is None else f"{hex(found)} is attached"
+            raise TimeoutError(f"{hex(mac_address)} was not attached after {timeout:.1f}s ({attached})")
+        time.sleep(min(poll_interval, remaining))
 
-def create_communication_interface(programmer, side, interface_options=None, verify_nvm_writes=False):
+
+def create_communication_interface(programmer, side, interface_options=None, verify_nvm_writes=False, product_name=None):
+    """
+    Creates a communication interface. Without interface options, the options that tune_interface.py
+    found to be fastest for this programmer and product (if it has been run on this station) are used.
+    """
     from sd_sdk_python import get_product_manager
 
-    product_manager = get_product_manager()
-    interface = product_manager.CreateCommunicationInterface(programmer, side, '' if interface_options is None else interface_options)
+    if interface_options is None and product_name is not None:
+        interface_options = get_tuned_interface_options(programmer, product_name)
+    set_trace_metadata(programmer=programmer)
+    if product_name is not None:
+        set_trace_metadata(product=product_name)
+    with trace_step('create_communication_interface', programmer=programmer, interface_options=interface_options):
+        product_manager = get_product_manager()
+        interface = product_manager.CreateCommunicationInterface(programmer, side, '' if interface_options is None else interface_options)
     interface.VerifyNvmWrites = verify_nvm_writes
     return interface
+
+
+def get_cache_dir(*parts):
+    """Returns (and creates) a folder for locally cached data (set 'SD_SDK_UTILS_CACHE_DIR' to override)"""
+    if 'SD_SDK_UTILS_CACHE_DIR' in os.environ:
+        cache_dir = Path(os.environ['SD_SDK_UTILS_CACHE_DIR'])
+    elif 'LOCALAPPDATA' in os.environ:
+        cache_dir = Path(os.environ['LOCALAPPDATA']) / 'sd_sdk_utils'
+    else:
+        cache_dir = Path.home() / '.cache' / 'sd_sdk_utils'
+    cache_dir = cache_dir.joinpath(*parts)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def get_tuned_interface_options_path():
+    return get_cache_dir() / 'interface_options.json'
+
+
+def read_tuned_interface_options():
+    """Returns {'PROGRAMMER/PRODUCT': {'interface_options': ..., ...}} as saved by tune_interface.py"""
+    try:
+        with get_tuned_interface_options_path().open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_tuned_interface_options(programmer, product_name):
+    """Returns the tuned interface options for a programmer and product (or None if they were never tuned)"""
+    entry = read_tuned_interface_options().get(f"{programmer}/{product_name}")
+    return None if entry is None else entry['interface_options']
+
+
+def save_tuned_interface_options(programmer, product_name, interface_options, **details):
+    path = get_tuned_interface_options_path()
+    tuned = read_tuned_interface_options()
+    tuned[f"{programmer}/{product_name}"] = dict(interface_options=interface_options, **details)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with temp_path.open('w') as fp:
+        json.dump(tuned, fp, indent=2)
+    os.replace(temp_path, path)
+    return path
+
+
+def get_library_path(product_name, library_file=None):
+    if library_file is not None:
+        return str(library_file)
+    sdk_root = Path(os.environ['SD_SDK_ROOT'])
+    return str(sdk_root / f"products/{product_name}.library")
+
+
+def load_product(product_name, library_file=None, product_index=0):
+    from sd_sdk_python import get_product_manager
+
+    set_trace_metadata(product=product_name)
+    with trace_step('load_product', product=product_name):
+        product_manager = get_product_manager()
+        library = product_manager.LoadLibraryFromFile(get_library_path(product_name, library_file))
+        return library.Products[product_index].CreateProduct()
+
+
+def check_param_file_library(param_file, product, overrides=None):
+    from param_file import read_param_header
+    from validate_params import check_param_file
+
+    # Confirm that the .library referenced in the .param file is the same as the product library specified
+    param_header = read_param_header(param_file)
+    assert param_header["libraryid"] == product.Definition.LibraryId, "The library ID in the .param file does not match the product library!"
+
+    # Check every parameter against the product definition before any device is touched
+    with trace_step('validate_param_file'):
+        check_param_file(param_file, product, overrides)
+
+
+def get_parameter_value(sd, param):
+    """Returns the typed value of an SDK parameter (mirrors Ezairo.get_parameter_value)"""
+    if param.Type == sd.kBoolean:
+        return param.BooleanValue
+    if param.Type == sd.kDouble:
+        return param.DoubleValue
+    return param.Value
+
+
+def get_memory_parameters(configured_device, memory):
+    if memory == configured_device.sd.kSystemNvmMemory:
+        return configured_device.product.SystemMemory.Parameters
+    return configured_device.product.Memories[memory].Parameters
+
+
+def get_all_parameter_values(configured_device):
+    """
+    Returns {memory: {name: value}} for system memory and every NVM memory, as currently held
+    in the SDK's in-memory parameter set (call restore_all_parameters() first to get the
+    device state).
+    """
+    sd = configured_device.sd
+    memories = [sd.kSystemNvmMemory] + list(range(len(configured_device.product.Memories)))
+    return {memory: {p.Id: get_parameter_value(sd, p) for p in get_memory_parameters(configured_device, memory)}
+            for memory in memories}
+
+
+@dataclass
+class DeltaBurnResult:
+    memories_written: int = 0
+    memories_skipped: int = 0
+    parameters_changed: int = 0
+    parameter_writes_skipped: int = 0
+
+    def __str__(self):
+        return f"{self.parameters_changed} changed parameter(s) in {self.memories_written} memories burned, " \
+               f"skipped {self.parameter_writes_skipped} parameter writes in {self.memories_skipped} unchanged memories"
+
+
+def burn_changed_parameters(configured_device, device_values):
+    """
+    Burns only the memories whose parameters differ from `device_values` (the result of
+    get_all_parameter_values() taken right after restore_all_parameters() read every memory
+    from the device, never from a snapshot).
+
+    The SDK writes a whole memory at a time, so any memory containing at least one changed
+    parameter is burned completely and unchanged memories are skipped entirely.
+    """
+    sd = configured_device.sd
+    result = DeltaBurnResult()
+    for memory, values in device_values.items():
+        parameters = get_memory_parameters(configured_device, memory)
+        changed = sum(1 for p in parameters if values.get(p.Id) != get_parameter_value(sd, p))
+        if changed:
+            configured_device.product.WriteParameters(memory)
+            result.memories_written += 1
+            result.parameters_changed += changed
+        else:
+            result.memories_skipped += 1
+            result.parameter_writes_skipped += len(parameters)
+    return result
+
+
+def set_parameter_value(sd, param, value):
+    """Sets the typed value of an SDK parameter (mirrors Ezairo.set_parameter_value)"""
+    if param.Type == sd.kBoolean:
+        param.BooleanValue = value
+    elif param.Type == sd.kDouble:
+        param.DoubleValue = value
+    else:
+        param.Value = value
+
+
+def apply_parameter_overrides(configured_device, overrides):
+    """
+    Sets parameter `overrides` ({(memory, name): value}, where memory is 'system' or a memory
+    index and the value may be a string from the command line) in the SDK's in-memory parameter
+    set, e.g. right after a .param file is loaded, so they are burned with the rest of the parameters
+    """
+    from param_file import SYSTEM_MEMORY, TYPE_INTEGER, TYPE_BOOLEAN, TYPE_DOUBLE, coerce_value
+
+    sd = configured_device.sd
+    for (memory, name), value in overrides.items():
+        parameters = get_memory_parameters(configured_device, sd.kSystemNvmMemory if memory == SYSTEM_MEMORY else memory)
+        param = next((p for p in parameters if p.Id == name), None)
+        if param is None:
+            raise ValueError(f"{memory}:{name}: unknown parameter")
+        value_type = {sd.kBoolean: TYPE_BOOLEAN, sd.kDouble: TYPE_DOUBLE}.get(param.Type, TYPE_INTEGER)
+        value = coerce_value(value_type, value)
+        set_parameter_value(sd, param, bool(value) if value_type == TYPE_BOOLEAN
+                            else value if value_type == TYPE_DOUBLE else int(value))
+
+
+def _normalize_value(value):
+    # Doubles can come back from the device slightly different than they were written
+    return float(f"{value:.6g}") if isinstance(value, float) else value
+
+
+def get_memory_digest(values):
+    """Returns a SHA-256 digest of the {name: value} of one memory"""
+    digest = hashlib.sha256()
+    for name in sorted(values):
+        digest.update(f"{name}={_normalize_value(values[name])!r}\n".encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class VerificationResult:
+    parameters_verified: int = 0
+    # The digest of all of the verified parameters (e.g. for a traceability record)
+    digest: str = ""
+    # (memory, name, expected, actual) of every parameter that still differs
+    mismatches: list = field(default_factory=list)
+    memories_rewritten: int = 0
+
+    def __str__(self):
+        if self.mismatches:
+            return f"{len(self.mismatches)} of {self.parameters_verified} parameter(s) differ on the device"
+        rewritten = f" after rewriting {self.memories_rewritten} memory(s)" if self.memories_rewritten else ""
+        return f"all {self.parameters_verified} parameters match{rewritten} (digest {self.digest[:16]})"
+
+
+def verify_burned_parameters(configured_device, retries=0):
+    """
+    Verifies a burn by reading every memory back from the device in one pass and comparing it
+    with the parameter values that were burned (the SDK's in-memory parameter set) by digest.
+    Only the memories whose digests differ are compared parameter by parameter, and with
+    `retries` those memories are written (the SDK writes a whole memory at a time) and read
+    back again. This replaces per-write verification (VerifyNvmWrites).
+    """
+    sd = configured_device.sd
+    expected_values = get_all_parameter_values(configured_device)
+    expected_digests = {memory: get_memory_digest(values) for memory, values in expected_values.items()}
+    overall_digest = hashlib.sha256()
+    for memory in expected_values:
+        overall_digest.update(f"{memory}:{expected_digests[memory]}\n".encode())
+    result = VerificationResult(parameters_verified=sum(len(v) for v in expected_values.values()),
+                                digest=overall_digest.hexdigest())
+
+    memories = list(expected_values)
+    for attempt in range(retries + 1):
+        with trace_step('read_back_parameters', attempt=attempt):
+            for memory in memories:
+                configured_device.product.ReadParameters(memory)
+        differing = []
+        for memory in memories:
+            parameters = get_memory_parameters(configured_device, memory)
+            actual = {p.Id: get_parameter_value(sd, p) for p in parameters}
+            if get_memory_digest(actual) != expected_digests[memory]:
+                differing.append((memory, parameters, actual))
+        result.mismatches = [(memory, name, expected, actual.get(name))
+                             for memory, _, actual in differing
+                             for name, expected in expected_values[memory].items()
+                             if _normalize_value(expected) != _normalize_value(actual.get(name))]
+        if not differing or attempt == retries:
+            break
+
+        # Put the expected values back and rewrite only the memories that differ
+        with trace_step('rewrite_parameters', memories=len(differing)):
+            for memory, parameters, _ in differing:
+                for p in parameters:
+                    set_parameter_value(sd, p, expected_values[memory][p.Id])
+                configured_device.product.WriteParameters(memory)
+        result.memories_rewritten += len(differing)
+        memories = [memory for memory, _, _ in differing]
+    return result
+
+
+def check_burned_parameters(configured_device, retries=0):
+    """Runs verify_burned_parameters() and raises RuntimeError naming the parameters that differ"""
+    result = verify_burned_parameters(configured_device, retries=retries)
+    if result.mismatches:
+        system_memory = configured_device.sd.kSystemNvmMemory
+        listed = [f"{'system' if memory == system_memory else memory}:{name}: expected {expected}, read {actual}"
+                  for memory, name, expected, actual in result.mismatches[:20]]
+        if len(result.mismatches) > len(listed):
+            listed.append(f"... and {len(result.mismatches) - len(listed)} more")
+        raise RuntimeError(f"Verification failed, {result}:\n  " + "\n  ".join(listed))
+    return result
+
+
+# The signature of each product definition, by id() (along with the product, so the id isn't reused)
+_library_signatures = {}
+
+
+def get_library_signature(product):
+    """
+    Returns a digest of the library ID and the name and type of every parameter of a product,
+    which changes whenever a different library (or library version) is used
+    """
+    known = _library_signatures.get(id(product))
+    if known is not None and known[0] is product:
+        return known[1]
+    digest = hashlib.sha256(f"{product.Definition.LibraryId}\n".encode())
+    for memory in [product.SystemMemory] + list(product.Memories):
+        digest.update(''.join(f"{p.Id}:{p.Type}\n" for p in memory.Parameters).encode())
+        digest.update(b'--\n')
+    _library_signatures[id(product)] = (product, digest.hexdigest())
+    return _library_signatures[id(product)][1]
+
+
+def _snapshot_path(mac_address):
+    return get_cache_dir('snapshots') / f"{mac_address.lower()}.json"
+
+
+def get_snapshot_key(configured_device):
+    """What a device snapshot is only valid for: the device, its firmware and the product library"""
+    # The Ezairo's device_info is the snake_case sd_sdk.DeviceInfo, not the SDK's DeviceInfo
+    return dict(mac_address=configured_device.product.DeviceMACAddress.lower(),
+                firmware_version=configured_device.device_info.firmware_version,
+                radio_application_version=configured_device.device_info.radio_application_version,
+                library_signature=get_library_signature(configured_device.product))
+
+
+def read_device_snapshot(configured_device):
+    """Returns the snapshot {memory: {name: value}} of the connected device (or None if there is no valid one)"""
+    try:
+        with _snapshot_path(configured_device.product.DeviceMACAddress).open() as fp:
+            snapshot = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('key') != get_snapshot_key(configured_device):
+        return None
+    return {int(memory): values for memory, values in snapshot['memories'].items()}
+
+
+def save_device_snapshot(configured_device):
+    """Saves the SDK's in-memory parameter set as the snapshot of the connected device (it must match the device)"""
+    path = _snapshot_path(configured_device.product.DeviceMACAddress)
+    snapshot = dict(key=get_snapshot_key(configured_device),
+                    memories={str(memory): values for memory, values in get_all_parameter_values(configured_device).items()})
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with temp_path.open('w') as fp:
+        json.dump(snapshot, fp)
+    os.replace(temp_path, path)
+
+
+def invalidate_device_snapshot(mac_address):
+    """Deletes the snapshot of a device (before anything is written to it)"""
+    _snapshot_path(mac_address).unlink(missing_ok=True)
+
+
+def restore_all_parameters(configured_device, use_snapshot=False):
+    """
+    Syncs all of the parameters from the device, like configured_device.restore_all_parameters().
+    With `use_snapshot`, only the system memory is read (as a fingerprint) when the device has a
+    snapshot, and if it matches the snapshot the NVM memories are taken from the snapshot instead
+    of being read. Otherwise the NVM memories are read too and saved as the new snapshot. Returns
+    whether the snapshot was used.
+    """
+    if not use_snapshot:
+        configured_device.restore_all_parameters()
+        return False
+
+    sd = configured_device.sd
+    product = configured_device.product
+    snapshot = read_device_snapshot(configured_device)
+    with trace_step('read_fingerprint'):
+        product.ReadParameters(sd.kSystemNvmMemory)
+    if snapshot is not None:
+        system = {p.Id: get_parameter_value(sd, p) for p in product.SystemMemory.Parameters}
+        if get_memory_digest(system) == get_memory_digest(snapshot.get(sd.kSystemNvmMemory, {})):
+            with trace_step('apply_snapshot'):
+                for memory in range(len(product.Memories)):
+                    values = snapshot[memory]
+                    for p in product.Memories[memory].Parameters:
+                        set_parameter_value(sd, p, values[p.Id])
+            return True
+
+    with trace_step('read_memories'):
+        for memory in range(len(product.Memories)):
+            product.ReadParameters(memory)
+    save_device_snapshot(configured_device)
+    return False
+
+
+def write_voice_alerts(configured_device, param_file):
+    """
+    Writes the voice alerts of a .param file. They are decoded from the file in chunks, straight
+    into one buffer the size of the device's voice alert memory, so the base64 text is never held
+    in memory. Returns the VoiceAlertEntry of each voice alert (or None if the file has no voice
+    alerts).
+
+    The decoded alerts are written back to back in file order, which is the layout sim_sdk.py
+    gives LoadParamFile(). It hasn't been checked against the SDK's LoadParamFile(), so this is
+    only allowed with the simulated SDK (see check_stream_voice_alerts()).
+    """
+    from param_file import stream_voice_alerts
+
+    capacity = configured_device.product.ReadVoiceAlertsTotalMemory()
+    buffer = memoryview(bytearray(capacity))
+    length = 0
+
+    def write_chunk(chunk):
+        nonlocal length
+        if length + len(chunk) > capacity:
+            raise ValueError(f"The voice alerts in {param_file} do not fit in the {capacity} bytes of voice alert memory")
+        buffer[length:length + len(chunk)] = chunk
+        length += len(chunk)
+
+    with trace_step('decode_voice_alerts'):
+        voice_alerts = stream_voice_alerts(param_file, write_chunk)
+    if voice_alerts is not None:
+        with trace_step('write_voice_alerts', bytes=length):
+            # The SDK binding expects bytes
+            configured_device.write_voice_alert_data(bytes(buffer[:length]))
+    return voice_alerts
+
+
+def check_stream_voice_alerts():
+    """Raises RuntimeError unless the voice alerts can be streamed (see write_voice_alerts())"""
+    import sim_sdk
+
+    if not sim_sdk.is_installed():
+        raise RuntimeError("--stream-voice-alerts is only supported with --simulate, the voice alert memory it writes "
+                           "hasn't been checked against the SDK's LoadParamFile() on a real device")
+
+
+def load_param_file_data(configured_device, param_file, configure_device, stream_voice_alerts=False):
+    """
+    Loads a .param file into the product (see Ezairo.load_param_file()), writing the
+    manufacturer data and voice alerts. With `stream_voice_alerts` the voice alerts are
+    written by write_voice_alerts() instead of the SDK.
+    """
+    invalidate_device_snapshot(configured_device.product.DeviceMACAddress)
+    configured_device.load_param_file(str(param_file),
+                                      configure_device=configure_device,
+                                      write_manufacturer_data=True,
+                                      write_voice_alerts=not stream_voice_alerts)
+    if stream_voice_alerts:
+        write_voice_alerts(configured_device, param_file)
+
+
+def program_from_param_file(configured_device, param_file, configure_device, overrides=None, delta_burn=False,
+                            stream_voice_alerts=False, verify_burn=False, verify_retries=0, use_snapshot=False):
+    """
+    Programs a connected device from the given .param file and resets it: the programming flow
+    shared by configure_device.py and configure_binaural_pair.py. Without `configure_device` the
+    device isn't configured (just the parameters, voice alerts and manufacturer data are burned).
+    Parameter `overrides` (see apply_parameter_overrides()) are burned together with the .param
+    file. Returns a list of notes about the writes that were skipped (for the caller to report).
+    """
+    if stream_voice_alerts:
+        # Before anything is written to the device
+        check_stream_voice_alerts()
+    configured_device.interface.MuteDuringCommunication = False
+    with trace_step('mute'):
+        configured_device.mute()
+
+    with trace_step('select_memory'):
+        # Configure for a pure tone input signal
+        configured_device.set_input_signal_type(configured_device.sd.kPureTone)
+        # Switch to memory 1
+        configured_device.set_current_memory(configured_device.sd.kNvmMemory1)
+    # Sync all parameters from the device. A delta burn always reads every memory: with a stale snapshot
+    # (e.g. another tool changed an NVM memory but not the system memory) a memory that differs on the
+    # device would look unchanged and not be burned.
+    notes = []
+    with trace_step('restore_all_parameters'):
+        if restore_all_parameters(configured_device, use_snapshot=use_snapshot and not delta_burn):
+            notes.append("Snapshot: synced the parameters from the snapshot (only the system memory was read)")
+    device_values = get_all_parameter_values(configured_device) if delta_burn else None
+
+    # Load the parameters from the param file (and configure the device)
+    with trace_step('load_param_file'):
+        load_param_file_data(configured_device, param_file, configure_device=configure_device,
+                             stream_voice_alerts=stream_voice_alerts)
+    if overrides:
+        with trace_step('apply_overrides', overrides=len(overrides)):
+            apply_parameter_overrides(configured_device, overrides)
+
+    if device_values is not None:
+        with trace_step('burn_changed_parameters'):
+            notes.append(f"Delta burn: {burn_changed_parameters(configured_device, device_values)}")
+    else:
+        with trace_step('burn_all_parameters'):
+            configured_device.burn_all_parameters()
+
+    if verify_burn:
+        with trace_step('verify_burn'):
+            notes.append(f"Verified: {check_burned_parameters(configured_device, retries=verify_retries)}")
+        if use_snapshot:
+            # Every memory was just read back and matches
+            save_device_snapshot(configured_device)
+
+    with trace_step('unmute'):
+        configured_device.unmute()
+
+    # Reset the device (this must be the last thing we do as the device will disconnect)
+    with trace_step('reset'):
+        configured_device.reset()
+    return notes
@@ -1,84 +1,144 @@
 from pathlib import Path
-import os
-import json
-import time
 
-from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_file
-from common import Role, Ear, create_communication_interface, connect_and_configure_device
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_param_file, add_library_arguments, \
+    add_programming_arguments, add_dry_run_argument, check_programming_arguments
+from common import Role, Ear, DeviceSession, create_communication_interface, load_product, check_param_file_library, \
+                   program_from_param_file
+from metrics import collect_metrics_to
+from tracing import trace_step, trace_to_file
 import argparse
 
 
 def program_binaural_half(configured_device, param_file : Path, peer_address : int,
-                          role : Role, enable_asha=True, enable_mfi=True):
-    configured_device.interface.MuteDuringCommunication = False
-
-    configured_device.mute()
-
-    # Configure for a pure tone input signal
-    configured_device.set_input_signal_type(configured_device.sd.kPureTone)
-
-    # Switch to memory 1
-    configured_device.set_current_memory(configured_device.sd.kNvmMemory1)
-
-    # Sync all parameters from the device
-    configured_device.restore_all_parameters()
-
-    # Load the parameters from the param file, but don't configure
-    # (just burn the voice alerts and manufacturing data)
-    configured_device.load_param_file(str(param_file),
-                                      configure_device=False,
-                                      write_manufacturer_data=True,
-                                      write_voice_alerts=True)
-
-    # Override the peer address
-    if role == Role.CENTRAL:
-        configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_RoleSelect', Role.CENTRAL.value)
-        configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_FWK_Ear', Ear.LEFT.value)
-    else:
-        configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_RoleSelect', Role.PERIPHERAL.value)
-        configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_FWK_Ear', Ear.RIGHT.value)
-
-    configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_BinauralPeerAddress2', peer_address & 0xFFFFFF)
-    configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_BinauralPeerAddress1', peer_address >> 24)
-
-    configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_ASHAEnable', 1 if enable_asha else 0)
-    configured_device.set_parameter_value(configured_device.sd.kSystemNvmMemory, 'X_RF_MFiEnable', 1 if enable_mfi else 0)
-
-    configured_device.burn_all_parameters()
-
-    configured_device.unmute()
-
-    # Reset the device (this must be the last thing we do as the device will disconnect)
-    configured_device.reset()
-
-def main():
-    parser = get_command_line_parser()
+                          role : Role, enable_asha=True, enable_mfi=True, delta_burn=False, stream_voice_alerts=False,
+                          verify_burn=False, verify_retries=0, use_snapshot=False):
+    # Load the parameters from the param file, but don't configure (just burn the voice alerts and
+    # manufacturing data). The role, ear, peer address and ASHA/MFi settings override the loaded
+    # parameters, so they are burned together with the rest of the system memory.
+    overrides = get_binaural_overrides(peer_address, role, enable_asha, enable_mfi)
+    notes = program_from_param_file(configured_device, param_file, configure_device=False, overrides=overrides,
+                                    delta_burn=delta_burn, stream_voice_alerts=stream_voice_alerts, verify_burn=verify_burn,
+                                    verify_retries=verify_retries, use_snapshot=use_snapshot)
+    for note in notes:
+        print(note)
+
+
+def get_binaural_overrides(peer_address, role, enable_asha, enable_mfi):
+    """Returns the system parameter overrides for one half of a binaural pair"""
+    return {
+        ('system', 'X_RF_RoleSelect'): role.value,
+        ('system', 'X_FWK_Ear'): (Ear.LEFT if role == Role.CENTRAL else Ear.RIGHT).value,
+        ('system', 'X_RF_BinauralPeerAddress2'): peer_address & 0xFFFFFF,
+        ('system', 'X_RF_BinauralPeerAddress1'): peer_address >> 24,
+        ('system', 'X_RF_ASHAEnable'): 1 if enable_asha else 0,
+        ('system', 'X_RF_MFiEnable'): 1 if enable_mfi else 0,
+    }
+
+
+def delete_bond_table(session, reboot_timeout=30.0):
+    print("Waiting for a reboot...")
+    # Wait for the device to come back and then re-connect and delete the bond table
+    reboot_time = session.reconnect_after_reset(timeout=reboot_timeout)
+    print(f"Device rebooted in {reboot_time:.1f}s")
+    with trace_step('clear_bond_table'):
+        session.interface.ClearBondTableOnDevice()
+
+
+def read_device_address(session, upgrade_firmware=False):
+    """Returns the MAC address of the attached device (leaving the session connected to it)"""
+    session.connect(upgrade_firmware=upgrade_firmware)
+    return session.mac_address
+
+
+def configure_binaural_device(session, param_file, peer_address, role, enable_asha=True, enable_mfi=True,
+                              delete_bonds=False, upgrade_firmware=False, delta_burn=False, stream_voice_alerts=False,
+                              verify_burn=False, verify_retries=0, use_snapshot=False, reboot_timeout=30.0):
+    """
+    Programs (and optionally deletes the bond table of) one half of a pair, reusing the session's
+    connection if it is still open, and returns its MAC address
+    """
+    try:
+        configured_device = session.connect(upgrade_firmware=upgrade_firmware)
+        address = session.mac_address
+        with trace_step('program_binaural_half', role=role.name):
+            program_binaural_half(configured_device, param_file, peer_address,
+                                  role, enable_asha=enable_asha, enable_mfi=enable_mfi, delta_burn=delta_burn,
+                                  stream_voice_alerts=stream_voice_alerts,
+                                  verify_burn=verify_burn, verify_retries=verify_retries, use_snapshot=use_snapshot)
+        if delete_bonds:
+            delete_bond_table(session, reboot_timeout=reboot_timeout)
+            print(f"Deleted the bond table on the {role.name.lower()}")
+    finally:
+        session.release()
+    return address
+
+
+def add_binaural_arguments(parser):
     parser.add_argument(
         "--upgrade-firmware",
         action="store_true",
         default=False, help="Upgrade the firmware on the device if it is not the same"
     )
+    add_library_arguments(parser)
     parser.add_argument(
-        "--param-file",
-        action="store",
-        default=None,
-        help="Path to the base .param file used to program the devices",
-        required=True,
-        type=validate_file,
+        "--asha",
+        action=argparse.BooleanOptionalAction,
+        default=False, help="Enable ASHA on the device",
+    )
+    parser.add_argument(
+        "--mfi",
+        action=argparse.BooleanOptionalAction,
+        default=False, help="Enable MFi on the device",
     )
     parser.add_argument(
-        "--library-file",
+        "--delete-bonds",
+        action="store_true",
+        default=False, help="When specified, delete the bond table on both devices"
+    )
+    parser.add_argument(
+        "--reboot-timeout",
         action="store",
-        default=None,
-        help="Path to the .library file to use (if different than the product default)",
-        type=validate_file,
+        default=30.0,
+        help="How long to wait (in seconds) for a device to come back after a reset before giving up",
+        type=float,
     )
+    add_programming_arguments(parser)
+    return add_dry_run_argument(parser)
+
+
+def plan_binaural_pair(args):
+    """Returns the planner.Plan of programming a pair from args.param_file"""
+    from planner import Plan, ParamFileSummary, add_setup_notes, add_startup_steps, add_connect_steps, \
+        add_program_steps, add_delete_bonds_steps
+
+    summary = ParamFileSummary.read(args.param_file)
+    plan = Plan(f"program a binaural pair from {args.param_file}")
+    add_setup_notes(plan, args, get_programmer(args.programmer))
+    plan.notes.append(f"Param file: {summary.describe()}")
+    add_startup_steps(plan, args)
+    connects = 2
+    if args.peripheral_address is None:
+        plan.add('read_device_address', "auto-detects the peripheral", detect=1, initialize=1, compatibility=1)
+        if args.central_address is not None:
+            # The peripheral is programmed over the same connection
+            connects = 1
+    add_connect_steps(plan, upgrade_firmware=args.upgrade_firmware, repeat=connects)
+    add_program_steps(plan, summary, args, configure_device=False, overrides="role, ear, peer address, ASHA and MFi",
+                      repeat=2)
+    if args.delete_bonds:
+        add_delete_bonds_steps(plan, repeat=2)
+    return plan
+
+
+def main(argv=None):
+    parser = add_binaural_arguments(get_command_line_parser())
     parser.add_argument(
-        "--product-index",
+        "--param-file",
         action="store",
-        default=0,
-        help="Index of the product in the library file",
-        type=int,
+        default=None,
+        help="Path to the base .param file used to program the devices (or FAMILY.pfam#VARIANT, see param_family.py)",
+        required=True,
+        type=validate_param_file,
     )
     parser.add_argument(
         "--central-address",
@@ -94,103 +154,95 @@ def main():
         help="Manually specify the peripheral's MAC address (default is to auto-detect)",
         type=lambda x: int(x, 0),
     )
-    parser.add_argument(
-        "--asha",
-        action=argparse.BooleanOptionalAction,
-        default=False, help="Enable ASHA on the device",
-    )
-    parser.add_argument(
-        "--mfi",
-        action=argparse.BooleanOptionalAction,
-        default=False, help="Enable MFi on the device",
-    )
-    parser.add_argument(
-        "--delete-bonds",
-        action="store_true",
-        default=False, help="When specified, delete the bond table on both devices"
-    )
-
-    args = parser.parse_args()
-
-    interface = create_communication_interface(get_programmer(args.programmer),
-                                               get_side(args.side),
-                                               interface_options=args.interface_options,
-                                               verify_nvm_writes=args.verify_nvm_writes)
 
-    from sd_sdk_python import get_product_manager
-    product_manager = get_product_manager()
-    sdk_root = Path(os.environ['SD_SDK_ROOT'])
-    library_path = str(sdk_root / f"products/{args.product}.library") if args.library_file is None else str(args.library_file)
-    library = product_manager.LoadLibraryFromFile(library_path)
-    product = library.Products[args.product_index].CreateProduct()
-
-    # Confirm that the .library referenced in the .param file is the same as the product library specified
-    with args.param_file.open() as fp:
-        param_json = json.load(fp)
-        assert param_json["libraryid"] == product.Definition.LibraryId, "The library ID in the .param file does not match the product library!"
+    args = parser.parse_args(argv)
+    check_programming_arguments(parser, args)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None and not args.dry_run:
+        collect_metrics_to(args.metrics)
+
+    if args.dry_run:
+        plan_binaural_pair(args).print()
+        return
+
+    if args.daemon is not None:
+        from programming_daemon import submit_job, get_device_job_args
+        job_args = get_device_job_args(args)
+
+        def read_address(keep_connected=False):
+            return submit_job(args.daemon, 'read_device_address', upgrade_firmware=args.upgrade_firmware,
+                              keep_connected=keep_connected, **job_args)
+
+        def configure(peer_address, role):
+            return submit_job(args.daemon, 'configure_binaural_device', param_file=str(args.param_file.resolve()),
+                              peer_address=peer_address, role=role, enable_asha=args.asha, enable_mfi=args.mfi,
+                              delete_bonds=args.delete_bonds, upgrade_firmware=args.upgrade_firmware,
+                              delta_burn=args.delta_burn, stream_voice_alerts=args.stream_voice_alerts,
+                              verify_burn=args.verify_burn,
+                              verify_retries=args.verify_retries, use_snapshot=args.use_snapshot,
+                              reboot_timeout=args.reboot_timeout, **job_args)
+    else:
+        interface = create_communication_interface(get_programmer(args.programmer),
+                                                   get_side(args.side),
+                                                   interface_options=args.interface_options,
+                                                   verify_nvm_writes=args.verify_nvm_writes,
+                                                   product_name=args.product)
+
+        product = load_product(args.product, args.library_file, args.product_index)
+        check_param_file_library(args.param_file, product)
+        session = DeviceSession(interface, product, args.product)
+
+        def read_address(keep_connected=False):
+            address = read_device_address(session, upgrade_firmware=args.upgrade_firmware)
+            if not keep_connected:
+                session.release()
+            return address
+
+        def configure(peer_address, role):
+            return configure_binaural_device(session, args.param_file, peer_address, role,
+                                             enable_asha=args.asha, enable_mfi=args.mfi, delete_bonds=args.delete_bonds,
+                                             upgrade_firmware=args.upgrade_firmware, delta_burn=args.delta_burn,
+                                             stream_voice_alerts=args.stream_voice_alerts, verify_burn=args.verify_burn,
+                                             verify_retries=args.verify_retries, use_snapshot=args.use_snapshot,
+                                             reboot_timeout=args.reboot_timeout)
 
     peripheral_address = args.peripheral_address
+    peripheral_programmed = False
     if peripheral_address is None:
         # Auto-deteect the peripheral address
         print("Unplug everything except for the desired RIGHT / PERIPHERAL device and press Enter when ready: ", end='')
         input()
-        peripheral = connect_and_configure_device(interface, product, args.product, upgrade_firmware=args.upgrade_firmware)
-        peripheral_address = int(peripheral.product.DeviceMACAddress, 16)
-        peripheral.product.CloseDevice()
+        # When the central address is known, program the peripheral over the same connection
+        peripheral_address = read_address(keep_connected=args.central_address is not None)
+        if args.central_address is not None:
+            print("Programming the RIGHT / PERIPHERAL device ...")
+            configure(args.central_address, Role.PERIPHERAL)
+            peripheral_programmed = True
 
     print(f"Peripheral MAC: {hex(peripheral_address)}")
 
     print("Unplug everything except for the desired LEFT / CENTRAL device and press Enter when ready: ", end='')
     input()
 
-    central = connect_and_configure_device(interface, product, args.product, upgrade_firmware=args.upgrade_firmware)
-    central_address = int(central.product.DeviceMACAddress, 16)
+    # Program the Central
+    print("Programming the LEFT / CENTRAL device ...")
+    central_address = configure(peripheral_address, Role.CENTRAL)
     if args.central_address is not None and central_address != args.central_address:
         print(f"Warning! The detected central address ({hex(central_address)}) is different than the one specified ({args.central_address})!")
         print(f"(Used the one specified on the command line: {args.central_address})")
     print(f"Central MAC: {hex(central_address)}")
-
-    # Program the Central
-    print("Programming the LEFT / CENTRAL device ...")
-    program_binaural_half(central, args.param_file, peripheral_address,
-                          Role.CENTRAL, enable_asha=args.asha, enable_mfi=args.mfi)
-    if args.delete_bonds:
-        print("Waiting for a reboot...")
-        # Wait and then re-connect and delete the bond table
-        time.sleep(5.0)
-        device_info = central.interface.DetectDevice()
-        assert device_info is not None and device_info.IsValid
-        assert product.InitializeDevice(central.interface)
-        central.interface.ClearBondTableOnDevice()
-        print("Deleted the bond table on the central")
-
-    central.product.CloseDevice()
+    if peripheral_programmed:
+        return
 
     print("Power off the central and power on the RIGHT / PERIPHERAL device and press Enter when ready: ", end='')
     input()
 
     print("Programming the RIGHT / PERIPHERAL device ...")
-    peripheral = connect_and_configure_device(interface, product, args.product, upgrade_firmware=args.upgrade_firmware)
-
-    if args.peripheral_address is not None:
-        peripheral_address = int(peripheral.product.DeviceMACAddress, 16)
-        if args.peripheral_address != peripheral_address:
-            print(f"Warning! The detected peripheral address ({hex(peripheral_address)}) is different than the one specified ({args.peripheral_address})!")
-            print(f"(Used the one specified on the command line: {args.peripheral_address})")
-
-    program_binaural_half(peripheral, args.param_file, central_address,
-                          Role.PERIPHERAL, enable_asha=args.asha, enable_mfi=args.mfi)
-    if args.delete_bonds:
-        print("Waiting for a reboot...")
-        # Wait and then re-connect and delete the bond table
-        time.sleep(5.0)
-        device_info = peripheral.interface.DetectDevice()
-        assert device_info is not None and device_info.IsValid
-        assert product.InitializeDevice(peripheral.interface)
-        peripheral.interface.ClearBondTableOnDevice()
-        print("Deleted the bond table peripheral")
-
-    peripheral.product.CloseDevice()
+    detected_peripheral_address = configure(central_address, Role.PERIPHERAL)
+    if args.peripheral_address is not None and args.peripheral_address != detected_peripheral_address:
+        print(f"Warning! The detected peripheral address ({hex(detected_peripheral_address)}) is different than the one specified ({args.peripheral_address})!")
+        print(f"(Used the one specified on the command line: {args.peripheral_address})")
 
 
 if __name__ == '__main__':
@@ -1,13 +1,14 @@
-from pathlib import Path
-import os
-import json
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_param_file, \
+    get_parameter_override, add_library_arguments, add_programming_arguments, add_dry_run_argument, \
+    check_programming_arguments
+from common import create_communication_interface, connect_and_configure_device, load_product, check_param_file_library, \
+                   program_from_param_file
+from metrics import collect_metrics_to
+from param_file import apply_overrides, load_compiled_param_file
+from tracing import trace_step, trace_to_file
 
-from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_file
-from common import create_communication_interface, connect_and_configure_device
 
-
-def main():
-    parser = get_command_line_parser()
+def add_configure_arguments(parser):
     parser.add_argument(
         "--upgrade-firmware",
         action="store_true",
@@ -17,70 +18,114 @@ def main():
         "--param-file",
         action="store",
         default=None,
-        help="Path to the base .param file used to program the devices",
+        help="Path to the base .param file used to program the devices (or FAMILY.pfam#VARIANT, see param_family.py)",
         required=True,
-        type=validate_file,
+        type=validate_param_file,
     )
+    add_library_arguments(parser)
+    add_programming_arguments(parser)
     parser.add_argument(
-        "--library-file",
-        action="store",
-        default=None,
-        help="Path to the .library file to use (if different than the product default)",
-        type=validate_file,
-    )
-    parser.add_argument(
-        "--product-index",
-        action="store",
-        default=0,
-        help="Index of the product in the library file",
-        type=int,
+        "--set",
+        action="append",
+        default=[],
+        metavar="[MEMORY:]NAME=VALUE",
+        help="Override a parameter from the .param file (MEMORY is 'system', the default, or a memory index); "
+             "the overrides are burned together with the rest of the parameters",
+        type=get_parameter_override,
     )
+    return add_dry_run_argument(parser)
+
+
+def get_parameter_overrides(args):
+    """
+    Returns the --set overrides ({(memory, name): value}), after checking that each one matches a
+    parameter of the .param file and has a valid value (raises ValueError listing those that don't)
+    """
+    overrides = dict(args.set)
+    if overrides:
+        apply_overrides(load_compiled_param_file(args.param_file), overrides)
+    return overrides
+
 
-    args = parser.parse_args()
+def configure_from_param_file(configured_device, param_file, overrides=None, delta_burn=False,
+                              stream_voice_alerts=False, verify_burn=False, verify_retries=0, use_snapshot=False):
+    """
+    Programs a connected device from the given .param file and parameter overrides (see
+    common.program_from_param_file()) and resets it. Returns a list of notes about the writes
+    that were skipped (for the caller to report).
+    """
+    with trace_step('configure_from_param_file'):
+        return program_from_param_file(configured_device, param_file, configure_device=True, overrides=overrides,
+                                       delta_burn=delta_burn, stream_voice_alerts=stream_voice_alerts,
+                                       verify_burn=verify_burn,
+                                       verify_retries=verify_retries, use_snapshot=use_snapshot)
+
+
+def plan_configure(args, param_file, slots=None):
+    """Returns the planner.Plan of programming each slot (default is the --programmer/--side slot) from param_file"""
+    from planner import Plan, ParamFileSummary, add_setup_notes, add_startup_steps, add_connect_steps, add_program_steps
+
+    summary = ParamFileSummary.read(param_file)
+    if slots is None:
+        plan = Plan(f"configure a device from {args.param_file}")
+        add_setup_notes(plan, args, get_programmer(args.programmer))
+    else:
+        plan = Plan(f"configure {len(slots)} slot(s) from {args.param_file} (the steps of one slot, "
+                    f"up to {args.max_workers or len(slots)} slot(s) run at the same time)")
+        add_setup_notes(plan, args)
+        plan.notes.extend(f"Slot: {slot}" for slot in slots)
+    plan.notes.append(f"Param file: {summary.describe()}")
+    add_startup_steps(plan, args)
+    add_connect_steps(plan, upgrade_firmware=args.upgrade_firmware)
+    add_program_steps(plan, summary, args, overrides=f"{len(args.set)} parameter(s) set with --set" if args.set else '')
+    return plan
+
+
+def main(argv=None):
+    parser = add_configure_arguments(get_command_line_parser())
+    args = parser.parse_args(argv)
+    check_programming_arguments(parser, args)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None and not args.dry_run:
+        collect_metrics_to(args.metrics)
+
+    param_file = args.param_file
+    overrides = get_parameter_overrides(args)
+    if args.dry_run:
+        plan_configure(args, param_file).print()
+        return
+
+    if args.daemon is not None:
+        from programming_daemon import submit_job, get_device_job_args
+        print(f"Configuring device from .param file: {str(args.param_file)} (via the programming daemon)")
+        notes = submit_job(args.daemon, 'configure', param_file=str(param_file.resolve()), overrides=overrides,
+                           upgrade_firmware=args.upgrade_firmware, delta_burn=args.delta_burn,
+                           stream_voice_alerts=args.stream_voice_alerts, verify_burn=args.verify_burn,
+                           verify_retries=args.verify_retries, use_snapshot=args.use_snapshot,
+                           **get_device_job_args(args))
+        print('\n'.join(notes))
+        return
 
     interface = create_communication_interface(get_programmer(args.programmer),
                                                get_side(args.side),
                                                interface_options=args.interface_options,
-                                               verify_nvm_writes=args.verify_nvm_writes)
-
-    from sd_sdk_python import get_product_manager
-    product_manager = get_product_manager()
-    sdk_root = Path(os.environ['SD_SDK_ROOT'])
-    library_path = str(sdk_root / f"products/{args.product}.library") if args.library_file is None else str(args.library_file)
-    library = product_manager.LoadLibraryFromFile(library_path)
-    product = library.Products[args.product_index].CreateProduct()
+                                               verify_nvm_writes=args.verify_nvm_writes,
+                                               product_name=args.product)
 
-    # Confirm that the .library referenced in the .param file is the same as the product library specified
-    with args.param_file.open() as fp:
-        param_json = json.load(fp)
-        assert param_json["libraryid"] == product.Definition.LibraryId, "The library ID in the .param file does not match the product library!"
+    product = load_product(args.product, args.library_file, args.product_index)
+    check_param_file_library(param_file, product, overrides)
 
     configured_device = connect_and_configure_device(interface, product, args.product, upgrade_firmware=args.upgrade_firmware)
 
     print(f"Configuring device from .param file: {str(args.param_file)}...", end='', flush=True)
-    configured_device.interface.MuteDuringCommunication = False
-    configured_device.mute()
-
-    # Configure for a pure tone input signal
-    configured_device.set_input_signal_type(configured_device.sd.kPureTone)
-    # Switch to memory 1
-    configured_device.set_current_memory(configured_device.sd.kNvmMemory1)
-    # Sync all parameters from the device
-    configured_device.restore_all_parameters()
-
-    # Load the parameters from the param file and configure the device
-    configured_device.load_param_file(str(args.param_file),
-                                      configure_device=True,
-                                      write_manufacturer_data=True,
-                                      write_voice_alerts=True)
-    configured_device.burn_all_parameters()
-
-    configured_device.unmute()
-
-    # Reset the device (this must be the last thing we do as the device will disconnect)
-    configured_device.reset()
+    notes = configure_from_param_file(configured_device, param_file, overrides=overrides, delta_burn=args.delta_burn,
+                                      stream_voice_alerts=args.stream_voice_alerts, verify_burn=args.verify_burn,
+                                      verify_retries=args.verify_retries, use_snapshot=args.use_snapshot)
     configured_device.product.CloseDevice()
     print(" done!")
+    for note in notes:
+        print(note)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, check_programming_arguments
+from common import create_communication_interface, connect_and_configure_device, load_product, check_param_file_library
+from configure_device import add_configure_arguments, configure_from_param_file, get_parameter_overrides, \
+    plan_configure
+from metrics import collect_metrics_to
+from station import Slot, parse_slot, run_slots, print_summary
+from tracing import trace_to_file
+
+
+def configure_slot(slot, args):
+    interface = create_communication_interface(get_programmer(slot.programmer),
+                                               get_side(slot.side),
+                                               interface_options=slot.interface_options,
+                                               verify_nvm_writes=args.verify_nvm_writes,
+                                               product_name=args.product)
+    product = load_product(args.product, args.library_file, args.product_index)
+    configured_device = connect_and_configure_device(interface, product, args.product, upgrade_firmware=args.upgrade_firmware)
+    mac_address = configured_device.product.DeviceMACAddress
+    notes = configure_from_param_file(configured_device, args.param_file, overrides=args.overrides,
+                                      delta_burn=args.delta_burn,
+                                      stream_voice_alerts=args.stream_voice_alerts, verify_burn=args.verify_burn,
+                                      verify_retries=args.verify_retries, use_snapshot=args.use_snapshot)
+    configured_device.product.CloseDevice()
+    return '; '.join([f"MAC: {mac_address}"] + notes)
+
+
+def main(argv=None):
+    parser = add_configure_arguments(get_command_line_parser())
+    parser.add_argument(
+        "--slot",
+        action="append",
+        default=None,
+        help="A programmer slot of the form PROGRAMMER:SIDE[:INTERFACE_OPTIONS] (repeat for each attached device; "
+             "default is the single slot given by --programmer/--side/--interface-options)",
+        type=parse_slot,
+    )
+    parser.add_argument(
+        "--max-workers",
+        action="store",
+        default=None,
+        help="Maximum number of slots to program at the same time (default is all of them)",
+        type=int,
+    )
+    args = parser.parse_args(argv)
+    check_programming_arguments(parser, args)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None and not args.dry_run:
+        collect_metrics_to(args.metrics)
+
+    slots = args.slot or [Slot(args.programmer, args.side, args.interface_options)]
+    if len(set(slots)) != len(slots):
+        parser.error("Each --slot may only be given once")
+
+    # Fail fast on a mismatched .param file or invalid overrides before starting any workers
+    args.overrides = get_parameter_overrides(args)
+    if args.dry_run:
+        plan_configure(args, args.param_file, slots=slots).print()
+        return
+    check_param_file_library(args.param_file, load_product(args.product, args.library_file, args.product_index),
+                             args.overrides)
+
+    print(f"Programming {len(slots)} slot(s) from .param file: {str(args.param_file)}")
+    results, elapsed = run_slots(configure_slot, slots, args, max_workers=args.max_workers,
+                                 simulate=args.simulate)
+    print_summary(results, elapsed)
+    if not all(r.success for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,14 @@
 from cmd_line_args import get_command_line_parser
 import os
 
-def main():
+def main(argv=None):
     parser = get_command_line_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.daemon is not None:
+        from programming_daemon import submit_job
+        print(f"ProductManager Version (programming daemon): 0x{hex(submit_job(args.daemon, 'ping'))}")
+        return
 
     from sd_sdk_python import get_product_manager
     product_manager = get_product_manager()
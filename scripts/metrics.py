@@ -0,0 +1,358 @@
+"""
+Station throughput metrics. While metrics are collected (the scripts' --metrics option, or
+SD_SDK_UTILS_METRICS), every trace_step() is recorded with the programmer and product it ran on,
+and at the end of the run the steps are added to either:
+
+- a Prometheus textfile (FILE.prom, e.g. in the node_exporter textfile collector folder) with a
+  duration histogram and a failure counter per step, programmer and product, or
+- a local SQLite database (FILE.db or FILE.sqlite) with one row per step, which also records the
+  station (host name) and the time of each step.
+
+`metrics.py report FILE` prints the count, failures and duration percentiles of each step (and
+the units per hour of the programming flows) from either kind of file.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+import argparse
+import atexit
+import math
+import os
+import re
+import socket
+import sqlite3
+import time
+
+from tracing import add_step_listener, remove_step_listener, get_trace_metadata
+
+# The upper bounds (in seconds) of the duration histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# The steps that each program (or upgrade) one unit, which the report shows the throughput of
+FLOW_STEPS = ('configure_from_param_file', 'program_binaural_half', 'update_device')
+
+# The short names used in the labels (the same names as the --programmer option)
+PROGRAMMER_LABELS = {'Communication Accelerator Adaptor': 'CAA', 'DSP3': 'DSP3', 'Promira': 'Promira'}
+
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+STEP_DURATION = 'sd_sdk_step_duration_seconds'
+STEP_FAILURES = 'sd_sdk_step_failures_total'
+
+
+@dataclass
+class StepObservation:
+    time: float
+    step: str
+    programmer: str
+    product: str
+    duration: float
+    failed: bool
+
+
+class MetricsCollector:
+    def __init__(self):
+        self.observations = []
+
+    def on_step(self, name, start, duration, failed, args):
+        metadata = get_trace_metadata()
+        programmer = metadata.get('programmer', '')
+        self.observations.append(StepObservation(time.time(), name, PROGRAMMER_LABELS.get(programmer, programmer),
+                                                 metadata.get('product', ''), duration, failed))
+
+    def add_observations(self, observations):
+        self.observations.extend(observations)
+
+
+_collector = None
+
+
+def start_metrics():
+    global _collector
+    stop_metrics()
+    _collector = MetricsCollector()
+    add_step_listener(_collector.on_step)
+    return _collector
+
+
+def stop_metrics():
+    global _collector
+    collector, _collector = _collector, None
+    if collector is not None:
+        remove_step_listener(collector.on_step)
+    return collector
+
+
+def get_metrics_collector():
+    return _collector
+
+
+def collect_metrics_to(path):
+    """Starts collecting metrics and adds them to the given .prom or SQLite file when the script exits"""
+    path = Path(path)
+    collector = start_metrics()
+
+    def write_metrics():
+        if collector.observations:
+            export_metrics(collector.observations, path)
+
+    atexit.register(write_metrics)
+    return path
+
+
+def export_metrics(observations, path):
+    path = Path(path)
+    if path.suffix.lower() in SQLITE_SUFFIXES:
+        write_sqlite(path, observations)
+    else:
+        write_prometheus_textfile(path, observations)
+
+
+def _connect_sqlite(path):
+    connection = sqlite3.connect(str(path), timeout=30.0)
+    connection.execute("CREATE TABLE IF NOT EXISTS steps (time REAL, station TEXT, pid INTEGER, step TEXT, "
+                       "programmer TEXT, product TEXT, duration REAL, failed INTEGER)")
+    connection.execute("CREATE INDEX IF NOT EXISTS steps_time ON steps (time)")
+    return connection
+
+
+def write_sqlite(path, observations):
+    station = socket.gethostname()
+    pid = os.getpid()
+    with _connect_sqlite(path) as connection:
+        connection.executemany("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               [(o.time, station, pid, o.step, o.programmer, o.product, o.duration, int(o.failed))
+                                for o in observations])
+    connection.close()
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+
+_SAMPLE = re.compile(r'^(\w+)\{(.*)\}\s+(\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def read_prometheus_textfile(path):
+    """Returns {(metric, labels): value} for the samples in a textfile written by write_prometheus_textfile()"""
+    samples = {}
+    try:
+        with open(path) as fp:
+            lines = fp.read().splitlines()
+    except OSError:
+        return samples
+    for line in lines:
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        labels = tuple((name, re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value))
+                       for name, value in _LABEL.findall(match.group(2)))
+        samples[(match.group(1), labels)] = float(match.group(3))
+    return samples
+
+
+def _format_bound(bound):
+    return '+Inf' if math.isinf(bound) else repr(bound)
+
+
+def write_prometheus_textfile(path, observations):
+    """
+    Adds the observations to the counters and histograms in a Prometheus textfile (creating it if
+    needed), so the file keeps the totals of every run on this station. The file is replaced
+    atomically, as node_exporter may read it at any time.
+    """
+    samples = read_prometheus_textfile(path)
+
+    def add(metric, labels, value):
+        samples[(metric, labels)] = samples.get((metric, labels), 0.0) + value
+
+    for o in observations:
+        labels = (('step', o.step), ('programmer', o.programmer), ('product', o.product))
+        for bound in HISTOGRAM_BUCKETS + (math.inf,):
+            add(f"{STEP_DURATION}_bucket", labels + (('le', _format_bound(bound)),), 1 if o.duration <= bound else 0)
+        add(f"{STEP_DURATION}_sum", labels, o.duration)
+        add(f"{STEP_DURATION}_count", labels, 1)
+        add(STEP_FAILURES, labels, 1 if o.failed else 0)
+
+    def sort_key(sample):
+        (metric, labels), _ = sample
+        le = dict(labels).get('le')
+        return metric, [value for name, value in labels if name != 'le'], math.inf if le == '+Inf' else float(le or 0)
+
+    families = (
+        (STEP_DURATION, 'histogram', "The duration of each programming step"),
+        (STEP_FAILURES, 'counter', "The number of programming steps that failed"),
+    )
+    lines = []
+    for family, kind, description in families:
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for (metric, labels), value in sorted(samples.items(), key=sort_key):
+            if metric == family or (kind == 'histogram' and metric.startswith(f"{family}_")):
+                lines.append(f"{metric}{_format_labels(labels)} {value:g}" if metric != f"{family}_sum"
+                             else f"{metric}{_format_labels(labels)} {value!r}")
+
+    path = Path(path)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with temp_path.open('w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
+
+
+def percentile(sorted_values, fraction):
+    """The linearly interpolated percentile of a sorted list"""
+    if not sorted_values:
+        return math.nan
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def histogram_percentile(buckets, fraction):
+    """The percentile estimated from [(upper bound, cumulative count)] the way Prometheus' histogram_quantile() does"""
+    buckets = sorted(buckets)
+    total = buckets[-1][1] if buckets else 0
+    if total == 0:
+        return math.nan
+    rank = fraction * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if math.isinf(bound):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+@dataclass
+class ReportRow:
+    group: tuple
+    count: int
+    failed: int
+    p50: float
+    p90: float
+    p99: float
+    maximum: float = math.nan
+    units_per_hour: float = math.nan
+
+
+def report_sqlite(path, group_by, since=None):
+    query = "SELECT time, station, step, programmer, product, duration, failed FROM steps"
+    parameters = ()
+    if since is not None:
+        query += " WHERE time >= ?"
+        parameters = (time.time() - since * 3600.0,)
+    connection = _connect_sqlite(path)
+    try:
+        rows = connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+
+    groups = {}
+    for end, station, step, programmer, product, duration, failed in rows:
+        fields = dict(step=step, programmer=programmer, product=product, station=station)
+        groups.setdefault(tuple(fields[name] for name in group_by), []).append((end, duration, failed))
+
+    report = []
+    for group, observations in groups.items():
+        durations = sorted(duration for _, duration, _ in observations)
+        failed = sum(failed for _, _, failed in observations)
+        row = ReportRow(group, len(observations), failed, percentile(durations, 0.5), percentile(durations, 0.9),
+                        percentile(durations, 0.99), durations[-1])
+        if dict(zip(group_by, group)).get('step') in FLOW_STEPS:
+            # The units that succeeded over the time from the start of the first one to the end of the last one
+            span = max(end for end, _, _ in observations) - min(end - duration for end, duration, _ in observations)
+            if span > 0:
+                row.units_per_hour = (len(observations) - failed) * 3600.0 / span
+        report.append(row)
+    return report
+
+
+def report_prometheus_textfile(path, group_by):
+    if 'station' in group_by:
+        raise ValueError("A Prometheus textfile has no station label (it is added by Prometheus as the instance)")
+    groups = {}
+    for (metric, labels), value in read_prometheus_textfile(path).items():
+        labels = dict(labels)
+        group = groups.setdefault(tuple(labels.get(name, '') for name in group_by), {'buckets': {}, 'count': 0.0,
+                                                                                         'failed': 0.0})
+        if metric == f"{STEP_DURATION}_bucket":
+            bound = math.inf if labels['le'] == '+Inf' else float(labels['le'])
+            group['buckets'][bound] = group['buckets'].get(bound, 0.0) + value
+        elif metric == f"{STEP_DURATION}_count":
+            group['count'] += value
+        elif metric == STEP_FAILURES:
+            group['failed'] += value
+
+    report = []
+    for group, values in groups.items():
+        buckets = list(values['buckets'].items())
+        report.append(ReportRow(group, int(values['count']), int(values['failed']), histogram_percentile(buckets, 0.5),
+                                histogram_percentile(buckets, 0.9), histogram_percentile(buckets, 0.99)))
+    return report
+
+
+def print_report(report, group_by):
+    widths = [max([len(str(row.group[i])) for row in report] + [len(name)]) for i, name in enumerate(group_by)]
+    header = '  '.join(f"{name.capitalize():<{width}}" for name, width in zip(group_by, widths))
+    print(f"{header}  {'Count':>6}  {'Failed':>6}  {'p50 (s)':>8}  {'p90 (s)':>8}  {'p99 (s)':>8}  {'Max (s)':>8}  "
+          f"{'Units/hour':>10}")
+    for row in sorted(report, key=lambda r: r.group):
+        values = '  '.join(f"{str(value):<{width}}" for value, width in zip(row.group, widths))
+        numbers = '  '.join('-'.rjust(8) if math.isnan(v) else f"{v:>8.3f}" for v in (row.p50, row.p90, row.p99,
+                                                                                       row.maximum))
+        units_per_hour = '-' if math.isnan(row.units_per_hour) else f"{row.units_per_hour:.1f}"
+        print(f"{values}  {row.count:>6}  {row.failed:>6}  {numbers}  {units_per_hour:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reports on the metrics collected with --metrics")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = subparsers.add_parser('report', help="Print the duration percentiles and failures of each step")
+    report_parser.add_argument("metrics_file", help="A .prom textfile or SQLite database written with --metrics", type=Path)
+    report_parser.add_argument(
+        "--group-by",
+        action="append",
+        default=None,
+        help="Group the steps by this label too (repeatable; default is programmer and product)",
+        choices=('programmer', 'product', 'station'),
+    )
+    report_parser.add_argument(
+        "--since",
+        action="store",
+        default=None,
+        metavar="HOURS",
+        help="Only report the steps of the last HOURS hours (SQLite only)",
+        type=float,
+    )
+    args = parser.parse_args(argv)
+
+    if not args.metrics_file.is_file():
+        parser.error(f"{args.metrics_file} is not a valid file path")
+    group_by = ['step'] + (args.group_by or ['programmer', 'product'])
+    if args.metrics_file.suffix.lower() in SQLITE_SUFFIXES:
+        report = report_sqlite(args.metrics_file, group_by, since=args.since)
+    else:
+        if args.since is not None:
+            parser.error("--since needs the step times, which are only kept in a SQLite database")
+        try:
+            report = report_prometheus_textfile(args.metrics_file, group_by)
+        except ValueError as e:
+            parser.error(str(e))
+    if not report:
+        print(f"No steps recorded in {args.metrics_file}")
+        return
+    print_report(report, group_by)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+"""
+Compact storage for a family of .param files (e.g. the fitting variants of a product): one
+shared base plus a small delta per variant. Any variant can be rebuilt as a CompiledParamFile
+or as a standard .param file, and any two .param files (or variants) can be diffed.
+"""
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import copy
+import hashlib
+import json
+import lzma
+import os
+import struct
+import sys
+import time
+
+from common import get_cache_dir
+from param_file import CompiledMemory, CompiledParamFile, CompiledVoiceAlert, format_value, \
+    load_compiled_param_file, write_param_file, cache_compiled_param_file
+
+FAMILY_SUFFIX = '.pfam'
+FAMILY_MAGIC = b'SDPF'
+
+# Bump this whenever the layout of a .pfam file changes
+FAMILY_FORMAT_VERSION = 1
+
+# Separates the family file from the variant name, e.g. 'configs/fittings.pfam#left_only'
+VARIANT_SEPARATOR = '#'
+
+
+@dataclass
+class MemoryDelta:
+    """The values of a variant memory that differ from the base memory at `base_position`"""
+    id: object
+    base_position: int
+    positions: array = field(default_factory=lambda: array('I'))
+    types: bytes = b''
+    values: array = field(default_factory=lambda: array('d'))
+
+    def __len__(self):
+        return len(self.positions)
+
+
+@dataclass
+class Variant:
+    name: str
+    header: dict
+    # A MemoryDelta for every memory with the same parameters as the base, otherwise the
+    # whole CompiledMemory (system memory first, like CompiledParamFile.all_memories())
+    memories: list
+    transducers: list
+    # Indexes into ParamFamily.scratch_memories and ParamFamily.voice_alerts (or None)
+    scratch_memory: int
+    voice_alerts: list
+    # The SHA-256 of the rebuilt .param file
+    content_hash: str = None
+
+    def changed_parameters(self):
+        return sum(len(m) for m in self.memories)
+
+
+def _memory_names(names, memory):
+    return [names[i] for i in memory.name_indexes]
+
+
+def _to_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def get_param_json_hash(compiled_param_file):
+    """The SHA-256 of the .param file write_param_file() writes for a CompiledParamFile"""
+    return hashlib.sha256(json.dumps(compiled_param_file.to_param_json(), indent=2).encode()).hexdigest()
+
+
+class ParamFamily:
+    """A shared base (the memories, scratch memories and voice alerts) and the variants built from it"""
+    def __init__(self, names, base_memories, scratch_memories, voice_alerts, variants):
+        self.names = names
+        self.base_memories = base_memories
+        self.scratch_memories = scratch_memories
+        self.voice_alerts = voice_alerts
+        self.variants = variants
+
+    @property
+    def variant_names(self):
+        return list(self.variants)
+
+    @classmethod
+    def from_compiled(cls, compiled_param_files):
+        """
+        Builds a family from {variant name: CompiledParamFile}. The first one is the base, so
+        pass the most typical variant first.
+        """
+        base = next(iter(compiled_param_files.values()))
+        family = cls(list(base.names), base.all_memories(), [], [], {})
+        for name, compiled in compiled_param_files.items():
+            family.add_variant(name, compiled)
+        return family
+
+    def add_variant(self, name, compiled_param_file):
+        if name in self.variants:
+            raise ValueError(f"There is already a variant called {name}")
+        name_indexes = {n: i for i, n in enumerate(self.names)}
+        base_memories = {m.id: (position, m) for position, m in enumerate(self.base_memories)}
+
+        memories = []
+        for memory in compiled_param_file.all_memories():
+            memory_names = _memory_names(compiled_param_file.names, memory)
+            position, base_memory = base_memories.get(memory.id, (None, None))
+            if base_memory is not None and memory_names == _memory_names(self.names, base_memory):
+                changed = [i for i, (t, v, base_t, base_v) in
+                           enumerate(zip(memory.types, memory.values, base_memory.types, base_memory.values))
+                           if t != base_t or v != base_v]
+                memories.append(MemoryDelta(memory.id, position, array('I', changed),
+                                            bytes(memory.types[i] for i in changed),
+                                            array('d', (memory.values[i] for i in changed))))
+            else:
+                # Different parameters than the base, so store the whole memory
+                for memory_name in memory_names:
+                    if memory_name not in name_indexes:
+                        name_indexes[memory_name] = len(self.names)
+                        self.names.append(memory_name)
+                memories.append(CompiledMemory(memory.id, array('I', (name_indexes[n] for n in memory_names)),
+                                               bytes(memory.types), array('d', memory.values)))
+
+        scratch_memory = None
+        if compiled_param_file.scratch_memory is not None:
+            scratch_memory = self._add_to_pool(self.scratch_memories, compiled_param_file.scratch_memory)
+        voice_alerts = None
+        if compiled_param_file.voice_alerts is not None:
+            voice_alerts = [self._add_to_pool(self.voice_alerts, a) for a in compiled_param_file.voice_alerts]
+
+        self.variants[name] = Variant(name, dict(compiled_param_file.header), memories,
+                                      copy.deepcopy(compiled_param_file.transducers), scratch_memory, voice_alerts)
+        self.variants[name].content_hash = get_param_json_hash(self.get_compiled(name))
+
+    @staticmethod
+    def _add_to_pool(pool, item):
+        for i, pooled in enumerate(pool):
+            if pooled == item:
+                return i
+        pool.append(item)
+        return len(pool) - 1
+
+    def _rebuild_memory(self, memory):
+        if isinstance(memory, CompiledMemory):
+            return memory
+        base_memory = self.base_memories[memory.base_position]
+        if not memory.positions:
+            return CompiledMemory(memory.id, base_memory.name_indexes, base_memory.types, base_memory.values)
+        types = bytearray(base_memory.types)
+        values = array('d', base_memory.values)
+        for position, value_type, value in zip(memory.positions, memory.types, memory.values):
+            types[position] = value_type
+            values[position] = value
+        return CompiledMemory(memory.id, base_memory.name_indexes, bytes(types), values)
+
+    def get_compiled(self, name):
+        """Rebuilds the CompiledParamFile of a variant"""
+        variant = self.get_variant(name)
+        system, *memories = [self._rebuild_memory(m) for m in variant.memories]
+        return CompiledParamFile(header=dict(variant.header),
+                                 names=tuple(self.names),
+                                 memories=memories,
+                                 system=system,
+                                 transducers=copy.deepcopy(variant.transducers),
+                                 scratch_memory=None if variant.scratch_memory is None else self.scratch_memories[variant.scratch_memory],
+                                 voice_alerts=None if variant.voice_alerts is None else [self.voice_alerts[i] for i in variant.voice_alerts])
+
+    def get_variant(self, name):
+        variant = self.variants.get(name)
+        if variant is None:
+            raise ValueError(f"No variant called {name} (the variants are {', '.join(self.variants)})")
+        return variant
+
+    def write_param_file(self, name, path):
+        """Rebuilds the .param file of a variant, checking that it matches the file that was packed"""
+        compiled = self.get_compiled(name)
+        write_param_file(compiled, path)
+        content_hash = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        if content_hash != self.variants[name].content_hash:
+            raise ValueError(f"The rebuilt {name} does not match the packed .param file")
+        cache_compiled_param_file(content_hash, compiled)
+        return compiled
+
+    def save(self, path):
+        """Writes the family as a header followed by LZMA compressed metadata (JSON) and arrays"""
+        blobs = []
+
+        def blob(data):
+            blobs.append(bytes(data))
+            return len(blobs) - 1
+
+        def memory_metadata(memory):
+            if isinstance(memory, MemoryDelta):
+                metadata = {'id': memory.id, 'base': memory.base_position}
+                if memory.positions:
+                    metadata.update(positions=blob(_to_bytes(memory.positions)), types=blob(memory.types),
+                                    values=blob(_to_bytes(memory.values)))
+                return metadata
+            return {'id': memory.id, 'name_indexes': blob(_to_bytes(memory.name_indexes)), 'types': blob(memory.types),
+                    'values': blob(_to_bytes(memory.values))}
+
+        metadata = {
+            'names': self.names,
+            'base': [memory_metadata(m) for m in self.base_memories],
+            'scratch_memories': [blob(_to_bytes(m)) for m in self.scratch_memories],
+            'voice_alerts': [{'alertindex': a.alert_index, 'hash': a.hash, 'wavefilename': a.wave_file_name,
+                              'data': blob(a.data)} for a in self.voice_alerts],
+            'variants': [{'name': v.name, 'header': v.header, 'transducers': v.transducers,
+                          'scratch_memory': v.scratch_memory, 'voice_alerts': v.voice_alerts,
+                          'sha256': v.content_hash, 'memories': [memory_metadata(m) for m in v.memories]}
+                         for v in self.variants.values()],
+        }
+        metadata['blobs'] = [len(b) for b in blobs]
+        metadata = json.dumps(metadata, separators=(',', ':')).encode()
+        payload = lzma.compress(struct.pack('<I', len(metadata)) + metadata + b''.join(blobs), preset=9)
+
+        path = Path(path)
+        temp_file = path.with_suffix(f'.{os.getpid()}.tmp')
+        with temp_file.open('wb') as fp:
+            fp.write(FAMILY_MAGIC + struct.pack('<H', FAMILY_FORMAT_VERSION) + payload)
+        temp_file.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        data = Path(path).read_bytes()
+        if data[:len(FAMILY_MAGIC)] != FAMILY_MAGIC:
+            raise ValueError(f"{path} is not a .param family file")
+        version, = struct.unpack_from('<H', data, len(FAMILY_MAGIC))
+        if version != FAMILY_FORMAT_VERSION:
+            raise ValueError(f"{path} is version {version} of the .param family format (expected {FAMILY_FORMAT_VERSION})")
+        payload = lzma.decompress(data[len(FAMILY_MAGIC) + 2:])
+        metadata_length, = struct.unpack_from('<I', payload)
+        metadata = json.loads(payload[4:4 + metadata_length])
+
+        blobs = []
+        offset = 4 + metadata_length
+        for length in metadata['blobs']:
+            blobs.append(payload[offset:offset + length])
+            offset += length
+
+        def load_memory(memory):
+            if 'base' in memory:
+                if 'positions' not in memory:
+                    return MemoryDelta(memory['id'], memory['base'])
+                return MemoryDelta(memory['id'], memory['base'], _from_bytes('I', blobs[memory['positions']]),
+                                   blobs[memory['types']], _from_bytes('d', blobs[memory['values']]))
+            return CompiledMemory(memory['id'], _from_bytes('I', blobs[memory['name_indexes']]), blobs[memory['types']],
+                                  _from_bytes('d', blobs[memory['values']]))
+
+        variants = {}
+        for v in metadata['variants']:
+            variants[v['name']] = Variant(v['name'], v['header'], [load_memory(m) for m in v['memories']],
+                                          v['transducers'], v['scratch_memory'], v['voice_alerts'], v['sha256'])
+        return cls(names=metadata['names'],
+                   base_memories=[load_memory(m) for m in metadata['base']],
+                   scratch_memories=[_from_bytes('I', blobs[i]) for i in metadata['scratch_memories']],
+                   voice_alerts=[CompiledVoiceAlert(a['alertindex'], a['hash'], a['wavefilename'], blobs[a['data']])
+                                 for a in metadata['voice_alerts']],
+                   variants=variants)
+
+
+def split_variant_path(value):
+    """Splits 'FAMILY.pfam#VARIANT' into (family path, variant name), or returns (value, None) for a .param file"""
+    family_file, separator, variant = str(value).rpartition(VARIANT_SEPARATOR)
+    if separator and family_file.lower().endswith(FAMILY_SUFFIX):
+        return Path(family_file), variant
+    return Path(value), None
+
+
+def get_variant_param_file(family_file, variant):
+    """
+    Returns the path of a .param file for a variant of a family, rebuilt in the local cache
+    folder the first time it is needed (the SDK only loads .param files)
+    """
+    family = ParamFamily.load(family_file)
+    content_hash = family.get_variant(variant).content_hash
+    path = get_cache_dir('params', 'families') / f"{variant}-{content_hash[:16]}.param"
+    if not path.exists():
+        family.write_param_file(variant, path)
+    return path
+
+
+def load_compiled(value):
+    """Returns the CompiledParamFile of a .param file or of a 'FAMILY.pfam#VARIANT'"""
+    path, variant = split_variant_path(value)
+    if variant is None:
+        return load_compiled_param_file(path)
+    return ParamFamily.load(path).get_compiled(variant)
+
+
+@dataclass
+class ParamFileDiff:
+    header: dict = field(default_factory=dict)
+    # (memory, name, old value, new value), with None for a parameter that is only in one file
+    parameters: list = field(default_factory=list)
+    transducers: bool = False
+    scratch_memory: int = 0
+    voice_alerts: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.header or self.parameters or self.transducers or self.scratch_memory or self.voice_alerts)
+
+    def lines(self):
+        for key, (old, new) in self.header.items():
+            yield f"{key}: {old} -> {new}"
+        for memory, name, old, new in self.parameters:
+            if old is None:
+                yield f"{memory}:{name}: added ({new})"
+            elif new is None:
+                yield f"{memory}:{name}: removed ({old})"
+            else:
+                yield f"{memory}:{name}: {old} -> {new}"
+        if self.transducers:
+            yield "transducers differ"
+        if self.scratch_memory:
+            yield f"scratch memory: {self.scratch_memory} word(s) differ"
+        if self.voice_alerts:
+            yield f"voice alerts differ: {', '.join(str(i) for i in self.voice_alerts)}"
+
+
+def _format_parameter(value):
+    value_type, value = value
+    return format_value(value_type, value)
+
+
+def diff_param_files(old, new):
+    """Compares two CompiledParamFiles (parameters are compared by value, not by how they are formatted)"""
+    diff = ParamFileDiff()
+    for key in dict.fromkeys(list(old.header) + list(new.header)):
+        if old.header.get(key) != new.header.get(key):
+            diff.header[key] = (old.header.get(key), new.header.get(key))
+
+    def get_entries(compiled_param_file):
+        return {m.id: {compiled_param_file.names[i]: (t, v) for i, t, v in zip(m.name_indexes, m.types, m.values)}
+                for m in compiled_param_file.all_memories()}
+
+    old_memories, new_memories = get_entries(old), get_entries(new)
+    for memory in dict.fromkeys(list(old_memories) + list(new_memories)):
+        old_entries, new_entries = old_memories.get(memory, {}), new_memories.get(memory, {})
+        for name in dict.fromkeys(list(old_entries) + list(new_entries)):
+            old_value, new_value = old_entries.get(name), new_entries.get(name)
+            if old_value != new_value:
+                diff.parameters.append((memory, name, None if old_value is None else _format_parameter(old_value),
+                                        None if new_value is None else _format_parameter(new_value)))
+
+    diff.transducers = old.transducers != new.transducers
+    old_scratch, new_scratch = old.scratch_memory or array('I'), new.scratch_memory or array('I')
+    diff.scratch_memory = sum(a != b for a, b in zip(old_scratch, new_scratch)) + abs(len(old_scratch) - len(new_scratch))
+    old_alerts = {a.alert_index: a for a in old.voice_alerts or []}
+    new_alerts = {a.alert_index: a for a in new.voice_alerts or []}
+    diff.voice_alerts = sorted(i for i in old_alerts.keys() | new_alerts.keys() if old_alerts.get(i) != new_alerts.get(i))
+    return diff
+
+
+def _pack(args):
+    names = [p.stem for p in args.param_files]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise SystemExit(f"The variants are named after the files, so they must be unique: {', '.join(duplicates)}")
+    start = time.perf_counter()
+    family = ParamFamily.from_compiled({p.stem: load_compiled_param_file(p) for p in args.param_files})
+    family.save(args.output)
+    elapsed = time.perf_counter() - start
+
+    input_size = sum(p.stat().st_size for p in args.param_files)
+    output_size = args.output.stat().st_size
+    for variant in family.variants.values():
+        print(f"{variant.name}: {variant.changed_parameters()} parameter(s) differ from the base")
+    print(f"Packed {len(args.param_files)} .param file(s) ({input_size} bytes) into {args.output} ({output_size} bytes, "
+          f"{input_size / output_size:.1f}x smaller) in {elapsed:.2f}s")
+
+
+def _unpack(args):
+    start = time.perf_counter()
+    family = ParamFamily.load(args.family)
+    args.output.mkdir(parents=True, exist_ok=True)
+    for variant in args.variants or family.variant_names:
+        path = args.output / f"{variant}.param"
+        family.write_param_file(variant, path)
+        print(f"Wrote {path}")
+    print(f"Unpacked in {time.perf_counter() - start:.2f}s")
+
+
+def _list(args):
+    family = ParamFamily.load(args.family)
+    base_name = family.variant_names[0]
+    for variant in family.variants.values():
+        detail = 'base' if variant.name == base_name else f"{variant.changed_parameters()} parameter(s) differ from the base"
+        print(f"{variant.name}: {variant.header.get('product')} ({detail})")
+
+
+def _diff(args):
+    start = time.perf_counter()
+    diff = diff_param_files(load_compiled(args.old), load_compiled(args.new))
+    elapsed = (time.perf_counter() - start) * 1000
+    for line in diff.lines():
+        print(line)
+    print(f"{len(diff.parameters)} parameter(s) differ ({elapsed:.1f} ms)" if diff else f"No differences ({elapsed:.1f} ms)")
+    if diff:
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack = commands.add_parser('pack', help="Pack .param files into a family (the first file is the base)")
+    pack.add_argument("param_files", nargs='+', type=Path, help="The .param files (each becomes a variant named after the file)")
+    pack.add_argument("-o", "--output", required=True, type=Path, help=f"The family file to write (e.g. fittings{FAMILY_SUFFIX})")
+    pack.set_defaults(run=_pack)
+
+    unpack = commands.add_parser('unpack', help="Rebuild the .param files of a family")
+    unpack.add_argument("family", type=Path)
+    unpack.add_argument("variants", nargs='*', help="The variants to rebuild (default is all of them)")
+    unpack.add_argument("-o", "--output", default=Path('.'), type=Path, help="The folder to write the .param files to")
+    unpack.set_defaults(run=_unpack)
+
+    list_variants = commands.add_parser('list', help="List the variants of a family")
+    list_variants.add_argument("family", type=Path)
+    list_variants.set_defaults(run=_list)
+
+    diff = commands.add_parser('diff', help="Show the differences between two .param files or FAMILY.pfam#VARIANTs")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.set_defaults(run=_diff)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
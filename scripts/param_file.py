@@ -0,0 +1,528 @@
+"""
+Fast access to .param files: a header-only reader, a streaming compiler (that never holds the
+whole JSON document) and a compiled, content-hash keyed cache.
+"""
+from array import array
+from dataclasses import dataclass, replace
+from pathlib import Path
+import base64
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+from common import get_cache_dir
+
+
+HEADER_KEYS = ('library', 'libraryid', 'product', 'librarysignature')
+
+# The id of the system memory in a CompiledParamFile (and in parameter overrides)
+SYSTEM_MEMORY = 'system'
+
+TYPE_INTEGER = 0
+TYPE_BOOLEAN = 1
+TYPE_DOUBLE = 2
+
+# Bump this whenever the layout of CompiledParamFile changes
+COMPILED_FORMAT_VERSION = 1
+
+# The size (in characters) of the pieces .param files are streamed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+class _Truncated(Exception):
+    pass
+
+
+def _skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in ' \t\r\n':
+        pos += 1
+    if pos >= len(text):
+        raise _Truncated()
+    return pos
+
+
+def _decode_value(text, pos):
+    try:
+        value, end = _decoder.raw_decode(text, pos)
+    except json.JSONDecodeError:
+        raise _Truncated()
+    # A number at the very end of the buffer may have been cut in half
+    _skip_whitespace(text, end)
+    return value, end
+
+
+def _parse_header(text):
+    """Returns (header, complete) for the header fields at the start of `text`"""
+    header = {}
+    pos = _skip_whitespace(text, 0)
+    if text[pos] != '{':
+        raise ValueError("Not a .param file")
+    pos += 1
+    while len(header) < len(HEADER_KEYS):
+        pos = _skip_whitespace(text, pos)
+        if text[pos] == ',':
+            pos = _skip_whitespace(text, pos + 1)
+        key, pos = _decode_value(text, pos)
+        pos = _skip_whitespace(text, pos)
+        if text[pos] != ':':
+            raise ValueError("Not a .param file")
+        pos = _skip_whitespace(text, pos + 1)
+        if key not in HEADER_KEYS:
+            return header, False
+        header[key], pos = _decode_value(text, pos)
+    return header, True
+
+
+def read_param_header(param_file, chunk_size=4096):
+    """
+    Returns the header fields (library, libraryid, product, librarysignature) of a .param file,
+    reading only as much of the file as needed. Falls back to a full parse if the header fields
+    are not all at the top of the file.
+    """
+    with Path(param_file).open() as fp:
+        text = ''
+        while True:
+            chunk = fp.read(chunk_size)
+            text += chunk
+            try:
+                header, complete = _parse_header(text)
+                break
+            except _Truncated:
+                if not chunk:
+                    raise ValueError(f"{param_file} is not a valid .param file")
+
+        if not complete:
+            fp.seek(0)
+            param_json = json.load(fp)
+            header = {k: param_json[k] for k in HEADER_KEYS if k in param_json}
+    return header
+
+
+@dataclass
+class CompiledMemory:
+    id: object
+    # Indexes into CompiledParamFile.names, the type of each parameter and its value
+    name_indexes: array
+    types: bytes
+    values: array
+
+    def __len__(self):
+        return len(self.name_indexes)
+
+
+@dataclass
+class CompiledVoiceAlert:
+    alert_index: int
+    hash: int
+    wave_file_name: str
+    data: bytes
+
+
+@dataclass
+class CompiledParamFile:
+    """A compact, array-backed form of a .param file"""
+    header: dict
+    names: tuple
+    memories: list
+    system: CompiledMemory
+    transducers: list
+    scratch_memory: array
+    voice_alerts: list
+
+    def all_memories(self):
+        return [self.system] + self.memories
+
+    def get_values(self, memory):
+        """Returns {name: value} for a CompiledMemory"""
+        names = self.names
+        return {names[i]: _typed_value(t, v) for i, t, v in zip(memory.name_indexes, memory.types, memory.values)}
+
+    def to_param_json(self):
+        """Rebuilds the standard .param JSON document"""
+        param_json = dict(self.header)
+        param_json['memory'] = [{'id': m.id, 'param': self._to_param_list(m)} for m in self.memories]
+        param_json['system'] = {'param': self._to_param_list(self.system)}
+        param_json['transducer'] = self.transducers
+        if self.scratch_memory is not None:
+            param_json['scratchmemory'] = {'csvalues': ','.join(f"0x{v:08X}" for v in self.scratch_memory)}
+        if self.voice_alerts is not None:
+            param_json['voicealerts'] = [{'alertindex': a.alert_index, 'hash': a.hash, 'wavefilename': a.wave_file_name,
+                                          'encodeddata': base64.b64encode(a.data).decode('ascii')}
+                                         for a in self.voice_alerts]
+        return param_json
+
+    def _to_param_list(self, memory):
+        names = self.names
+        return [{'name': names[i], 'value': format_value(t, v)}
+                for i, t, v in zip(memory.name_indexes, memory.types, memory.values)]
+
+
+def parse_value(value):
+    """Returns (type, value) for a .param value string"""
+    lowered = value.lower()
+    if lowered in ('true', 'false'):
+        return TYPE_BOOLEAN, 1.0 if lowered == 'true' else 0.0
+    if '.' in value or 'e' in lowered:
+        return TYPE_DOUBLE, float(value)
+    return TYPE_INTEGER, float(int(value))
+
+
+def format_value(value_type, value):
+    if value_type == TYPE_BOOLEAN:
+        return 'True' if value else 'False'
+    if value_type == TYPE_DOUBLE:
+        return repr(value)
+    return str(int(value))
+
+
+def coerce_value(value_type, value):
+    """Converts a Python value or a string (e.g. from the command line) to the stored form of `value_type`"""
+    if isinstance(value, str):
+        text = value.strip()
+        if value_type == TYPE_BOOLEAN:
+            if text.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError(f"{value} is not a boolean value")
+            return 1.0 if text.lower() in ('true', '1') else 0.0
+        if value_type == TYPE_DOUBLE:
+            return float(text)
+        return float(int(text, 0))
+    if value_type == TYPE_BOOLEAN:
+        return 1.0 if value else 0.0
+    if value_type == TYPE_DOUBLE:
+        return float(value)
+    return float(int(value))
+
+
+def _typed_value(value_type, value):
+    if value_type == TYPE_BOOLEAN:
+        return bool(value)
+    if value_type == TYPE_DOUBLE:
+        return value
+    return int(value)
+
+
+def _make_memory_compiler(name_indexes):
+    """Returns a function that compiles the parameters of a memory, adding their names to `name_indexes`"""
+    def compile_memory(memory_id, params):
+        indexes = array('I')
+        types = bytearray()
+        values = array('d')
+        for p in params:
+            name = sys.intern(p['name'])
+            indexes.append(name_indexes.setdefault(name, len(name_indexes)))
+            value_type, value = parse_value(p['value'])
+            types.append(value_type)
+            values.append(value)
+        return CompiledMemory(memory_id, indexes, bytes(types), values)
+    return compile_memory
+
+
+def _compile_scratch_memory(scratch_memory):
+    return array('I', (int(v, 16) for v in scratch_memory['csvalues'].split(',')))
+
+
+def compile_param_json(param_json):
+    name_indexes = {}
+    compile_memory = _make_memory_compiler(name_indexes)
+
+    memories = [compile_memory(m['id'], m['param']) for m in param_json['memory']]
+    system = compile_memory(SYSTEM_MEMORY, param_json['system']['param'])
+
+    scratch_memory = None
+    if 'scratchmemory' in param_json:
+        scratch_memory = _compile_scratch_memory(param_json['scratchmemory'])
+    voice_alerts = None
+    if 'voicealerts' in param_json:
+        voice_alerts = [CompiledVoiceAlert(a['alertindex'], a['hash'], a['wavefilename'], base64.b64decode(a['encodeddata']))
+                        for a in param_json['voicealerts']]
+
+    return CompiledParamFile(header={k: param_json[k] for k in HEADER_KEYS if k in param_json},
+                             names=tuple(name_indexes),
+                             memories=memories,
+                             system=system,
+                             transducers=param_json.get('transducer', []),
+                             scratch_memory=scratch_memory,
+                             voice_alerts=voice_alerts)
+
+
+@dataclass
+class VoiceAlertEntry:
+    """A voice alert read by stream_voice_alerts() (its data went to the sink)"""
+    alert_index: int
+    hash: int
+    wave_file_name: str
+    size: int
+
+
+class _TextStream:
+    """A window over a text file that is read in chunks, so only the part being parsed is held in memory"""
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+
+    def read_more(self):
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            raise ValueError("Unexpected end of the .param file")
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Returns the next non-whitespace character (without consuming it)"""
+        while True:
+            try:
+                self.pos = _skip_whitespace(self.text, self.pos)
+                return self.text[self.pos]
+            except _Truncated:
+                self.read_more()
+
+    def expect(self, characters):
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in the .param file but found {character!r}")
+        self.pos += 1
+        return character
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, self.pos = _decode_value(self.text, self.pos)
+                return value
+            except _Truncated:
+                self.read_more()
+
+    def string_pieces(self):
+        """Yields the next JSON string in pieces of at most about chunk_size characters (escapes are not decoded)"""
+        self.expect('"')
+        while True:
+            end = self.text.find('"', self.pos)
+            if end >= 0:
+                piece, self.pos = self.text[self.pos:end], end + 1
+                if piece:
+                    yield piece
+                return
+            piece, self.pos = self.text[self.pos:], len(self.text)
+            if piece:
+                yield piece
+            self.read_more()
+
+
+def _iter_array(stream, read_item):
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.pos += 1
+        return
+    while True:
+        yield read_item()
+        if stream.expect(',]') == ']':
+            return
+
+
+def _decode_base64_pieces(pieces, sink):
+    """Decodes base64 text given in pieces, passing the bytes to sink() as they are decoded. Returns the size."""
+    carry = ''
+    size = 0
+    for piece in pieces:
+        text = carry + piece
+        if '\\' in text:
+            # JSON allows '/' to be escaped. Keep a trailing backslash until the next piece.
+            text = text.replace('\\/', '/')
+            if '\\' in text.rstrip('\\') or text.endswith('\\\\'):
+                raise ValueError("Unexpected escape in base64 data")
+        usable = len(text.rstrip('\\'))
+        usable -= usable % 4
+        if usable:
+            data = base64.b64decode(text[:usable])
+            sink(data)
+            size += len(data)
+        carry = text[usable:]
+    if carry:
+        raise ValueError("Truncated base64 data")
+    return size
+
+
+def _read_voice_alert(stream, sink):
+    fields = {'size': 0}
+    stream.expect('{')
+    if stream.peek() != '}':
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key == 'encodeddata':
+                fields['size'] = _decode_base64_pieces(stream.string_pieces(), sink)
+            else:
+                fields[key] = stream.value()
+            if stream.expect(',}') == '}':
+                break
+    else:
+        stream.pos += 1
+    return VoiceAlertEntry(fields.get('alertindex'), fields.get('hash'), fields.get('wavefilename'), fields['size'])
+
+
+def _iter_param_entries(fp, voice_alert_sink, chunk_size):
+    """
+    Yields (key, value) for the top-level entries of a .param file while reading it in chunks.
+    'memory' and 'voicealerts' are yielded as iterators over their items (each voice alert is a
+    VoiceAlertEntry, yielded after its data has been passed to voice_alert_sink() in chunks).
+    """
+    stream = _TextStream(fp, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key in ('memory', 'voicealerts'):
+            read_item = stream.value if key == 'memory' else lambda: _read_voice_alert(stream, voice_alert_sink)
+            items = _iter_array(stream, read_item)
+            yield key, items
+            # Skip the items that weren't used
+            for _ in items:
+                pass
+        else:
+            yield key, stream.value()
+        if stream.expect(',}') == '}':
+            return
+
+
+def compile_param_file(param_file, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Compiles a .param file like compile_param_json(), but streams it instead of loading the
+    whole JSON document: the voice alerts are decoded from base64 piece by piece, so their
+    text is never held in memory
+    """
+    name_indexes = {}
+    compile_memory = _make_memory_compiler(name_indexes)
+    header = {}
+    memories = []
+    system = None
+    transducers = []
+    scratch_memory = None
+    voice_alerts = None
+    data = bytearray()
+    with Path(param_file).open() as fp:
+        for key, value in _iter_param_entries(fp, data.extend, chunk_size):
+            if key in HEADER_KEYS:
+                header[key] = value
+            elif key == 'memory':
+                memories = [compile_memory(m['id'], m['param']) for m in value]
+            elif key == 'system':
+                system = compile_memory(SYSTEM_MEMORY, value['param'])
+            elif key == 'transducer':
+                transducers = value
+            elif key == 'scratchmemory':
+                scratch_memory = _compile_scratch_memory(value)
+            elif key == 'voicealerts':
+                voice_alerts = []
+                for alert in value:
+                    voice_alerts.append(CompiledVoiceAlert(alert.alert_index, alert.hash, alert.wave_file_name, bytes(data)))
+                    data.clear()
+
+    if system is None:
+        raise ValueError(f"{param_file} is not a valid .param file (it has no system memory)")
+    return CompiledParamFile(header=header,
+                             names=tuple(name_indexes),
+                             memories=memories,
+                             system=system,
+                             transducers=transducers,
+                             scratch_memory=scratch_memory,
+                             voice_alerts=voice_alerts)
+
+
+def stream_voice_alerts(param_file, sink, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Decodes the voice alerts of a .param file in chunks of bytes, passing each one to sink() as
+    soon as it is decoded. Returns a VoiceAlertEntry per alert (or None if the file has none).
+    """
+    with Path(param_file).open() as fp:
+        for key, value in _iter_param_entries(fp, sink, chunk_size):
+            if key == 'voicealerts':
+                return list(value)
+    return None
+
+
+def get_content_hash(param_file):
+    content_hash = hashlib.sha256()
+    with Path(param_file).open('rb') as fp:
+        for chunk in iter(lambda: fp.read(STREAM_CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def _get_compiled_cache_file(content_hash):
+    return get_cache_dir('params') / f"{content_hash}.v{COMPILED_FORMAT_VERSION}.pickle"
+
+
+def cache_compiled_param_file(content_hash, compiled_param_file):
+    """Stores the compiled form of the .param file with this content hash (e.g. one that was just rebuilt from it)"""
+    cache_file = _get_compiled_cache_file(content_hash)
+    temp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+    with temp_file.open('wb') as fp:
+        pickle.dump(compiled_param_file, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    temp_file.replace(cache_file)
+
+
+def load_compiled_param_file(param_file, use_cache=True):
+    """
+    Returns the CompiledParamFile for a .param file. Compiled files are cached on disk, keyed
+    by the SHA-256 of the file contents, so edited files are always recompiled.
+    """
+    content_hash = get_content_hash(param_file)
+    cache_file = _get_compiled_cache_file(content_hash)
+    if use_cache and cache_file.exists():
+        with cache_file.open('rb') as fp:
+            return pickle.load(fp)
+
+    compiled = compile_param_file(param_file)
+    if use_cache:
+        cache_compiled_param_file(content_hash, compiled)
+    return compiled
+
+
+def apply_overrides(compiled_param_file, overrides):
+    """
+    Returns a copy of a CompiledParamFile with `overrides` ({(memory, name): value}, where
+    memory is SYSTEM_MEMORY or a memory id) applied. Raises ValueError listing every override
+    that does not match a parameter in the file.
+    """
+    name_indexes = {name: i for i, name in enumerate(compiled_param_file.names)}
+    memories = {m.id: m for m in compiled_param_file.all_memories()}
+    updated = {}
+    errors = []
+    for (memory_id, name), value in overrides.items():
+        if memory_id not in memories:
+            errors.append(f"{memory_id}:{name}: unknown memory")
+            continue
+        memory = updated.get(memory_id)
+        if memory is None:
+            memory = memories[memory_id]
+            memory = updated[memory_id] = replace(memory, values=array('d', memory.values))
+        if name not in name_indexes or name_indexes[name] not in memory.name_indexes:
+            errors.append(f"{memory_id}:{name}: unknown parameter")
+            continue
+        position = memory.name_indexes.index(name_indexes[name])
+        try:
+            memory.values[position] = coerce_value(memory.types[position], value)
+        except ValueError as e:
+            errors.append(f"{memory_id}:{name}: {e}")
+    if errors:
+        raise ValueError("Invalid parameter overrides:\n  " + "\n  ".join(errors))
+
+    return replace(compiled_param_file,
+                   memories=[updated.get(m.id, m) for m in compiled_param_file.memories],
+                   system=updated.get(SYSTEM_MEMORY, compiled_param_file.system))
+
+
+def write_param_file(compiled_param_file, path):
+    path = Path(path)
+    temp_file = path.with_suffix(f'.{os.getpid()}.tmp')
+    with temp_file.open('w') as fp:
+        json.dump(compiled_param_file.to_param_json(), fp, indent=2)
+    temp_file.replace(path)
@@ -0,0 +1,158 @@
+"""
+Plans a programming run for --dry-run: the paths are resolved and the .param files read, and
+the steps that would run are printed with an estimate of how long each one takes, all without
+loading the SDK or touching a device. The estimates multiply the parameter and data counts in
+each .param file by the nominal per-operation latencies of the simulated SDK (SimLatencies in
+sim_sdk.py), so they are best used to compare options (e.g. --verify-nvm-writes against
+--verify-burn) rather than as exact times.
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+import os
+
+from common import get_library_path, get_tuned_interface_options
+from param_file import read_param_header, load_compiled_param_file
+from sim_sdk import SimLatencies
+
+
+@dataclass
+class PlannedStep:
+    name: str
+    cost: float = 0.0
+    detail: str = ''
+    repeat: int = 1
+
+
+@dataclass
+class Plan:
+    title: str
+    notes: list = field(default_factory=list)
+    steps: list = field(default_factory=list)
+    latencies: SimLatencies = field(default_factory=SimLatencies, repr=False)
+
+    def add(self, name, detail='', repeat=1, **counts):
+        """Adds a step that costs the sum of count * latency for each of the SimLatencies `counts`"""
+        cost = sum(getattr(self.latencies, latency) * count for latency, count in counts.items())
+        self.steps.append(PlannedStep(name, cost, detail, repeat))
+
+    @property
+    def total_cost(self):
+        return sum(step.cost * step.repeat for step in self.steps)
+
+    def print(self):
+        print(f"Dry run: {self.title}")
+        for note in self.notes:
+            print(f"  {note}")
+        print()
+        width = max([len(step.name) for step in self.steps] + [len('Step')])
+        print(f"{'Step':<{width}}  {'Repeat':>6}  {'Est. (s)':>9}  Detail")
+        for step in self.steps:
+            print(f"{step.name:<{width}}  {step.repeat:>6}  {step.cost * step.repeat:>9.3f}  {step.detail}".rstrip())
+        print(f"{'Total':<{width}}  {'':>6}  {self.total_cost:>9.3f}")
+        print("\nNothing was loaded or programmed (the estimates use the nominal latencies in sim_sdk.SimLatencies)")
+
+
+@dataclass
+class ParamFileSummary:
+    """The counts from a .param file that the cost of programming it depends on"""
+    path: Path
+    header: dict
+    parameters: int
+    system_parameters: int
+    memories: int
+    manufacturer_data_bytes: int
+    voice_alert_bytes: int
+
+    @classmethod
+    def read(cls, param_file):
+        compiled_param_file = load_compiled_param_file(param_file)
+        return cls(path=Path(param_file),
+                   header=read_param_header(param_file),
+                   parameters=sum(len(m) for m in compiled_param_file.all_memories()),
+                   system_parameters=len(compiled_param_file.system),
+                   memories=len(compiled_param_file.all_memories()),
+                   manufacturer_data_bytes=0 if compiled_param_file.scratch_memory is None
+                   else len(compiled_param_file.scratch_memory) * 4,
+                   voice_alert_bytes=sum(len(a.data) for a in compiled_param_file.voice_alerts or []))
+
+    def describe(self):
+        return f"{self.path} ({self.header.get('product')}, library ID {self.header.get('libraryid')}: " \
+               f"{self.parameters} parameters in {self.memories} memories, {self.voice_alert_bytes} voice alert " \
+               f"bytes, {self.manufacturer_data_bytes} manufacturer data bytes)"
+
+
+def add_setup_notes(plan, args, programmer=None):
+    """Notes where the SDK, the library and the interface options would come from"""
+    if getattr(args, 'daemon', None) is not None:
+        plan.notes.append(f"SDK: the programming daemon at {args.daemon} (already loaded)")
+        return
+    sdk_root = os.environ.get('SD_SDK_ROOT')
+    plan.notes.append(f"SDK root: {sdk_root or '(not set, use --sdk-root or SD_SDK_ROOT)'}")
+    library_file = getattr(args, 'library_file', None)
+    if sdk_root is not None or library_file is not None:
+        library_path = get_library_path(args.product, library_file)
+        found = '' if Path(library_path).is_file() else ' (not found)'
+        plan.notes.append(f"Library: {library_path}{found}, product index {getattr(args, 'product_index', 0)}")
+    if programmer is not None:
+        interface_options = args.interface_options
+        source = '--interface-options'
+        if interface_options is None:
+            interface_options = get_tuned_interface_options(programmer, args.product)
+            source = 'tuned with tune_interface.py' if interface_options is not None else 'SDK defaults'
+        plan.notes.append(f"Interface: {programmer} with {interface_options or ''!r} ({source})")
+
+
+def add_startup_steps(plan, args):
+    """The one-time cost of loading the SDK and the library (paid by the daemon instead, with --daemon)"""
+    if getattr(args, 'daemon', None) is None:
+        plan.add('create_communication_interface', "loads the SDK", product_manager=1)
+        plan.add('load_product', f"{args.product}", load_library=1)
+
+
+def add_connect_steps(plan, upgrade_firmware=False, repeat=1):
+    plan.add('detect_device', repeat=repeat, detect=1)
+    if upgrade_firmware:
+        plan.add('firmware_compatibility_check', repeat=repeat, compatibility=1)
+        plan.add('update_firmware', "only if the firmware is not up to date", repeat=repeat,
+                 firmware_update=1, reboot=1)
+    plan.add('initialize_device', "plus configure_device if the device is blank", repeat=repeat, initialize=1)
+    if not upgrade_firmware:
+        plan.add('firmware_compatibility_check', "skipped for a device already seen by the session", repeat=repeat,
+                 compatibility=1)
+
+
+def add_program_steps(plan, summary, args, configure_device=True, overrides='', repeat=1):
+    """The steps of common.program_from_param_file()"""
+    parameters = summary.parameters
+    plan.add('mute', repeat=repeat)
+    plan.add('select_memory', repeat=repeat)
+    if getattr(args, 'use_snapshot', False) and not getattr(args, 'delta_burn', False):
+        plan.add('restore_all_parameters', f"{summary.system_parameters} system parameters if the snapshot is fresh, "
+                 f"otherwise {parameters}", repeat=repeat, read_parameter=summary.system_parameters)
+    else:
+        plan.add('restore_all_parameters', f"{parameters} parameters", repeat=repeat, read_parameter=parameters)
+    data_detail = "voice alerts streamed" if getattr(args, 'stream_voice_alerts', False) else ''
+    plan.add('load_param_file', data_detail, repeat=repeat, configure=1 if configure_device else 0,
+             manufacturer_data_byte=summary.manufacturer_data_bytes, voice_alert_byte=summary.voice_alert_bytes)
+    if overrides:
+        plan.add('apply_overrides', overrides, repeat=repeat)
+
+    verify_writes = parameters if getattr(args, 'verify_nvm_writes', False) else 0
+    if getattr(args, 'delta_burn', False):
+        plan.add('burn_changed_parameters', "at most (only the memories that differ are written)", repeat=repeat,
+                 write_parameter=parameters, verify_write=verify_writes)
+    else:
+        plan.add('burn_all_parameters', f"{parameters} parameters" + (", every write verified" if verify_writes else ''),
+                 repeat=repeat, write_parameter=parameters, verify_write=verify_writes)
+    if getattr(args, 'verify_burn', False):
+        retries = getattr(args, 'verify_retries', 0)
+        plan.add('verify_burn', f"plus up to {retries} rewrite(s) of the memories that differ" if retries else '',
+                 repeat=repeat, read_parameter=parameters)
+    plan.add('unmute', repeat=repeat)
+    plan.add('reset', repeat=repeat, reset=1)
+
+
+def add_delete_bonds_steps(plan, repeat=1):
+    plan.add('wait_for_device', "the reboot after the reset", repeat=repeat, reboot=1)
+    plan.add('initialize_device', repeat=repeat, initialize=1)
+    plan.add('clear_bond_table', repeat=repeat, clear_bond_table=1)
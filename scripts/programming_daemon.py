@@ -0,0 +1,301 @@
+"""
+A long-lived programming daemon that keeps the ProductManager, the .library files and the
+products loaded between devices. Scripts submit jobs to it with their --daemon option.
+"""
+from multiprocessing.connection import Listener, Client
+from contextlib import redirect_stdout
+import argparse
+import io
+import os
+import secrets
+import sys
+import traceback
+
+from cmd_line_args import get_programmer, get_side, set_sdk_root, simulate_sdk
+from common import DeviceSession, create_communication_interface, get_library_path, check_param_file_library, \
+    get_tuned_interface_options, get_cache_dir
+from metrics import start_metrics, stop_metrics, get_metrics_collector
+from tracing import start_tracing, stop_tracing, get_tracer, set_trace_metadata
+
+
+if sys.platform == 'win32':
+    DEFAULT_ADDRESS = r'\\.\pipe\sd_sdk_utils'
+else:
+    DEFAULT_ADDRESS = ('localhost', 47160)
+
+
+
+def get_authkey():
+    """
+    Returns the key that clients need to submit jobs. Requests are unpickled, so anyone with the
+    key can run code as the daemon: it is 'SD_SDK_DAEMON_AUTHKEY' if set, otherwise a random key
+    generated once per user and kept in the cache folder, readable only by that user.
+    """
+    if os.environ.get('SD_SDK_DAEMON_AUTHKEY'):
+        return os.environ['SD_SDK_DAEMON_AUTHKEY'].encode()
+    path = get_cache_dir('daemon') / 'authkey'
+    if not path.exists():
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(secrets.token_hex(32))
+        try:
+            # Unlike a rename, this fails instead of replacing a key another process just created
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    if sys.platform != 'win32' and path.stat().st_mode & 0o077:
+        raise PermissionError(f"{path} can be read by other users, delete it (a new key is generated) "
+                              f"or make it readable only by you")
+    return path.read_text().strip().encode()
+
+
+def parse_address(value):
+    """Accepts 'default', a named pipe (\\\\.\\pipe\\name), a Unix socket path or [HOST:]PORT"""
+    if value is None or value == 'default':
+        return DEFAULT_ADDRESS
+    if value.startswith('\\\\') or '/' in value:
+        return value
+    host, _, port = value.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+class SdkCache:
+    """Loads the ProductManager once and caches libraries, products and communication interfaces"""
+    def __init__(self):
+        from sd_sdk_python import get_product_manager
+        self.product_manager = get_product_manager()
+        self.libraries = {}
+        self.products = {}
+        self.interfaces = {}
+        self.sessions = {}
+
+    def get_product(self, product_name, library_file=None, product_index=0, slot=None):
+        """
+        Returns the product for a programmer slot. A product is bound to the device last initialized
+        with it, so each slot gets its own (the library is only loaded once).
+        """
+        library_path = get_library_path(product_name, library_file)
+        key = (library_path, product_index, slot)
+        if key not in self.products:
+            if library_path not in self.libraries:
+                print(f"Loading library {library_path}")
+                self.libraries[library_path] = self.product_manager.LoadLibraryFromFile(library_path)
+            self.products[key] = self.libraries[library_path].Products[product_index].CreateProduct()
+        return self.products[key]
+
+    def get_interface(self, programmer, side, interface_options=None, verify_nvm_writes=False, product_name=None):
+        if interface_options is None and product_name is not None:
+            # Looked up for every job, so retuning takes effect without restarting the daemon
+            interface_options = get_tuned_interface_options(get_programmer(programmer), product_name)
+        key = (programmer, side, interface_options)
+        if key not in self.interfaces:
+            self.interfaces[key] = create_communication_interface(get_programmer(programmer),
+                                                                  get_side(side),
+                                                                  interface_options=interface_options)
+        interface = self.interfaces[key]
+        interface.VerifyNvmWrites = verify_nvm_writes
+        return interface
+
+    def get_device(self, programmer, side, product, interface_options=None, verify_nvm_writes=False,
+                   library_file=None, product_index=0, **kwargs):
+        return (self.get_interface(programmer, side, interface_options, verify_nvm_writes, product),
+                self.get_product(product, library_file, product_index, slot=(programmer, side, interface_options)))
+
+    def get_session(self, programmer, side, product, interface_options=None, verify_nvm_writes=False,
+                    library_file=None, product_index=0, **kwargs):
+        """Returns the DeviceSession for a programmer slot, so what is known about its devices is kept between jobs"""
+        interface, product_object = self.get_device(programmer, side, product, interface_options, verify_nvm_writes,
+                                                    library_file, product_index)
+        key = (programmer, side, interface_options, get_library_path(product, library_file), product_index)
+        session = self.sessions.get(key)
+        if session is None or session.interface is not interface:
+            # The first job for this slot, or its interface was retuned
+            if session is not None:
+                session.release()
+            session = self.sessions[key] = DeviceSession(interface, product_object, product)
+        return session
+
+
+def get_device_job_args(args):
+    """The arguments every device job needs, taken from the parsed command line"""
+    return dict(programmer=args.programmer, side=args.side, product=args.product,
+                interface_options=args.interface_options, verify_nvm_writes=args.verify_nvm_writes,
+                library_file=None if getattr(args, 'library_file', None) is None else str(args.library_file.resolve()),
+                product_index=getattr(args, 'product_index', 0))
+
+
+def _job_ping(cache, **kwargs):
+    return cache.product_manager.Version
+
+
+def _job_configure(cache, param_file, overrides=None, upgrade_firmware=False, delta_burn=False, stream_voice_alerts=False,
+                   verify_burn=False, verify_retries=0, use_snapshot=False, **kwargs):
+    from configure_device import configure_from_param_file
+    session = cache.get_session(**kwargs)
+    check_param_file_library(param_file, session.product, overrides)
+    try:
+        configured_device = session.connect(upgrade_firmware=upgrade_firmware)
+        return configure_from_param_file(configured_device, param_file, overrides=overrides, delta_burn=delta_burn,
+                                         stream_voice_alerts=stream_voice_alerts, verify_burn=verify_burn,
+                                         verify_retries=verify_retries, use_snapshot=use_snapshot)
+    finally:
+        session.release()
+
+
+def _job_read_device_address(cache, upgrade_firmware=False, keep_connected=False, **kwargs):
+    from configure_binaural_pair import read_device_address
+    session = cache.get_session(**kwargs)
+    try:
+        return read_device_address(session, upgrade_firmware=upgrade_firmware)
+    finally:
+        # Unless the next job programs the same device, another device may be attached next
+        if not keep_connected:
+            session.release()
+
+
+def _job_configure_binaural_device(cache, param_file, peer_address, role, enable_asha=True, enable_mfi=True,
+                                   delete_bonds=False, upgrade_firmware=False, delta_burn=False, stream_voice_alerts=False,
+                                   verify_burn=False, verify_retries=0, use_snapshot=False, reboot_timeout=30.0, **kwargs):
+    from configure_binaural_pair import configure_binaural_device
+    session = cache.get_session(**kwargs)
+    check_param_file_library(param_file, session.product)
+    return configure_binaural_device(session, param_file, peer_address, role,
+                                     enable_asha=enable_asha, enable_mfi=enable_mfi, delete_bonds=delete_bonds,
+                                     upgrade_firmware=upgrade_firmware, delta_burn=delta_burn,
+                                     stream_voice_alerts=stream_voice_alerts, verify_burn=verify_burn,
+                                     verify_retries=verify_retries, use_snapshot=use_snapshot,
+                                     reboot_timeout=reboot_timeout)
+
+
+def _job_inspect(cache, use_snapshot=False, **kwargs):
+    from test import inspect_device
+    interface, product = cache.get_device(**kwargs)
+    inspect_device(interface, product, kwargs['product'], use_snapshot=use_snapshot)
+
+
+JOBS = {
+    'ping': _job_ping,
+    'configure': _job_configure,
+    'read_device_address': _job_read_device_address,
+    'configure_binaural_device': _job_configure_binaural_device,
+    'inspect': _job_inspect,
+}
+
+
+def submit_job(address, job, **kwargs):
+    """Runs a job on the daemon, echoes its output and returns its result"""
+    tracer = get_tracer()
+    collector = get_metrics_collector()
+    with Client(parse_address(address), authkey=get_authkey()) as connection:
+        connection.send({'job': job, 'args': kwargs, 'trace': tracer is not None, 'metrics': collector is not None})
+        response = connection.recv()
+    print(response['output'], end='', flush=True)
+    if tracer is not None:
+        tracer.add_events(response.get('trace_events', []))
+    if collector is not None:
+        collector.add_observations(response.get('metric_observations', []))
+    if response['error'] is not None:
+        raise RuntimeError(f"Job '{job}' failed on the programming daemon:\n{response['error']}")
+    return response['result']
+
+
+def handle_request(cache, request):
+    output = io.StringIO()
+    result = error = None
+    if request.get('trace'):
+        start_tracing()
+    if request.get('metrics'):
+        start_metrics()
+    args = request['args']
+    if 'programmer' in args:
+        # The interfaces are cached, so label the steps of this job with its own slot
+        set_trace_metadata(programmer=get_programmer(args['programmer']), product=args.get('product'))
+    try:
+        with redirect_stdout(output):
+            result = JOBS[request['job']](cache, **request['args'])
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        tracer = stop_tracing()
+        collector = stop_metrics()
+    return {'result': result, 'error': error, 'output': output.getvalue(),
+            'trace_events': [] if tracer is None else tracer.events,
+            'metric_observations': [] if collector is None else collector.observations}
+
+
+def serve(address, preload_products=()):
+    cache = SdkCache()
+    for product_name in preload_products:
+        cache.get_product(product_name)
+
+    with Listener(address, authkey=get_authkey()) as listener:
+        print(f"Programming daemon listening on {address}", flush=True)
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                print(f"Rejected a connection: {e!r}", flush=True)
+                continue
+            with connection:
+                request = connection.recv()
+                if request['job'] == 'shutdown':
+                    connection.send({'result': None, 'error': None, 'output': "Programming daemon stopped\n"})
+                    break
+                print(f"Running job '{request['job']}'", flush=True)
+                response = handle_request(cache, request)
+                print(response['output'], end='')
+                if response['error'] is not None:
+                    print(response['error'], end='')
+                connection.send(response)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sdk-root",
+        action="store",
+        default=None,
+        help="Path to the Sound Designer SDK root folder (or set 'SD_SDK_ROOT' in your environment)",
+        type=set_sdk_root,
+    )
+    parser.add_argument(
+        "--address",
+        action="store",
+        default="default",
+        help="Address to listen on (a named pipe, a Unix socket path or [HOST:]PORT)",
+    )
+    parser.add_argument(
+        "--preload",
+        action="append",
+        default=[],
+        help="Load the default library for this product at startup (e.g. E7160SL)",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store",
+        nargs="?",
+        const="1.0",
+        default=None,
+        metavar="LATENCY_SCALE",
+        help="Use the simulated SDK and devices in sim_sdk.py instead of real hardware",
+        type=simulate_sdk,
+    )
+    parser.add_argument(
+        "--shutdown",
+        action="store_true",
+        default=False, help="Stop the daemon running at --address"
+    )
+    args = parser.parse_args(argv)
+
+    if args.shutdown:
+        submit_job(args.address, 'shutdown')
+        return
+
+    serve(parse_address(args.address), args.preload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,681 @@
+"""
+An in-process simulation of the parts of the Sound Designer SDK used by these scripts.
+
+Calling install() registers fake 'sd_sdk_python' and 'sd_sdk_python.sd_sdk' modules so the
+existing scripts run unchanged (and without hardware) on any machine. The product definition
+is derived from a .param file (SD_SDK_SIM_PARAM_FILE, default configs/binaural_pair_default.param)
+and the per-operation latencies come from SimLatencies, scaled by `latencies.scale` and
+optionally overridden with a JSON object in SD_SDK_SIM_LATENCIES.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+import base64
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import types
+import zlib
+
+
+DEFAULT_PARAM_FILE = Path(__file__).resolve().parent.parent / 'configs' / 'binaural_pair_default.param'
+
+FIRMWARE_VERSION = '1.15.1576'
+RADIO_APPLICATION_VERSION = '1.15.1576'
+
+
+@dataclass
+class SimLatencies:
+    """Per-operation latencies (in seconds) of the simulated SDK and hardware"""
+    product_manager: float = 2.0
+    load_library: float = 1.5
+    detect: float = 0.05
+    compatibility: float = 0.02
+    initialize: float = 0.2
+    configure: float = 1.0
+    read_parameter: float = 0.0002
+    write_parameter: float = 0.0005
+    # Reading back each write as it happens (VerifyNvmWrites) costs a bus turnaround per
+    # parameter, unlike the streamed reads of ReadParameters()
+    verify_write: float = 0.0005
+    voice_alert_byte: float = 0.000002
+    manufacturer_data_byte: float = 0.00001
+    firmware_update: float = 120.0
+    reset: float = 0.1
+    reboot: float = 2.0
+    clear_bond_table: float = 0.2
+    scale: float = 1.0
+
+    def wait(self, name, count=1):
+        delay = getattr(self, name) * count * self.scale
+        if delay > 0:
+            time.sleep(delay)
+
+
+latencies = SimLatencies()
+
+# The bus speed (in kHz) of an interface created without a 'speed=N' option, and the fastest
+# speed each programmer transfers parameters at reliably (faster transfers sometimes fail)
+DEFAULT_INTERFACE_SPEED = 400
+MAX_RELIABLE_INTERFACE_SPEED = {'Communication Accelerator Adaptor': 1600, 'DSP3': 800, 'Promira': 3200}
+
+# Fraction of WriteParameters() calls that store one parameter incorrectly (unless the
+# interface verifies its writes), set with SD_SDK_SIM_WRITE_ERROR_RATE
+write_error_rate = 0.0
+_random = random.Random(1)
+
+
+# Constants mirroring the 'sd' module
+class _SdConstants:
+    kNvmMemory0, kNvmMemory1, kNvmMemory2, kNvmMemory3 = 0, 1, 2, 3
+    kNvmMemory4, kNvmMemory5, kNvmMemory6, kNvmMemory7 = 4, 5, 6, 7
+    kActiveMemory = 8
+    kSystemNvmMemory = 9
+    kSystemActiveMemory = 10
+
+    kLeft = 0
+    kRight = 1
+
+    kInteger = 0
+    kBoolean = 1
+    kDouble = 2
+    kIndexedList = 3
+    kIndexedTextList = 4
+    kByte = 5
+
+    kUnknownCompatibility = 0
+    kIncompatible = 1
+    kCompatibleUpgradable = 2
+    kCompatibleUpToDate = 3
+
+    kPureTone = 1
+
+
+class SimDevice:
+    """The non-volatile state of one simulated hearing aid"""
+    def __init__(self, mac, firmware_version=FIRMWARE_VERSION, radio_application_version=RADIO_APPLICATION_VERSION):
+        self.mac = mac
+        self.firmware_version = firmware_version
+        self.radio_application_version = radio_application_version
+        self.configured = False
+        self.memories = [{} for _ in range(8)]
+        self.system = {}
+        self.voice_alerts = b''
+        self.manufacturer_data = bytes(4096)
+        self.bond_count = 1
+        self.offline_until = 0.0
+        self.parameters_written = 0
+        self.parameters_read = 0
+
+    def nvm(self, memory):
+        return self.system if memory == _SdConstants.kSystemNvmMemory else self.memories[memory]
+
+    def copy(self, mac):
+        """Returns a new device with the same firmware and NVM contents (e.g. an already programmed unit)"""
+        device = SimDevice(mac, self.firmware_version, self.radio_application_version)
+        device.configured = self.configured
+        device.memories = [dict(m) for m in self.memories]
+        device.system = dict(self.system)
+        device.voice_alerts = self.voice_alerts
+        device.manufacturer_data = self.manufacturer_data
+        device.bond_count = self.bond_count
+        return device
+
+
+_lock = threading.Lock()
+_devices = {}
+_next_mac = 0x60c0bf000001
+
+
+def _allocate_mac():
+    global _next_mac
+    with _lock:
+        mac = _next_mac
+        _next_mac += 1
+    return mac
+
+
+def attach_device(programmer, side, mac=None, template=None, **kwargs):
+    """Attach a new simulated device (optionally a copy of `template`) to the given programmer/side"""
+    if mac is None:
+        mac = _allocate_mac()
+    device = SimDevice(mac, **kwargs) if template is None else template.copy(mac)
+    with _lock:
+        _devices[(programmer, side)] = device
+    return device
+
+
+def detach_device(programmer, side):
+    with _lock:
+        return _devices.pop((programmer, side), None)
+
+
+def _get_default_device_versions():
+    """Versions for auto-attached devices, e.g. SD_SDK_SIM_DEVICE_FIRMWARE='1.14.1000[/1.14.1000]' for out of date devices"""
+    versions = os.environ.get('SD_SDK_SIM_DEVICE_FIRMWARE')
+    if not versions:
+        return {}
+    firmware_version, _, radio_application_version = versions.partition('/')
+    return dict(firmware_version=firmware_version, radio_application_version=radio_application_version or firmware_version)
+
+
+def get_attached_device(programmer, side, auto_attach=True):
+    with _lock:
+        device = _devices.get((programmer, side))
+    if device is None and auto_attach:
+        # Give each port its own (stable) MAC address, even across processes
+        mac = 0x60c0bf000000 | (zlib.crc32(f"{programmer}/{side}".encode()) & 0xFFFFFF)
+        device = attach_device(programmer, side, mac=mac, **_get_default_device_versions())
+    return device
+
+
+class SimDeviceInfo:
+    def __init__(self, device, definition):
+        self.IsValid = True
+        self.LibraryId = definition.LibraryId
+        self.ProductId = definition.ProductId
+        self.ChipId = 7160
+        self.ChipVersion = 1
+        self.HybridId = 0
+        self.FirmwareId = definition.FirmwareId
+        self.FirmwareVersion = device.firmware_version
+        self.SerialId = device.mac & 0xFFFFFFFF
+        self.ParameterLockState = False
+        self.RadioApplicationVersion = device.radio_application_version
+        self.RadioBootloaderVersion = '1.0.0'
+        self.RadioSoftDeviceVersion = '1.0.0'
+        self.HybridSerial = device.mac
+        self.HybridRevision = 0
+        self.HybridTester = 0
+
+    def __str__(self):
+        return f"DeviceInfo(FirmwareId={self.FirmwareId}, FirmwareVersion={self.FirmwareVersion}, " \
+               f"RadioApplicationVersion={self.RadioApplicationVersion}, SerialId={self.SerialId})"
+
+
+def _parse_interface_speed(settings):
+    """Returns the 'speed=N' option from interface settings such as 'unit=2,speed=800'"""
+    for option in settings.replace(';', ',').split(','):
+        name, _, value = option.partition('=')
+        if name.strip().lower() == 'speed':
+            return int(value)
+    return DEFAULT_INTERFACE_SPEED
+
+
+class SimCommunicationInterface:
+    def __init__(self, programmer, side, settings):
+        self.programmer = programmer
+        self.side = side
+        self.settings = settings
+        self.speed = _parse_interface_speed(settings)
+        self.VerifyNvmWrites = False
+        self.MuteDuringCommunication = True
+        self.definition = None
+
+    def transfer(self, name, count):
+        """Waits for a parameter transfer at the interface speed (a transfer that is too fast may fail)"""
+        latencies.wait(name, count * DEFAULT_INTERFACE_SPEED / self.speed)
+        max_speed = MAX_RELIABLE_INTERFACE_SPEED.get(self.programmer, DEFAULT_INTERFACE_SPEED)
+        if self.speed > max_speed and _random.random() < min(0.9, self.speed / max_speed - 1):
+            raise RuntimeError(f"Communication error on {self.programmer} ({self.side}) at {self.speed} kHz")
+
+    @property
+    def device(self):
+        device = get_attached_device(self.programmer, self.side)
+        if device is None or time.monotonic() < device.offline_until:
+            raise RuntimeError(f"No device detected on {self.programmer} ({self.side})")
+        return device
+
+    def DetectDevice(self):
+        latencies.wait('detect')
+        return SimDeviceInfo(self.device, _default_definition())
+
+    def ClearBondTableOnDevice(self):
+        latencies.wait('clear_bond_table')
+        self.device.bond_count = 0
+
+
+class SimParameter:
+    def __init__(self, name, param_type, value):
+        self.Id = name
+        self.Type = param_type
+        self.Value = 0
+        self.BooleanValue = False
+        self.DoubleValue = 0.0
+        if param_type == _SdConstants.kBoolean:
+            self.Min, self.Max = 0, 1
+        elif param_type == _SdConstants.kDouble:
+            self.Min, self.Max = 0, 0
+        else:
+            self.Min, self.Max = -(1 << 23), (1 << 24) - 1
+        self.DoubleMin, self.DoubleMax = -1.0e9, 1.0e9
+        self.set_from_string(value)
+
+    def get(self):
+        if self.Type == _SdConstants.kBoolean:
+            return self.BooleanValue
+        if self.Type == _SdConstants.kDouble:
+            return self.DoubleValue
+        return self.Value
+
+    def set(self, value):
+        if self.Type == _SdConstants.kBoolean:
+            self.BooleanValue = bool(value)
+        elif self.Type == _SdConstants.kDouble:
+            self.DoubleValue = float(value)
+        else:
+            self.Value = int(value)
+
+    def set_from_string(self, value):
+        if self.Type == _SdConstants.kBoolean:
+            self.BooleanValue = value.lower() == 'true'
+        elif self.Type == _SdConstants.kDouble:
+            self.DoubleValue = float(value)
+        else:
+            self.Value = int(value)
+
+
+class SimParameters:
+    def __init__(self, parameters):
+        self._parameters = parameters
+        self._by_id = {p.Id: p for p in parameters}
+
+    def __iter__(self):
+        return iter(self._parameters)
+
+    def __len__(self):
+        return len(self._parameters)
+
+    def GetById(self, name):
+        return self._by_id.get(name)
+
+
+class SimParameterMemory:
+    def __init__(self, param_entries):
+        self.Parameters = SimParameters([SimParameter(name, param_type, value) for name, param_type, value in param_entries])
+
+
+def _param_type(value):
+    if value.lower() in ('true', 'false'):
+        return _SdConstants.kBoolean
+    if '.' in value:
+        return _SdConstants.kDouble
+    return _SdConstants.kInteger
+
+
+class SimProductDefinition:
+    """A product definition derived from the contents of a .param file"""
+    def __init__(self, param_file):
+        with open(param_file) as fp:
+            param_json = json.load(fp)
+        self.LibraryId = param_json['libraryid']
+        self.ProductId = 1
+        self.Name = param_json['product']
+        self.FirmwareId = 'E7160SL'
+        self.UpdateFirmwareVersion = FIRMWARE_VERSION
+        self.UpdateRadioApplicationVersion = RADIO_APPLICATION_VERSION
+        self.ManufacturerDataAreaLength = 4096
+        self.VoiceAlertsTotalMemory = 256 * 1024
+        self.memory_entries = [[(p['name'], _param_type(p['value']), p['value']) for p in m['param']]
+                               for m in param_json['memory']]
+        self.system_entries = [(p['name'], _param_type(p['value']), p['value']) for p in param_json['system']['param']]
+
+    def GetDeviceCompatibility(self, interface):
+        latencies.wait('compatibility')
+        device = interface.device
+        if device.firmware_version == self.UpdateFirmwareVersion and \
+                device.radio_application_version == self.UpdateRadioApplicationVersion:
+            return _SdConstants.kCompatibleUpToDate
+        return _SdConstants.kCompatibleUpgradable
+
+    def UpdateDevice(self, interface):
+        latencies.wait('firmware_update')
+        device = interface.device
+        device.firmware_version = self.UpdateFirmwareVersion
+        device.radio_application_version = self.UpdateRadioApplicationVersion
+        return "Update complete"
+
+
+_definitions = {}
+
+
+def _default_definition(param_file=None):
+    param_file = str(param_file or os.environ.get('SD_SDK_SIM_PARAM_FILE', DEFAULT_PARAM_FILE))
+    with _lock:
+        if param_file not in _definitions:
+            _definitions[param_file] = SimProductDefinition(param_file)
+        return _definitions[param_file]
+
+
+class SimProduct:
+    def __init__(self, definition):
+        self.Definition = definition
+        self.Memories = [SimParameterMemory(entries) for entries in definition.memory_entries]
+        self.SystemMemory = SimParameterMemory(definition.system_entries)
+        self.CurrentMemory = 0
+        self.InputSignal = 0
+        self.interface = None
+
+    def _memory(self, memory):
+        if memory in (_SdConstants.kSystemNvmMemory, _SdConstants.kSystemActiveMemory):
+            return self.SystemMemory
+        if memory == _SdConstants.kActiveMemory:
+            memory = self.CurrentMemory
+        return self.Memories[memory]
+
+    def _nvm_index(self, memory):
+        if memory == _SdConstants.kSystemActiveMemory:
+            return _SdConstants.kSystemNvmMemory
+        if memory == _SdConstants.kActiveMemory:
+            return self.CurrentMemory
+        return memory
+
+    @property
+    def device(self):
+        if self.interface is None:
+            raise RuntimeError("Device has not been initialized")
+        return self.interface.device
+
+    @property
+    def DeviceMACAddress(self):
+        return f"{self.device.mac:012x}"
+
+    def InitializeDevice(self, interface):
+        latencies.wait('initialize')
+        self.interface = interface
+        return interface.device.configured
+
+    def ConfigureDevice(self):
+        latencies.wait('configure')
+        device = self.device
+        device.configured = True
+        for memory in list(range(len(self.Memories))) + [_SdConstants.kSystemNvmMemory]:
+            device.nvm(memory).update({p.Id: p.get() for p in self._memory(memory).Parameters})
+
+    def CloseDevice(self):
+        self.interface = None
+
+    def SwitchToMemory(self, memory):
+        self.CurrentMemory = memory
+
+    def MuteDevice(self, mute):
+        self.device
+
+    def ResetDevice(self):
+        latencies.wait('reset')
+        self.device.offline_until = time.monotonic() + latencies.reboot * latencies.scale
+
+    def ReadParameters(self, memory):
+        parameters = self._memory(memory).Parameters
+        device = self.device
+        self.interface.transfer('read_parameter', len(parameters))
+        nvm = device.nvm(self._nvm_index(memory))
+        for p in parameters:
+            if p.Id in nvm:
+                p.set(nvm[p.Id])
+        device.parameters_read += len(parameters)
+
+    def WriteParameters(self, memory):
+        parameters = self._memory(memory).Parameters
+        device = self.device
+        self.interface.transfer('write_parameter', len(parameters))
+        values = {p.Id: p.get() for p in parameters}
+        if self.interface.VerifyNvmWrites:
+            # Every write is read back (and retried if it doesn't match)
+            self.interface.transfer('verify_write', len(parameters))
+            device.parameters_read += len(parameters)
+        elif write_error_rate and _random.random() < write_error_rate:
+            name = _random.choice(list(values))
+            values[name] = _corrupt_value(values[name])
+        device.nvm(self._nvm_index(memory)).update(values)
+        device.parameters_written += len(parameters)
+
+    def LoadParamFile(self, param_file, configure_device, write_manufacturer_data, write_voice_alerts):
+        with open(param_file) as fp:
+            param_json = json.load(fp)
+        for m in param_json['memory']:
+            parameters = self.Memories[m['id']].Parameters
+            for p in m['param']:
+                parameter = parameters.GetById(p['name'])
+                if parameter is not None:
+                    parameter.set_from_string(p['value'])
+        for p in param_json['system']['param']:
+            parameter = self.SystemMemory.Parameters.GetById(p['name'])
+            if parameter is not None:
+                parameter.set_from_string(p['value'])
+        if configure_device:
+            self.ConfigureDevice()
+        if write_manufacturer_data and 'scratchmemory' in param_json:
+            values = [int(v, 16) for v in param_json['scratchmemory']['csvalues'].split(',')]
+            data = struct.pack('>' + 'I' * len(values), *values)
+            self.WriteManufacturerData(0, len(data), data)
+        if write_voice_alerts and 'voicealerts' in param_json:
+            data = b''.join(base64.b64decode(a['encodeddata']) for a in param_json['voicealerts'])
+            self.WriteVoiceAlert(len(data), data)
+
+    def ReadVoiceAlertsTotalMemory(self):
+        return self.Definition.VoiceAlertsTotalMemory
+
+    def WriteVoiceAlert(self, length, data):
+        # bytes is the only type the SDK binding is known to accept (not e.g. a memoryview)
+        if not isinstance(data, bytes):
+            raise TypeError(f"WriteVoiceAlert() expects bytes, not {type(data).__name__}")
+        latencies.wait('voice_alert_byte', length)
+        self.device.voice_alerts = bytes(data[:length])
+
+    def WriteManufacturerData(self, offset, length, data):
+        latencies.wait('manufacturer_data_byte', length)
+        device = self.device
+        device.manufacturer_data = device.manufacturer_data[:offset] + bytes(data[:length]) + \
+                                   device.manufacturer_data[offset + length:]
+
+    def ReadManufacturerData(self, offset, length):
+        latencies.wait('manufacturer_data_byte', length)
+        return self.device.manufacturer_data[offset:offset + length]
+
+
+class SimProductDescription:
+    def __init__(self, definition):
+        self.definition = definition
+
+    def CreateProduct(self):
+        return SimProduct(self.definition)
+
+
+class SimLibrary:
+    def __init__(self, library_path):
+        self.Path = library_path
+        self.Products = [SimProductDescription(_default_definition())]
+
+
+class SimProductManager:
+    Version = 0x1000000
+
+    def __init__(self):
+        latencies.wait('product_manager')
+
+    def CreateCommunicationInterface(self, programmer, side, settings):
+        return SimCommunicationInterface(programmer, side, settings)
+
+    def LoadLibraryFromFile(self, library_path):
+        latencies.wait('load_library')
+        return SimLibrary(library_path)
+
+
+@dataclass
+class DeviceInfo:
+    """Mirrors sd_sdk_python.sd_sdk.DeviceInfo, the snake_case copy of an sd.DeviceInfo"""
+    _info: object
+    library_id: int = 0
+    product_id: int = 0
+    chip_id: int = 0
+    chip_version: int = 0
+    hybrid_id: int = 0
+    firmware_id: str = ""
+    firmware_version: str = ""
+    serial_id: int = 0
+    valid: bool = False
+    locked: bool = False
+    radio_application_version: str = ""
+    radio_bootloader_version: str = ""
+    radio_soft_device_version: str = ""
+    hybrid_serial: int = 0
+    hybrid_revision: int = 0
+    hybrid_tester: int = 0
+
+    def __post_init__(self):
+        assert self._info is not None
+        self.library_id = self._info.LibraryId
+        self.product_id = self._info.ProductId
+        self.chip_id = self._info.ChipId
+        self.chip_version = self._info.ChipVersion
+        self.hybrid_id = self._info.HybridId
+        self.firmware_id = self._info.FirmwareId
+        self.firmware_version = self._info.FirmwareVersion
+        self.serial_id = self._info.SerialId
+        self.valid = self._info.IsValid
+        self.locked = self._info.ParameterLockState
+        self.radio_application_version = self._info.RadioApplicationVersion
+        self.radio_bootloader_version = self._info.RadioBootloaderVersion
+        self.radio_soft_device_version = self._info.RadioSoftDeviceVersion
+        self.hybrid_serial = self._info.HybridSerial
+        self.hybrid_revision = self._info.HybridRevision
+        self.hybrid_tester = self._info.HybridTester
+
+
+class SimEzairo:
+    """Mirrors the subset of sd_sdk_python.sd_sdk.Ezairo used by these scripts"""
+    def __init__(self, sd, interface, device_info, product):
+        self.sd = sd
+        self.interface = interface
+        self.device_info = device_info
+        self.product = product
+        if type(self.device_info) == self.sd.DeviceInfo:
+            # Like Ezairo.__post_init__(), so code reading the SDK's field names from it fails here too
+            self.device_info = DeviceInfo(self.device_info)
+
+    def load_param_file(self, param_file, configure_device=False, write_manufacturer_data=False, write_voice_alerts=False):
+        self.product.LoadParamFile(str(param_file), configure_device, write_manufacturer_data, write_voice_alerts)
+
+    def reset(self,):
+        self.product.ResetDevice()
+
+    def mute(self,):
+        self.product.MuteDevice(True)
+
+    def unmute(self,):
+        self.product.MuteDevice(False)
+
+    def set_input_signal_type(self, signal_type):
+        self.product.InputSignal = signal_type
+
+    def get_current_memory(self,):
+        return self.product.CurrentMemory
+
+    def set_current_memory(self, memory_number, read_parameters=False):
+        self.product.SwitchToMemory(memory_number)
+        if read_parameters:
+            self.product.ReadParameters(self.sd.kActiveMemory)
+
+    def find_parameter(self, memory_number, param_name):
+        return self.product._memory(memory_number).Parameters.GetById(param_name)
+
+    def get_parameter_value(self, memory_number, param_name):
+        param = self.find_parameter(memory_number, param_name)
+        return None if param is None else param.get()
+
+    def set_parameter_value(self, memory_number, param_name, value):
+        param = self.find_parameter(memory_number, param_name)
+        if param is not None:
+            param.set(value)
+
+    def restore_all_parameters(self,):
+        self.restore_system_parameters()
+        for i in range(len(self.product.Memories)):
+            self.restore_profile_parameters(i)
+
+    def restore_system_parameters(self,):
+        self.product.ReadParameters(self.sd.kSystemNvmMemory)
+
+    def restore_profile_parameters(self, memory):
+        self.product.ReadParameters(memory)
+
+    def burn_all_parameters(self,):
+        self.product.WriteParameters(self.sd.kSystemNvmMemory)
+        for i in range(len(self.product.Memories)):
+            self.product.WriteParameters(i)
+
+    def write_voice_alert_data(self, voice_alert_data):
+        self.product.WriteVoiceAlert(len(voice_alert_data), voice_alert_data)
+
+    def write_scratch_memory(self, scratch_memory):
+        scratch_data = struct.pack('>' + 'I' * len(scratch_memory), *scratch_memory)
+        self.product.WriteManufacturerData(0, len(scratch_data), scratch_data)
+
+    def read_scratch_memory(self,):
+        return self.product.ReadManufacturerData(0, self.product.Definition.ManufacturerDataAreaLength)
+
+
+_product_manager = None
+
+
+def _get_product_manager():
+    global _product_manager
+    with _lock:
+        if _product_manager is None:
+            _product_manager = SimProductManager()
+        return _product_manager
+
+
+def _corrupt_value(value):
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, float):
+        return value + 1.0
+    return value ^ 1
+
+
+def install(scale=None, sdk_root=None):
+    """Registers the simulated SDK in place of 'sd_sdk_python'"""
+    global write_error_rate
+
+    if scale is not None:
+        latencies.scale = scale
+    write_error_rate = float(os.environ.get('SD_SDK_SIM_WRITE_ERROR_RATE', write_error_rate))
+    for name, value in json.loads(os.environ.get('SD_SDK_SIM_LATENCIES', '{}')).items():
+        if not hasattr(latencies, name):
+            raise ValueError(f"Unknown simulated latency: {name}")
+        setattr(latencies, name, float(value))
+
+    sd = types.ModuleType('sd')
+    for name in dir(_SdConstants):
+        if name.startswith('k'):
+            setattr(sd, name, getattr(_SdConstants, name))
+    sd.DeviceInfo = SimDeviceInfo
+
+    package = types.ModuleType('sd_sdk_python')
+    package.__path__ = []
+    package.sd = sd
+    package.get_product_manager = _get_product_manager
+    package.simulated = True
+
+    sd_sdk = types.ModuleType('sd_sdk_python.sd_sdk')
+    sd_sdk.Ezairo = SimEzairo
+    package.sd_sdk = sd_sdk
+
+    sys.modules['sd'] = sd
+    sys.modules['sd_sdk_python'] = package
+    sys.modules['sd_sdk_python.sd_sdk'] = sd_sdk
+
+    # The scripts resolve the default .library path relative to the SDK root
+    os.environ.setdefault('SD_SDK_ROOT', str(sdk_root or Path(__file__).resolve().parent))
+    print(f"*** SIMULATED SDK (sim_sdk.py, latency scale {latencies.scale}): no real devices are programmed ***",
+          file=sys.stderr, flush=True)
+    return package
+
+
+def is_installed():
+    return getattr(sys.modules.get('sd_sdk_python'), 'simulated', False)
@@ -0,0 +1,113 @@
+"""
+Runs one worker per programmer slot in parallel, each in its own process (and therefore with
+its own SDK instance and communication interface).
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import time
+import traceback
+
+from cmd_line_args import get_programmer, get_side
+from metrics import start_metrics, stop_metrics, get_metrics_collector
+from tracing import start_tracing, stop_tracing, get_tracer
+
+
+@dataclass(frozen=True)
+class Slot:
+    programmer: str
+    side: str
+    interface_options: str = None
+
+    def __str__(self):
+        name = f"{self.programmer}/{self.side}"
+        return name if not self.interface_options else f"{name} ({self.interface_options})"
+
+
+def parse_slot(value):
+    """Parses a 'PROGRAMMER:SIDE[:INTERFACE_OPTIONS]' slot specification"""
+    parts = value.split(':', 2)
+    if len(parts) < 2:
+        raise ValueError(f"{value} is not of the form PROGRAMMER:SIDE[:INTERFACE_OPTIONS]")
+    programmer = {'CAA': 'CAA', 'DSP3': 'DSP3', 'PROMIRA': 'Promira'}.get(parts[0].upper(), parts[0])
+    # Validate the programmer and side
+    get_programmer(programmer)
+    get_side(parts[1])
+    return Slot(programmer, parts[1].lower(), parts[2] if len(parts) > 2 and parts[2] else None)
+
+
+@dataclass
+class SlotResult:
+    slot: Slot
+    success: bool
+    elapsed: float
+    detail: str = ""
+    trace_events: list = field(default_factory=list)
+    metric_observations: list = field(default_factory=list)
+
+
+def _run_slot(worker, slot, args, trace, metrics, simulate):
+    start = time.monotonic()
+    # Forked workers inherit the simulated SDK, spawned workers have to install it again
+    if simulate is not None:
+        import sim_sdk
+        if not sim_sdk.is_installed():
+            sim_sdk.install(scale=simulate)
+    if trace:
+        start_tracing()
+    if metrics:
+        start_metrics()
+    try:
+        detail = worker(slot, args)
+        result = SlotResult(slot, True, time.monotonic() - start, "" if detail is None else str(detail))
+    except Exception as e:
+        result = SlotResult(slot, False, time.monotonic() - start,
+                            ''.join(traceback.format_exception_only(type(e), e)).strip())
+    tracer = stop_tracing()
+    if tracer is not None:
+        result.trace_events = tracer.events
+    collector = stop_metrics()
+    if collector is not None:
+        result.metric_observations = collector.observations
+    return result
+
+
+def run_slots(worker, slots, args, max_workers=None, simulate=None):
+    """
+    Calls worker(slot, args) for every slot in a pool of processes. A failure in one slot
+    does not affect the others. With simulate (the --simulate latency scale), the workers use
+    the simulated SDK in sim_sdk.py. Returns the list of SlotResults (in slot order) and the
+    total elapsed time.
+    """
+    start = time.monotonic()
+    results = {}
+    tracer = get_tracer()
+    collector = get_metrics_collector()
+    with ProcessPoolExecutor(max_workers=max_workers or len(slots)) as executor:
+        futures = {executor.submit(_run_slot, worker, slot, args, tracer is not None,
+                                   collector is not None, simulate): slot for slot in slots}
+        for future in as_completed(futures):
+            slot = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. a crash in the SDK)
+                result = SlotResult(slot, False, time.monotonic() - start, f"Worker process failed: {e!r}")
+            print(f"[{result.slot}] {'done' if result.success else 'FAILED'} in {result.elapsed:.1f}s {result.detail}", flush=True)
+            if tracer is not None:
+                tracer.add_events(result.trace_events)
+            if collector is not None:
+                collector.add_observations(result.metric_observations)
+            results[slot] = result
+    return [results[slot] for slot in slots], time.monotonic() - start
+
+
+def print_summary(results, elapsed, unit_name="units"):
+    width = max([len(str(r.slot)) for r in results] + [4])
+    print()
+    print(f"{'Slot':<{width}}  {'Result':<6}  {'Time (s)':>8}  Detail")
+    for r in results:
+        print(f"{str(r.slot):<{width}}  {'OK' if r.success else 'FAILED':<6}  {r.elapsed:>8.1f}  {r.detail}")
+
+    succeeded = sum(1 for r in results if r.success)
+    per_hour = succeeded * 3600.0 / elapsed if elapsed > 0 else 0.0
+    print(f"\n{succeeded}/{len(results)} {unit_name} succeeded in {elapsed:.1f}s ({per_hour:.1f} {unit_name}/hour)")
@@ -1,44 +1,11 @@
-from pathlib import Path
-import os
-import json
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, add_library_arguments
+from common import create_communication_interface, connect_and_configure_device, load_product, restore_all_parameters
+from metrics import collect_metrics_to
+from tracing import trace_step, trace_to_file
 
-from cmd_line_args import get_programmer, get_side, get_command_line_parser, validate_file
-from common import create_communication_interface, connect_and_configure_device
 
-
-def main():
-    parser = get_command_line_parser()
-    parser.add_argument(
-        "--library-file",
-        action="store",
-        default=None,
-        help="Path to the .library file to use (if different than the product default)",
-        type=validate_file,
-    )
-    parser.add_argument(
-        "--product-index",
-        action="store",
-        default=0,
-        help="Index of the product in the library file",
-        type=int,
-    )
-
-    args = parser.parse_args()
-
-    interface = create_communication_interface(get_programmer(args.programmer),
-                                               get_side(args.side),
-                                               interface_options=args.interface_options,
-                                               verify_nvm_writes=args.verify_nvm_writes)
-
-    from sd_sdk_python import get_product_manager
-    product_manager = get_product_manager()
-    sdk_root = Path(os.environ['SD_SDK_ROOT'])
-    library_path = str(sdk_root / f"products/{args.product}.library") if args.library_file is None else str(args.library_file)
-    library = product_manager.LoadLibraryFromFile(library_path)
-    product = library.Products[args.product_index].CreateProduct()
-
-
-    configured_device = connect_and_configure_device(interface, product, args.product, upgrade_firmware=False)
+def inspect_device(interface, product, product_name, use_snapshot=False):
+    configured_device = connect_and_configure_device(interface, product, product_name, upgrade_firmware=False)
     print(configured_device.device_info)
     # Configure for a pure tone input signal
     configured_device.set_input_signal_type(configured_device.sd.kPureTone)
@@ -49,12 +16,45 @@ def main():
     print(f"Current memory: {configured_device.product.CurrentMemory}")
 
     # Sync all parameters from the device
-    configured_device.restore_all_parameters()
+    with trace_step('restore_all_parameters'):
+        if restore_all_parameters(configured_device, use_snapshot=use_snapshot):
+            print("Synced the parameters from the snapshot (only the system memory was read)")
 
     print(f"Current memory: {configured_device.product.CurrentMemory}")
 
     configured_device.product.CloseDevice()
 
 
+def main(argv=None):
+    parser = add_library_arguments(get_command_line_parser())
+    parser.add_argument(
+        "--use-snapshot",
+        action="store_true",
+        default=False, help="Sync the parameters from the device's cached snapshot when its system memory still "
+                            "matches, instead of reading every memory (and cache a snapshot of the device)"
+    )
+
+    args = parser.parse_args(argv)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None:
+        collect_metrics_to(args.metrics)
+
+    if args.daemon is not None:
+        from programming_daemon import submit_job, get_device_job_args
+        submit_job(args.daemon, 'inspect', use_snapshot=args.use_snapshot, **get_device_job_args(args))
+        return
+
+    interface = create_communication_interface(get_programmer(args.programmer),
+                                               get_side(args.side),
+                                               interface_options=args.interface_options,
+                                               verify_nvm_writes=args.verify_nvm_writes,
+                                               product_name=args.product)
+
+    product = load_product(args.product, args.library_file, args.product_index)
+
+    inspect_device(interface, product, args.product, use_snapshot=args.use_snapshot)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,123 @@
+"""
+Opt-in step timing. Wrap SDK calls in trace_step() and, when tracing has been started (the
+scripts' --trace option), every step is recorded as a Chrome trace / Perfetto "complete" event.
+Step listeners (e.g. the metrics in metrics.py) are called after every step as well, whether or
+not tracing has been started.
+"""
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.metadata = {}
+
+    def add_step(self, name, start, end, failed, args):
+        if failed:
+            args = dict(args, failed=True)
+        self.events.append({'name': name, 'cat': 'sd_sdk', 'ph': 'X',
+                            'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+    def add_events(self, events):
+        self.events.extend(events)
+
+    def write(self, path):
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms', 'otherData': self.metadata}, fp, indent=1)
+
+    def get_summary(self):
+        """Returns (name, count, total, mean, min, max) per step (in seconds), slowest total first"""
+        durations = {}
+        for event in self.events:
+            durations.setdefault(event['name'], []).append(event['dur'] / 1e6)
+        rows = [(name, len(d), sum(d), sum(d) / len(d), min(d), max(d)) for name, d in durations.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def print_summary(self):
+        rows = self.get_summary()
+        width = max([len(row[0]) for row in rows] + [4])
+        print(f"\n{'Step':<{width}}  {'Count':>5}  {'Total (s)':>9}  {'Mean (s)':>8}  {'Min (s)':>8}  {'Max (s)':>8}")
+        for name, count, total, mean, minimum, maximum in rows:
+            print(f"{name:<{width}}  {count:>5}  {total:>9.3f}  {mean:>8.3f}  {minimum:>8.3f}  {maximum:>8.3f}")
+
+
+_tracer = None
+_step_listeners = []
+# The metadata of the current run (e.g. the programmer and product), kept whether or not tracing is started
+_metadata = {}
+
+
+def start_tracing():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def trace_to_file(path):
+    """Starts tracing and writes the trace (and prints a summary) when the script exits"""
+    tracer = start_tracing()
+
+    def write_trace():
+        tracer.write(path)
+        tracer.print_summary()
+        print(f"Wrote trace to {path}")
+
+    atexit.register(write_trace)
+    return tracer
+
+
+def set_trace_metadata(**kwargs):
+    _metadata.update(kwargs)
+    if _tracer is not None:
+        _tracer.metadata.update(kwargs)
+
+
+def get_trace_metadata():
+    return _metadata
+
+
+def add_step_listener(listener):
+    """Calls listener(name, start, duration, failed, args) after every trace_step() (times are in seconds)"""
+    _step_listeners.append(listener)
+
+
+def remove_step_listener(listener):
+    if listener in _step_listeners:
+        _step_listeners.remove(listener)
+
+
+@contextmanager
+def trace_step(name, **args):
+    if _tracer is None and not _step_listeners:
+        yield
+        return
+
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        end = time.perf_counter()
+        if _tracer is not None:
+            _tracer.add_step(name, start, end, failed, args)
+        for listener in list(_step_listeners):
+            listener(name, start, end - start, failed, args)
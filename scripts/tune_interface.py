@@ -0,0 +1,260 @@
+"""
+Measures the detect time, parameter read/write throughput and error rate of a programmer with
+each candidate set of interface options, and saves the fastest reliable options to this
+station's cache. create_communication_interface() uses the saved options whenever no
+--interface-options are given.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import time
+
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, add_library_arguments
+from common import DeviceSession, create_communication_interface, load_product, get_parameter_value, \
+    set_parameter_value, save_tuned_interface_options, invalidate_device_snapshot
+from metrics import collect_metrics_to
+from tracing import trace_step, trace_to_file
+
+# The candidates tried (along with the SDK defaults) with --simulate when no --candidate is given.
+# 'speed=N' is an option of the simulated interfaces in sim_sdk.py: the options of a real
+# programmer are listed in its SDK documentation, so they must be given with --candidate.
+SIMULATED_CANDIDATES = {
+    'CAA': ['speed=800', 'speed=1600', 'speed=3200'],
+    'DSP3': ['speed=200', 'speed=800', 'speed=1600'],
+    'Promira': ['speed=800', 'speed=1600', 'speed=3200', 'speed=6400'],
+}
+
+
+@dataclass
+class TuningResult:
+    interface_options: str
+    # The candidate options (without the --interface-options they were appended to)
+    candidate: str = ''
+    parameters: int = 0
+    operations: int = 0
+    errors: int = 0
+    last_error: str = None
+    times: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def error_rate(self):
+        return 1.0 if self.operations == 0 else self.errors / self.operations
+
+    def mean_time(self, name):
+        times = self.times.get(name)
+        return sum(times) / len(times) if times else 0.0
+
+    def rate(self, name):
+        """The mean parameters per second of the 'read' or 'write' operations"""
+        mean_time = self.mean_time(name)
+        return self.parameters / mean_time if mean_time > 0 else 0.0
+
+    @property
+    def cycle_time(self):
+        """The mean time to detect the device and then read and write one memory"""
+        return self.mean_time('detect') + self.mean_time('read') + self.mean_time('write')
+
+    def measure(self, name, function, *args):
+        """Times one operation (a failed operation is counted as an error) and returns whether it succeeded"""
+        self.operations += 1
+        start = time.perf_counter()
+        try:
+            function(*args)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        self.times.setdefault(name, []).append(time.perf_counter() - start)
+        return True
+
+    def summary(self):
+        return dict(interface_options=self.interface_options, detect_time=self.mean_time('detect'),
+                    read_rate=self.rate('read'), write_rate=self.rate('write'), errors=self.errors,
+                    operations=self.operations)
+
+
+@contextmanager
+def connected_session(programmer, side, product, product_name, interface_options):
+    """Connects to the device with the given interface options (and closes the connection afterwards)"""
+    interface = create_communication_interface(programmer, side, interface_options=interface_options)
+    session = DeviceSession(interface, product, product_name)
+    try:
+        session.connect()
+        yield session
+    finally:
+        session.release()
+
+
+def get_memory_values(product, memory):
+    from sd_sdk_python import sd
+    return [get_parameter_value(sd, p) for p in product.Memories[memory].Parameters]
+
+
+def set_memory_values(product, memory, values):
+    from sd_sdk_python import sd
+    for p, value in zip(product.Memories[memory].Parameters, values):
+        set_parameter_value(sd, p, value)
+
+
+def read_reference_values(programmer, side, product, product_name, interface_options, memory):
+    """Reads the values of a memory with (known good) interface options, before any candidate is measured"""
+    with connected_session(programmer, side, product, product_name, interface_options):
+        product.ReadParameters(memory)
+        return get_memory_values(product, memory)
+
+
+def restore_memory(programmer, side, product, product_name, interface_options, memory, values, attempts=3):
+    """
+    Writes the reference values of a memory back with (known good) interface options and reads
+    them back, raising RuntimeError if the device still holds different values after all attempts
+    """
+    with trace_step('restore_memory', memory=memory):
+        with connected_session(programmer, side, product, product_name, interface_options):
+            for _ in range(attempts):
+                set_memory_values(product, memory, values)
+                product.WriteParameters(memory)
+                product.ReadParameters(memory)
+                if get_memory_values(product, memory) == values:
+                    return
+    raise RuntimeError(f"Memory {memory} could not be restored with {interface_options!r}, "
+                       f"reprogram the device before using it")
+
+
+def measure_interface_options(programmer, side, product, product_name, interface_options, reference_values,
+                              memory=0, iterations=5):
+    """
+    Connects with the given interface options and then repeatedly detects the device, reads a
+    memory and writes its reference values (read beforehand with known good options) back.
+    Every read is compared with the reference values, so a write or read that silently got the
+    wrong values is counted as an error too.
+    """
+    result = TuningResult(interface_options)
+    interface = create_communication_interface(programmer, side, interface_options=interface_options)
+    session = DeviceSession(interface, product, product_name)
+    if not result.measure('connect', session.connect):
+        return result
+
+    # The reference values are written back, but a failed write may have stored something else
+    invalidate_device_snapshot(product.DeviceMACAddress)
+    result.parameters = len(reference_values)
+    try:
+        for _ in range(iterations):
+            result.measure('detect', interface.DetectDevice)
+            if result.measure('read', product.ReadParameters, memory):
+                result.operations += 1
+                if get_memory_values(product, memory) != reference_values:
+                    result.errors += 1
+                    result.last_error = "The values read differ from the values on the device"
+            set_memory_values(product, memory, reference_values)
+            if result.measure('write', product.WriteParameters, memory) and \
+                    result.measure('read', product.ReadParameters, memory):
+                result.operations += 1
+                if get_memory_values(product, memory) != reference_values:
+                    result.errors += 1
+                    result.last_error = "The values read back differ from the values written"
+    finally:
+        session.release()
+    return result
+
+
+def print_results(results, best):
+    width = max(len(repr(r.interface_options)) for r in results)
+    print()
+    print(f"{'Interface options':<{width}}  {'Detect (ms)':>11}  {'Read (param/s)':>14}  {'Write (param/s)':>15}  "
+          f"{'Errors':>9}  {'Cycle (ms)':>10}")
+    for r in results:
+        marker = '  <- fastest reliable' if r is best else ''
+        print(f"{repr(r.interface_options):<{width}}  {r.mean_time('detect') * 1000:>11.1f}  {r.rate('read'):>14.0f}  "
+              f"{r.rate('write'):>15.0f}  {f'{r.errors}/{r.operations}':>9}  {r.cycle_time * 1000:>10.1f}{marker}")
+
+
+def main(argv=None):
+    parser = add_library_arguments(get_command_line_parser())
+    parser.add_argument(
+        "--candidate",
+        action="append",
+        default=None,
+        help="A set of interface options to measure (repeat for each candidate; the SDK defaults are always measured "
+             "too). See the SDK documentation of the programmer for its options. Required unless --simulate is given. "
+             "If --interface-options is given, it is prepended to every candidate (e.g. to select a unit), but only "
+             "the candidate is saved.",
+    )
+    parser.add_argument(
+        "--iterations",
+        action="store",
+        default=5,
+        help="How many times to detect the device and read and write a memory with each candidate",
+        type=int,
+    )
+    parser.add_argument(
+        "--memory",
+        action="store",
+        default=0,
+        help="The memory that is read and written back (it is restored with the SDK defaults if a write fails)",
+        type=int,
+        choices=range(8),
+    )
+    parser.add_argument(
+        "--max-error-rate",
+        action="store",
+        default=0.0,
+        help="The fraction of failed operations above which a candidate is not considered reliable",
+        type=float,
+    )
+    parser.add_argument(
+        "--no-save",
+        action="store_true",
+        default=False, help="Only report the results, without saving the fastest reliable options"
+    )
+    args = parser.parse_args(argv)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None:
+        collect_metrics_to(args.metrics)
+
+    if args.candidate is None and args.simulate is None:
+        parser.error("--candidate is required (the interface options depend on the programmer, see its SDK documentation)")
+
+    programmer = get_programmer(args.programmer)
+    side = get_side(args.side)
+    candidates = [''] + [c for c in args.candidate or SIMULATED_CANDIDATES[args.programmer] if c != '']
+    # The SDK defaults (with any --interface-options, e.g. to select a unit) are used to read and restore the memory
+    default_options = args.interface_options or ''
+
+    product = load_product(args.product, args.library_file, args.product_index)
+    reference_values = read_reference_values(programmer, side, product, args.product, default_options, args.memory)
+    results = []
+    for candidate in candidates:
+        interface_options = ','.join(filter(None, (args.interface_options, candidate)))
+        print(f"Measuring {interface_options!r}...", flush=True)
+        with trace_step('measure_interface_options', interface_options=interface_options):
+            result = measure_interface_options(programmer, side, product, args.product, interface_options,
+                                               reference_values, memory=args.memory, iterations=args.iterations)
+        result.candidate = candidate
+        if result.errors:
+            print(f"  {result.errors} error(s), the last one was: {result.last_error}")
+            print(f"  Restoring memory {args.memory} with {default_options!r}...", flush=True)
+            restore_memory(programmer, side, product, args.product, default_options, args.memory, reference_values)
+        results.append(result)
+
+    reliable = [r for r in results if r.operations > 0 and r.error_rate <= args.max_error_rate]
+    best = min(reliable, key=lambda r: r.cycle_time) if reliable else None
+    print_results(results, best)
+    if best is None:
+        print(f"\nNone of the candidates were reliable on {args.programmer} with {args.product}, nothing was saved")
+        raise SystemExit(1)
+
+    if args.no_save:
+        print(f"\nThe fastest reliable interface options are {best.candidate!r}")
+        return
+    # Without the --interface-options, as they are used for every slot without interface options
+    path = save_tuned_interface_options(programmer, args.product, best.candidate,
+                                        tuned=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                                        cycle_time=best.cycle_time,
+                                        results=[r.summary() for r in results])
+    print(f"\nSaved {best.candidate!r} for {args.programmer} with {args.product} to {path}")
+    print("It is used whenever --interface-options is not given")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+from cmd_line_args import get_programmer, get_side, get_command_line_parser, add_library_arguments
+from common import create_communication_interface, load_product, update_device_firmware
+from metrics import collect_metrics_to
+from station import Slot, parse_slot, run_slots, print_summary
+from tracing import trace_step, trace_to_file
+
+
+def upgrade_slot(slot, args):
+    interface = create_communication_interface(get_programmer(slot.programmer),
+                                               get_side(slot.side),
+                                               interface_options=slot.interface_options,
+                                               verify_nvm_writes=args.verify_nvm_writes,
+                                               product_name=args.product)
+    product = load_product(args.product, args.library_file, args.product_index)
+
+    with trace_step('detect_device'):
+        device_info = interface.DetectDevice()
+    if device_info is None or not device_info.IsValid:
+        raise RuntimeError("No device detected")
+
+    with trace_step('firmware_compatibility_check'):
+        compatibility = product.Definition.GetDeviceCompatibility(interface)
+    old_versions = f"{device_info.FirmwareVersion}/{device_info.RadioApplicationVersion}"
+    device_info, upgraded = update_device_firmware(interface, product, device_info, compatibility,
+                                                   reboot_timeout=args.reboot_timeout)
+    if device_info.FirmwareId != args.product:
+        raise RuntimeError(f"Expected a {args.product} device but found {device_info.FirmwareId}")
+
+    new_versions = f"{device_info.FirmwareVersion}/{device_info.RadioApplicationVersion}"
+    return f"Upgraded {old_versions} -> {new_versions}" if upgraded else f"Already up to date ({old_versions})"
+
+
+def main(argv=None):
+    parser = add_library_arguments(get_command_line_parser(),
+                                   help="Path to the .library file with the firmware to upgrade to "
+                                        "(if different than the product default)")
+    parser.add_argument(
+        "--slot",
+        action="append",
+        default=None,
+        help="A programmer slot of the form PROGRAMMER:SIDE[:INTERFACE_OPTIONS] (repeat for each attached device; "
+             "default is the single slot given by --programmer/--side/--interface-options)",
+        type=parse_slot,
+    )
+    parser.add_argument(
+        "--max-workers",
+        action="store",
+        default=None,
+        help="Maximum number of slots to upgrade at the same time (default is all of them)",
+        type=int,
+    )
+    parser.add_argument(
+        "--reboot-timeout",
+        action="store",
+        default=60.0,
+        help="How long to wait (in seconds) for a device to come back after the upgrade before giving up",
+        type=float,
+    )
+    args = parser.parse_args(argv)
+    if args.trace is not None:
+        trace_to_file(args.trace)
+    if args.metrics is not None:
+        collect_metrics_to(args.metrics)
+
+    slots = args.slot or [Slot(args.programmer, args.side, args.interface_options)]
+    if len(set(slots)) != len(slots):
+        parser.error("Each --slot may only be given once")
+
+    definition = load_product(args.product, args.library_file, args.product_index).Definition
+    print(f"Upgrading {len(slots)} slot(s) to FW: {definition.UpdateFirmwareVersion}, Radio: {definition.UpdateRadioApplicationVersion}")
+    results, elapsed = run_slots(upgrade_slot, slots, args, max_workers=args.max_workers,
+                                 simulate=args.simulate)
+    print_summary(results, elapsed, unit_name="devices")
+    if not all(r.success for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
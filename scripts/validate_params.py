@@ -0,0 +1,175 @@
+"""
+Validates .param files against the parameters of a product definition (existence, type and
+range of every entry), so a bad file is reported before any device is touched.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+import time
+
+from cmd_line_args import get_command_line_parser, add_library_arguments
+from common import load_product
+from param_file import SYSTEM_MEMORY, TYPE_INTEGER, TYPE_BOOLEAN, TYPE_DOUBLE, load_compiled_param_file, read_param_header, \
+    apply_overrides
+
+# The number of problems listed in the error raised by check_param_file()
+MAX_REPORTED_PROBLEMS = 20
+
+TYPE_NAMES = {TYPE_INTEGER: 'an integer', TYPE_BOOLEAN: 'a boolean', TYPE_DOUBLE: 'a double'}
+
+# The .param value types that can be loaded into each type of parameter
+COMPATIBLE_TYPES = {
+    TYPE_INTEGER: (TYPE_INTEGER,),
+    TYPE_BOOLEAN: (TYPE_BOOLEAN,),
+    TYPE_DOUBLE: (TYPE_DOUBLE, TYPE_INTEGER),
+}
+
+# {id(product): (product, index)}, the product is kept so that its id can't be reused by another product
+_parameter_indexes = {}
+
+
+@dataclass(frozen=True)
+class ParameterSpec:
+    type: int
+    minimum: float
+    maximum: float
+
+
+def _get_parameter_spec(sd, param):
+    if param.Type == sd.kBoolean:
+        return ParameterSpec(TYPE_BOOLEAN, 0, 1)
+    if param.Type == sd.kDouble:
+        return ParameterSpec(TYPE_DOUBLE, param.DoubleMin, param.DoubleMax)
+    return ParameterSpec(TYPE_INTEGER, param.Min, param.Max)
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def get_parameter_index(product):
+    """
+    Returns {memory: {name: ParameterSpec}} (memory is SYSTEM_MEMORY or a memory index) for a
+    product. The index is built once per product object (a product reloaded from a different
+    .library, e.g. by the daemon, gets a new index) and then reused.
+    """
+    from sd_sdk_python import sd
+
+    known = _parameter_indexes.get(id(product))
+    if known is not None and known[0] is product:
+        return known[1]
+    index = {SYSTEM_MEMORY: {p.Id: _get_parameter_spec(sd, p) for p in product.SystemMemory.Parameters}}
+    for i in range(len(product.Memories)):
+        index[i] = {p.Id: _get_parameter_spec(sd, p) for p in product.Memories[i].Parameters}
+    _parameter_indexes[id(product)] = (product, index)
+    return index
+
+
+def validate_compiled_param_file(compiled_param_file, parameter_index):
+    """
+    Returns the lists of problems and warnings found in a CompiledParamFile. Parameters that are
+    missing from the file are only warnings, as loading it leaves them at their current values.
+    """
+    problems = []
+    warnings = []
+    names = compiled_param_file.names
+    for memory in compiled_param_file.all_memories():
+        specs = parameter_index.get(memory.id)
+        if specs is None:
+            problems.append(f"{memory.id}: unknown memory")
+            continue
+        found = set()
+        for name_index, value_type, value in zip(memory.name_indexes, memory.types, memory.values):
+            name = names[name_index]
+            found.add(name)
+            spec = specs.get(name)
+            if spec is None:
+                problems.append(f"{memory.id}:{name}: unknown parameter")
+            elif value_type not in COMPATIBLE_TYPES[spec.type]:
+                problems.append(f"{memory.id}:{name}: expected {TYPE_NAMES[spec.type]} value but found {TYPE_NAMES[value_type]}")
+            elif spec.type != TYPE_BOOLEAN and not spec.minimum <= value <= spec.maximum:
+                problems.append(f"{memory.id}:{name}: {_format_number(value)} is out of range "
+                                f"[{_format_number(spec.minimum)}, {_format_number(spec.maximum)}]")
+        missing = [name for name in specs if name not in found]
+        if missing:
+            warnings.append(f"{memory.id}: {len(missing)} parameter(s) missing from the .param file ({', '.join(missing[:5])}"
+                            f"{', ...' if len(missing) > 5 else ''})")
+    return problems, warnings
+
+
+def validate_param_file(param_file, product, overrides=None):
+    """
+    Returns the lists of problems and warnings found in a .param file (with any parameter
+    `overrides` applied, see param_file.apply_overrides()) for the given product
+    """
+    header = read_param_header(param_file)
+    if header.get('libraryid') != product.Definition.LibraryId:
+        return [f"the library ID ({header.get('libraryid')}) does not match the product library ({product.Definition.LibraryId})"], []
+    compiled_param_file = load_compiled_param_file(param_file)
+    if overrides:
+        compiled_param_file = apply_overrides(compiled_param_file, overrides)
+    return validate_compiled_param_file(compiled_param_file, get_parameter_index(product))
+
+
+def check_param_file(param_file, product, overrides=None):
+    """Prints the warnings and raises ValueError listing the problems in a .param file (if there are any)"""
+    problems, warnings = validate_param_file(param_file, product, overrides)
+    for warning in warnings:
+        print(f"Warning: {param_file}: {warning}")
+    if problems:
+        listed = problems[:MAX_REPORTED_PROBLEMS]
+        if len(problems) > len(listed):
+            listed.append(f"... and {len(problems) - len(listed)} more")
+        raise ValueError(f"{param_file} has {len(problems)} problem(s):\n  " + "\n  ".join(listed))
+
+
+def find_param_files(paths):
+    for path in paths:
+        if path.is_dir():
+            yield from sorted(path.rglob('*.param'))
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = get_command_line_parser()
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=[Path(__file__).resolve().parent.parent / 'configs'],
+        help="The .param files (or folders of .param files) to validate (default is configs/)",
+        type=Path,
+    )
+    add_library_arguments(parser)
+    args = parser.parse_args(argv)
+    for path in args.paths:
+        if not path.exists():
+            parser.error(f"{path} does not exist")
+
+    product = load_product(args.product, args.library_file, args.product_index)
+    start = time.perf_counter()
+    get_parameter_index(product)
+    print(f"Indexed the {args.product} parameters in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    failed = 0
+    param_files = list(find_param_files(args.paths))
+    for param_file in param_files:
+        start = time.perf_counter()
+        problems, warnings = validate_param_file(param_file, product)
+        elapsed = (time.perf_counter() - start) * 1000
+        if problems:
+            failed += 1
+            print(f"{param_file}: {len(problems)} problem(s) ({elapsed:.1f} ms)")
+            for problem in problems:
+                print(f"  {problem}")
+        else:
+            print(f"{param_file}: OK ({elapsed:.1f} ms)")
+        for warning in warnings:
+            print(f"  Warning: {warning}")
+
+    print(f"\n{len(param_files) - failed}/{len(param_files)} .param file(s) are valid")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()